@@ -0,0 +1,171 @@
+"""
+Batch pre-processing of audience rows before they are exported to the CSV file:
+addresses are normalized and validated column by column, and duplicate endpoints
+are removed across all the channels.
+"""
+
+import re
+from hashlib import blake2b
+from itertools import compress, islice
+from operator import itemgetter
+
+from ..endpoint_store.endpoint_store import EndpointStore
+
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+                           r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}")
+E164_PATTERN = re.compile(r'\+[1-9][0-9]{6,14}')
+PHONE_SEPARATORS = str.maketrans('', '', ' -().\t')
+
+
+class AudienceCleaner:
+    """
+    Usage:
+        cleaner = AudienceCleaner(default_country_code='+91')
+        cleaned, report = cleaner.clean(csv_file_fields, {'EMAIL': email_rows, 'SMS': sms_rows})
+    """
+
+    REJECTION_REASONS = ('INVALID_EMAIL', 'INVALID_PHONE', 'UNKNOWN_CHANNEL', 'DUPLICATE')
+
+
+    def __init__(self,
+                 default_country_code=None,
+                 batch_size=65536,
+                 max_samples=10):
+        """
+        param: default_country_code: Prefixed to phone numbers without an international code, eg '+91'.
+                                     Such numbers are rejected if it is not given.
+
+        param: batch_size:           Number of rows processed together
+
+        param: max_samples:          Number of rejected addresses kept per reason in the report
+        """
+        self.default_country_code = default_country_code
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+
+
+    def clean(self,
+              csv_file_fields,
+              channel_rows):
+        """
+        Returns (cleaned, report). cleaned has the valid, de-duplicated rows of every channel with
+        normalized addresses, in the same format as given (list of lists, or EndpointStore). Duplicates
+        are found across all the channels, using ChannelType and the normalized Address. report is
+        {
+            'Input': 123,
+            'Output': 123,
+            'Rejected': {'INVALID_EMAIL': 123, 'INVALID_PHONE': 123, 'UNKNOWN_CHANNEL': 123, 'DUPLICATE': 123},
+            'Samples': {'INVALID_EMAIL': ['address', ...], ...}
+        }
+
+        param: csv_file_fields: Fields of the rows, should contain ChannelType and Address
+
+        param: channel_rows:    Dictionary of channel -> rows, eg {'EMAIL': email_data, 'SMS': sms_data}.
+                                Rows are lists, or dictionaries keyed by csv_file_fields, or an EndpointStore.
+        """
+        assert 'ChannelType' in csv_file_fields and 'Address' in csv_file_fields, \
+            'csv_file_fields should contain ChannelType and Address'
+        report = {
+            'Input': 0,
+            'Output': 0,
+            'Rejected': dict.fromkeys(self.REJECTION_REASONS, 0),
+            'Samples': {reason: [] for reason in self.REJECTION_REASONS}
+        }
+        seen = set()
+        cleaned = {}
+        for channel, rows in channel_rows.items():
+            if rows is None:
+                continue
+            cleaned_rows = []
+            for batch in self.__batches(csv_file_fields, rows):
+                cleaned_rows.extend(self.__clean_batch(csv_file_fields, batch, seen, report))
+            cleaned[channel] = EndpointStore.from_rows(csv_file_fields, cleaned_rows) \
+                if isinstance(rows, EndpointStore) else cleaned_rows
+        return cleaned, report
+
+
+    def __batches(self,
+                  csv_file_fields,
+                  rows):
+        """
+        Private method. Yields lists of rows as lists in the order of csv_file_fields
+        """
+        if isinstance(rows, EndpointStore):
+            rows = rows.select(csv_file_fields)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            if isinstance(batch[0], dict):
+                batch = [[row[field] for field in csv_file_fields] for row in batch]
+            yield batch
+
+
+    def __clean_batch(self,
+                      csv_file_fields,
+                      batch,
+                      seen,
+                      report):
+        """
+        Private method. Normalizes, validates and de-duplicates a batch, column by column
+        """
+        channel_position = csv_file_fields.index('ChannelType')
+        address_position = csv_file_fields.index('Address')
+        # Missing or non string channels become '', and are rejected as UNKNOWN_CHANNEL
+        channels = [channel.strip().upper() if isinstance(channel, str) else ''
+                    for channel in map(itemgetter(channel_position), batch)]
+        addresses = ['' if address is None else str(address).strip()
+                     for address in map(itemgetter(address_position), batch)]
+        report['Input'] += len(batch)
+
+        email_mask = [channel == 'EMAIL' for channel in channels]
+        sms_mask = [channel == 'SMS' for channel in channels]
+
+        emails = list(map(str.lower, compress(addresses, email_mask)))
+        email_valid = list(map(bool, map(EMAIL_PATTERN.fullmatch, emails)))
+
+        phones = list(map(self.__normalize_phone, compress(addresses, sms_mask)))
+        phone_valid = list(map(bool, map(E164_PATTERN.fullmatch, phones)))
+
+        emails, email_valid = iter(emails), iter(email_valid)
+        phones, phone_valid = iter(phones), iter(phone_valid)
+        cleaned_rows = []
+        for row, channel, address, is_email, is_sms in zip(batch, channels, addresses, email_mask, sms_mask):
+            if is_email:
+                address, valid, reason = next(emails), next(email_valid), 'INVALID_EMAIL'
+            elif is_sms:
+                address, valid, reason = next(phones), next(phone_valid), 'INVALID_PHONE'
+            else:
+                valid, reason = False, 'UNKNOWN_CHANNEL'
+
+            if valid:
+                key = blake2b(f'{channel}:{address}'.encode('utf-8'), digest_size=8).digest()
+                if key in seen:
+                    valid, reason = False, 'DUPLICATE'
+                else:
+                    seen.add(key)
+
+            if not valid:
+                report['Rejected'][reason] += 1
+                if len(report['Samples'][reason]) < self.max_samples:
+                    report['Samples'][reason].append(address)
+                continue
+
+            row = list(row)
+            row[channel_position] = channel
+            row[address_position] = address
+            cleaned_rows.append(row)
+
+        report['Output'] += len(cleaned_rows)
+        return cleaned_rows
+
+
+    def __normalize_phone(self,
+                          phone):
+        phone = phone.translate(PHONE_SEPARATORS)
+        if phone.startswith('00'):
+            return '+' + phone[2:]
+        if not phone.startswith('+') and self.default_country_code:
+            return self.default_country_code + phone.lstrip('0')
+        return phone
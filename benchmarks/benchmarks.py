@@ -0,0 +1,521 @@
+"""
+Offline benchmarks of the hot paths of PinpointCampaignBuilder: data conversion, CSV
+creation and upload, bulk and single sends, KPI fetching and import job polling.
+AWS clients are replaced by stub clients which answer instantly (or after a fixed
+latency) and count every call, so runs are reproducible and need no credentials.
+The stubs are plain objects, not botocore clients: they have no event hooks, so the
+throttle listener of ThrottledClient and ClientMetrics are not exercised, and the
+overhead of botocore (serialization, retries) is not measured.
+
+Usage:
+    python -m aws_pinpoint_campaign_builder.benchmarks.benchmarks --sizes 1000 100000 --save baseline.json
+    python -m aws_pinpoint_campaign_builder.benchmarks.benchmarks --sizes 1000 100000 --compare baseline.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+from itertools import islice
+
+from ..client_factory import client_factory
+from ..job_waiter.job_waiter import JobWaiter
+from ..pinpoint_campaign_builder import PinpointCampaignBuilder
+
+
+SIZES = (1000, 10000, 100000, 1000000, 10000000)
+DEFAULT_SIZES = (1000, 10000, 100000)
+FIELDS = ['ChannelType', 'Address', 'Attributes.Name', 'Attributes.City', 'User.UserId']
+CITIES = ['Pune', 'Delhi', 'Mumbai', 'Seattle', 'Berlin', 'Tokyo', 'Lagos', 'Lima']
+REGION = 'us-east-1'
+BUCKET = 'benchmark-bucket'
+
+
+class StubClient:
+    """
+    Base of the stub clients. Counts the calls per operation and optionally sleeps for a
+    fixed latency in every call, to mimic the round trip of a real client.
+    """
+
+
+    def __init__(self,
+                 latency=0.0):
+        self.latency = latency
+        self.call_counts = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+
+    def _record(self,
+                operation,
+                payload_size=0):
+        with self._lock:
+            self.call_counts[operation] += 1
+            self.bytes_sent += payload_size
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class StubPinpointClient(StubClient):
+    """
+    Stub of the pinpoint client, answering the operations used by the builder
+    """
+
+
+    def __init__(self,
+                 latency=0.0,
+                 polls_till_complete=2):
+        """
+        param: polls_till_complete: Number of get_import_job calls answered with IN_PROGRESS before COMPLETED
+        """
+        super().__init__(latency)
+        self.polls_till_complete = polls_till_complete
+        self._polls = Counter()
+        self._job_ids = iter(range(1, sys.maxsize))
+
+
+    def create_app(self, **request):
+        self._record('create_app')
+        return {'ApplicationResponse': {'Id': 'benchmark-app', 'Name': request['CreateApplicationRequest']['Name']}}
+
+
+    def update_email_channel(self, **request):
+        self._record('update_email_channel')
+        return {'EmailChannelResponse': {'Enabled': True}}
+
+
+    def update_sms_channel(self, **request):
+        self._record('update_sms_channel')
+        return {'SMSChannelResponse': {'Enabled': True}}
+
+
+    def send_messages(self, **request):
+        addresses = request['MessageRequest']['Addresses']
+        self._record('send_messages')
+        return {'MessageResponse': {'Result': {
+            address: {'DeliveryStatus': 'SUCCESSFUL', 'MessageId': address, 'StatusCode': 200}
+            for address in addresses
+        }}}
+
+
+    def create_import_job(self, **request):
+        self._record('create_import_job')
+        with self._lock:
+            job_id = f'job-{next(self._job_ids)}'
+        return {'ImportJobResponse': {'Id': job_id, 'JobStatus': 'CREATED'}}
+
+
+    def get_import_job(self, **request):
+        self._record('get_import_job')
+        job_id = request['JobId']
+        with self._lock:
+            self._polls[job_id] += 1
+            completed = self._polls[job_id] > self.polls_till_complete
+        return {'ImportJobResponse': {
+            'Id': job_id,
+            'JobStatus': 'COMPLETED' if completed else 'IN_PROGRESS',
+            'Definition': {'SegmentId': f'segment-{job_id}'},
+            'TotalProcessed': 0,
+            'TotalFailures': 0
+        }}
+
+
+    def get_campaigns(self, **request):
+        self._record('get_campaigns')
+        return {'CampaignsResponse': {'Item': [{'Id': 'campaign-1', 'Name': 'Benchmark campaign'}]}}
+
+
+    def get_campaign(self, **request):
+        self._record('get_campaign')
+        return {'CampaignResponse': {'Id': request['CampaignId'], 'Name': 'Benchmark campaign'}}
+
+
+    def get_application_date_range_kpi(self, **request):
+        self._record('get_application_date_range_kpi')
+        kpi_name = request['KpiName']
+        if kpi_name.endswith('grouped-by-date'):
+            rows = [{'GroupedBys': [{'Value': f'2020-01-{day:02d}'}], 'Values': [{'Value': '0.95'}]}
+                    for day in range(1, 31)]
+        elif kpi_name.endswith('grouped-by-campaign'):
+            rows = [{'GroupedBys': [{'Value': 'campaign-1'}], 'Values': [{'Value': '0.5'}]}]
+        else:
+            rows = [{'Values': [{'Value': '0.75'}]}]
+        return {'ApplicationDateRangeKpiResponse': {'KpiResult': {'Rows': rows}}}
+
+
+class StubS3Client(StubClient):
+    """
+    Stub of the s3 client. Uploaded data is counted and dropped.
+    """
+
+
+    def put_object(self, **request):
+        self._record('put_object', len(request['Body']))
+        return {'ETag': '"benchmark"'}
+
+
+    def upload_file(self, local_file_name, bucket_name, file_name, **kwargs):
+        self._record('upload_file', os.path.getsize(local_file_name))
+
+
+    def create_multipart_upload(self, **request):
+        self._record('create_multipart_upload')
+        return {'UploadId': 'benchmark-upload'}
+
+
+    def upload_part(self, **request):
+        self._record('upload_part', len(request['Body']))
+        return {'ETag': f'"part-{request["PartNumber"]}"'}
+
+
+    def complete_multipart_upload(self, **request):
+        self._record('complete_multipart_upload')
+        return {}
+
+
+    def abort_multipart_upload(self, **request):
+        self._record('abort_multipart_upload')
+        return {}
+
+
+def synthetic_rows(channel_type,
+                   count,
+                   start=0):
+    """
+    Lazily yields count rows of a synthetic audience in the order of FIELDS
+    """
+    for index in range(start, start + count):
+        address = f'user{index}@example.com' if channel_type == 'EMAIL' else f'+1555{index:07d}'
+        yield [channel_type, address, f'User {index}', CITIES[index % len(CITIES)], f'user-{index}']
+
+
+def synthetic_dict_rows(channel_type,
+                        count,
+                        start=0):
+    """
+    Same as synthetic_rows, with every row as a dictionary keyed by FIELDS
+    """
+    return (dict(zip(FIELDS, row)) for row in synthetic_rows(channel_type, count, start))
+
+
+def create_builder(pinpoint_client,
+                   s3_client):
+    """
+    Returns a lazy builder whose clients are the stubs. Throttling is opened up, so that
+    the pacing of ThrottledClient does not hide the overhead being measured.
+    """
+    client_factory.register_client('pinpoint', pinpoint_client, region_name=REGION)
+    client_factory.register_client('s3', s3_client)
+    return PinpointCampaignBuilder(s3_bucket_name=BUCKET,
+                                   pinpoint_access_role_arn='arn:aws:iam::000000000000:role/benchmark',
+                                   ses_identity_arn='arn:aws:ses:us-east-1:000000000000:identity/bench@example.com',
+                                   region=REGION,
+                                   channel_type=['EMAIL', 'SMS'],
+                                   application_id='benchmark-app',
+                                   csv_file_fields=FIELDS,
+                                   throttle_config={'initial_rate': 1e9, 'min_rate': 1e9, 'max_rate': 1e9},
+                                   lazy=True)
+
+
+CASES = {}
+
+
+def benchmark_case(name,
+                   max_size=SIZES[-1]):
+    """
+    Registers a benchmark. The decorated function takes (builder, size, work_dir) and returns
+    a function which runs the measured work and returns the number of items processed. Work
+    done before returning that function is setup, and is not measured.
+    """
+    def register(setup):
+        CASES[name] = {'Setup': setup, 'MaxSize': max_size}
+        return setup
+    return register
+
+
+@benchmark_case('set_data_rows', max_size=1000000)
+def set_data_rows(builder, size, work_dir):
+    rows = list(synthetic_dict_rows('EMAIL', size))
+
+    def run():
+        builder.set_email_data(rows, csv_file_fields=FIELDS)
+        return len(builder.email_data)
+    return run
+
+
+@benchmark_case('set_data_columnar')
+def set_data_columnar(builder, size, work_dir):
+    def run():
+        builder.set_email_data(synthetic_rows('EMAIL', size), csv_file_fields=FIELDS, columnar=True)
+        return len(builder.email_data)
+    return run
+
+
+@benchmark_case('create_csv', max_size=1000000)
+def create_csv(builder, size, work_dir):
+    builder.set_email_data(list(synthetic_rows('EMAIL', size // 2)), csv_file_fields=FIELDS)
+    builder.set_sms_data(list(synthetic_rows('SMS', size - size // 2, size // 2)), csv_file_fields=FIELDS)
+
+    def run():
+        builder.create_csv(local_csv_file_name=os.path.join(work_dir, 'create_csv.csv'), upload_to_s3=True)
+        return size
+    return run
+
+
+@benchmark_case('create_csv_stream_s3')
+def create_csv_stream_s3(builder, size, work_dir):
+    def run():
+        builder.create_csv_stream(email_rows=synthetic_rows('EMAIL', size // 2),
+                                  sms_rows=synthetic_rows('SMS', size - size // 2, size // 2),
+                                  stream_to_s3=True)
+        return size
+    return run
+
+
+def create_channels(builder):
+    """
+    Creates the channel objects of the lazy builder, so that channel setup is not measured as send cost
+    """
+    builder.email_obj
+    builder.sms_obj
+
+
+@benchmark_case('send_bulk_txn_sms', max_size=1000000)
+def send_bulk_txn_sms(builder, size, work_dir):
+    numbers = [row[1] for row in synthetic_rows('SMS', size)]
+    create_channels(builder)
+    return lambda: len(builder.send_bulk_txn_sms(numbers, origination_number='+15550000000',
+                                                 message='Benchmark')['Results'])
+
+
+@benchmark_case('send_txn_sms', max_size=1000000)
+def send_txn_sms(builder, size, work_dir):
+    numbers = [row[1] for row in synthetic_rows('SMS', max(size // 100, 1))]
+    create_channels(builder)
+
+    def run():
+        # send_txn_sms prints the message id of every send, the output is dropped
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for number in numbers:
+                builder.send_txn_sms(origination_number='+15550000000', destination_number=number,
+                                     message='Benchmark')
+        return len(numbers)
+    return run
+
+
+@benchmark_case('send_txn_email', max_size=1000000)
+def send_txn_email(builder, size, work_dir):
+    addresses = [row[1] for row in synthetic_rows('EMAIL', max(size // 100, 1))]
+    create_channels(builder)
+
+    def run():
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            for address in addresses:
+                builder.send_txn_email(sender='bench@example.com', to_address=address, subject='Benchmark',
+                                       body_text='Benchmark', body_html='<p>Benchmark</p>')
+        return len(addresses)
+    return run
+
+
+@benchmark_case('get_application_analytics', max_size=1000000)
+def get_application_analytics(builder, size, work_dir):
+    repeats = max(size // 1000, 1)
+
+    def run():
+        for _ in range(repeats):
+            builder.get_application_analytics(use_cache=False)
+        return repeats
+    return run
+
+
+@benchmark_case('job_waiter_polling', max_size=1000000)
+def job_waiter_polling(builder, size, work_dir):
+    job_count = max(size // 1000, 1)
+    job_waiter = JobWaiter(builder.client_pinpoint, initial_delay=0.001, max_delay=0.01, jitter=0)
+    job_ids = [builder.client_pinpoint.create_import_job(ApplicationId=builder.application_id,
+                                                         ImportJobRequest={})['ImportJobResponse']['Id']
+               for _ in range(job_count)]
+
+    def run():
+        futures = [job_waiter.add(builder.application_id, job_id) for job_id in job_ids]
+        for future in futures:
+            future.result()
+        return job_count
+    return run
+
+
+def run_case(name,
+             size,
+             trace_memory=True,
+             latency=0.0):
+    """
+    Runs one benchmark with fresh stub clients. Returns
+    {
+        'Case': name, 'Size': size, 'Items': items processed, 'Seconds': float, 'ItemsPerSecond': float,
+        'PeakMemoryBytes': int, 'BytesUploaded': int, 'Calls': {'pinpoint.send_messages': int, ...}
+    }
+
+    param: trace_memory: True | False, if true peak memory is traced with tracemalloc. Tracing slows
+                         the run, so throughput is only comparable between runs with the same setting.
+
+    param: latency:      In seconds, latency added to every stub call
+    """
+    pinpoint_client, s3_client = StubPinpointClient(latency=latency), StubS3Client(latency=latency)
+    builder = create_builder(pinpoint_client, s3_client)
+    with tempfile.TemporaryDirectory() as work_dir:
+        run = CASES[name]['Setup'](builder, size, work_dir)
+        calls_before = {'pinpoint': Counter(pinpoint_client.call_counts), 's3': Counter(s3_client.call_counts)}
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        started_at = time.perf_counter()
+        try:
+            items = run()
+            seconds = time.perf_counter() - started_at
+            peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+    calls = {}
+    for service, client in (('pinpoint', pinpoint_client), ('s3', s3_client)):
+        for operation, count in (client.call_counts - calls_before[service]).items():
+            calls[f'{service}.{operation}'] = count
+
+    return {
+        'Case': name,
+        'Size': size,
+        'Items': items,
+        'Seconds': round(seconds, 6),
+        'ItemsPerSecond': round(items / seconds, 2) if seconds else None,
+        'PeakMemoryBytes': peak_memory,
+        'BytesUploaded': s3_client.bytes_sent,
+        'Calls': dict(sorted(calls.items()))
+    }
+
+
+def run_benchmarks(cases=None,
+                   sizes=DEFAULT_SIZES,
+                   trace_memory=True,
+                   latency=0.0,
+                   report=None):
+    """
+    Runs the cases for every size upto the max size of the case. Returns the list of results of run_case.
+
+    param: cases:  Names of the cases, all the cases if not given
+
+    param: report: Callable called with every result as soon as it is ready, eg print
+    """
+    results = []
+    for name in cases if cases else CASES:
+        assert name in CASES, f'Unknown benchmark {name}, available benchmarks are {list(CASES)}'
+        for size in sizes:
+            if size > CASES[name]['MaxSize']:
+                continue
+            result = run_case(name, size, trace_memory=trace_memory, latency=latency)
+            results.append(result)
+            if report:
+                report(result)
+    return results
+
+
+def save_baseline(results,
+                  file_name):
+    """
+    Stores results as a baseline JSON file
+    """
+    baseline = {
+        'Python': platform.python_version(),
+        'Platform': platform.platform(),
+        'CreatedAt': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'Results': results
+    }
+    with open(file_name, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+
+
+def load_baseline(file_name):
+    with open(file_name) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare_results(results,
+                    baseline,
+                    tolerance=0.2):
+    """
+    Compares results with a baseline. Returns a list of regressions as
+    {'Case', 'Size', 'Metric', 'Baseline', 'Current', 'Change'}. Throughput falling or peak memory
+    rising by more than tolerance (a fraction) is a regression, and so is any extra API call.
+    """
+    baseline_results = {(result['Case'], result['Size']): result for result in baseline['Results']}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result['Case'], result['Size']))
+        if not previous:
+            continue
+
+        checks = [('ItemsPerSecond', previous['ItemsPerSecond'], result['ItemsPerSecond'], -1),
+                  ('PeakMemoryBytes', previous['PeakMemoryBytes'], result['PeakMemoryBytes'], 1)]
+        for metric, old, new, direction in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                regressions.append({'Case': result['Case'], 'Size': result['Size'], 'Metric': metric,
+                                    'Baseline': old, 'Current': new, 'Change': round(change, 4)})
+
+        for operation in set(previous['Calls']) | set(result['Calls']):
+            old, new = previous['Calls'].get(operation, 0), result['Calls'].get(operation, 0)
+            if new > old:
+                regressions.append({'Case': result['Case'], 'Size': result['Size'], 'Metric': f'Calls.{operation}',
+                                    'Baseline': old, 'Current': new, 'Change': round((new - old) / old, 4) if old else None})
+    return regressions
+
+
+def format_result(result):
+    peak_memory = f'{result["PeakMemoryBytes"] / 1024 / 1024:10.1f} MiB' if result['PeakMemoryBytes'] is not None \
+                  else f'{"-":>14}'
+    calls = ', '.join(f'{operation}={count}' for operation, count in islice(result['Calls'].items(), 4))
+    return f'{result["Case"]:28} {result["Size"]:>10} {result["Seconds"]:10.3f}s ' \
+           f'{result["ItemsPerSecond"] or 0:14.1f}/s {peak_memory}  {calls}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of PinpointCampaignBuilder')
+    parser.add_argument('--cases', nargs='*', choices=list(CASES), help='Benchmarks to run, default all')
+    parser.add_argument('--sizes', nargs='*', type=int, default=list(DEFAULT_SIZES),
+                        help=f'Audience sizes, default {list(DEFAULT_SIZES)}. Up to {SIZES[-1]} is supported.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency added to every stub call')
+    parser.add_argument('--no-memory', action='store_true', help='Do not trace peak memory')
+    parser.add_argument('--save', help='Store the results as a baseline JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed change before a regression, default 0.2')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.cases, args.sizes, trace_memory=not args.no_memory, latency=args.latency,
+                             report=lambda result: print(format_result(result), flush=True))
+    if args.save:
+        save_baseline(results, args.save)
+        print(f'Baseline saved to {args.save}')
+
+    if args.compare:
+        regressions = compare_results(results, load_baseline(args.compare), tolerance=args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression["Case"]} {regression["Size"]} {regression["Metric"]}: '
+                  f'{regression["Baseline"]} -> {regression["Current"]} ({regression["Change"]})')
+        if regressions:
+            return 1
+        print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+
+class BulkSender:
+    """
+    Sends one message to many addresses, packing the addresses in batches of upto
+    MAX_ADDRESSES_PER_REQUEST per send_messages call, and sending the batches over a
+    bounded thread pool. Results are returned per address instead of being printed.
+    """
+
+    MAX_ADDRESSES_PER_REQUEST = 100
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 application_id,
+                 batch_size=MAX_ADDRESSES_PER_REQUEST,
+                 max_workers=8):
+        """
+        param: batch_size:  Number of addresses in one send_messages call, max 100
+
+        param: max_workers: Maximum number of send_messages calls in flight
+        """
+        assert 0 < batch_size <= self.MAX_ADDRESSES_PER_REQUEST, \
+            f'batch_size should be between 1 and {self.MAX_ADDRESSES_PER_REQUEST}'
+        self.client = client_for_pinpoint
+        self.application_id = application_id
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+
+    def send(self,
+             recipients,
+             channel_type,
+             message_configuration):
+        """
+        Sends message_configuration to all the recipients. Returns
+        {
+            'Results': {
+                'address': {'DeliveryStatus': 'SUCCESSFUL', 'MessageId': 'string', 'StatusCode': 200, ...}
+            },
+            'Failures': {
+                'address': {'DeliveryStatus': 'PERMANENT_FAILURE', 'StatusCode': 400, 'StatusMessage': 'string'}
+            },
+            'Duplicates': {'address': 1}    --> number of times the address was skipped
+        }
+        Addresses whose whole request failed (throttling etc.) are in Failures with the error code
+        as DeliveryStatus. Results are keyed by address, so an address is sent the message only once:
+        later occurrences of an address are not sent, and are counted in Duplicates.
+
+        param: recipients:  Iterable of addresses, or of dictionaries having 'Address' key and
+                            any other AddressConfiguration keys (BodyOverride, Substitutions ...)
+
+        param: channel_type: 'EMAIL' | 'SMS'
+
+        param: message_configuration: MessageConfiguration of send_messages request
+        """
+        result = {'Results': {}, 'Failures': {}, 'Duplicates': {}}
+        recipients = self.__unique_address_configurations(recipients, channel_type, result['Duplicates'])
+        batches = iter(lambda: dict(islice(recipients, self.batch_size)), {})
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = []
+            for addresses in batches:
+                in_flight.append((addresses, executor.submit(self.__send_batch, addresses, message_configuration)))
+                if len(in_flight) >= 2 * self.max_workers:
+                    self.__collect(result, *in_flight.pop(0))
+            for batch_result in in_flight:
+                self.__collect(result, *batch_result)
+        return result
+
+
+    def __unique_address_configurations(self,
+                                        recipients,
+                                        channel_type,
+                                        duplicates):
+        """
+        Private method. Yields (address, AddressConfiguration) of every recipient whose address was not
+        seen before, counting the skipped ones in duplicates
+        """
+        seen = set()
+        for recipient in recipients:
+            if isinstance(recipient, dict):
+                address_configuration = dict(recipient)
+                address = address_configuration.pop('Address')
+            else:
+                address, address_configuration = recipient, {}
+            if address in seen:
+                duplicates[address] = duplicates.get(address, 0) + 1
+                continue
+            seen.add(address)
+            address_configuration['ChannelType'] = channel_type
+            yield address, address_configuration
+
+
+    def __send_batch(self,
+                     addresses,
+                     message_configuration):
+        response = self.client.send_messages(
+            ApplicationId=self.application_id,
+            MessageRequest={
+                'Addresses': addresses,
+                'MessageConfiguration': message_configuration
+            }
+        )
+        return response['MessageResponse']['Result']
+
+
+    def __collect(self,
+                  result,
+                  addresses,
+                  future):
+        """
+        Private method. Adds the per address results of a batch into result
+        """
+        try:
+            batch_result = future.result()
+        except Exception as ex:
+            error = getattr(ex, 'response', {}).get('Error', {})
+            failure = {
+                'DeliveryStatus': error.get('Code', type(ex).__name__),
+                'StatusMessage': error.get('Message', str(ex))
+            }
+            result['Failures'].update((address, dict(failure)) for address in addresses)
+            return
+
+        for address, address_result in batch_result.items():
+            if address_result.get('DeliveryStatus') == 'SUCCESSFUL':
+                result['Results'][address] = address_result
+            else:
+                result['Failures'][address] = address_result
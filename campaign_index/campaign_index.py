@@ -0,0 +1,101 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+import threading
+
+
+class CampaignIndex:
+    """
+    Index of campaign id -> campaign name of an application. It is loaded once with
+    paginated get_campaigns calls, and then kept up to date incrementally: created
+    campaigns are added with add, and an unknown id is fetched with a single get_campaign.
+    """
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 application_id,
+                 page_size=100):
+        """
+        param: page_size: Number of campaigns fetched in one get_campaigns call
+        """
+        self.client = client_for_pinpoint
+        self.application_id = application_id
+        self.page_size = page_size
+        self.is_loaded = False
+        self._names = {}
+        self._lock = threading.Lock()
+
+
+    def refresh(self):
+        """
+        Loads the names of all the campaigns of the application, page by page
+        """
+        names = {}
+        next_token = None
+        while True:
+            request = {'ApplicationId': self.application_id, 'PageSize': str(self.page_size)}
+            if next_token:
+                request['Token'] = next_token
+            response = self.client.get_campaigns(**request)['CampaignsResponse']
+            names.update((campaign['Id'], campaign['Name']) for campaign in response.get('Item', []))
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+
+        with self._lock:
+            self._names.update(names)
+            self.is_loaded = True
+
+
+    def add(self,
+            campaign_response):
+        """
+        Adds a campaign to the index
+
+        param: campaign_response: CampaignResponse as returned by create_campaign, get_campaign etc.
+        """
+        with self._lock:
+            self._names[campaign_response['Id']] = campaign_response['Name']
+
+
+    def remove(self,
+               campaign_id):
+        """
+        Removes a deleted campaign from the index
+        """
+        with self._lock:
+            self._names.pop(campaign_id, None)
+
+
+    def get_name(self,
+                 campaign_id):
+        """
+        Returns the name of the campaign
+        """
+        return self.get_names([campaign_id])[campaign_id]
+
+
+    def get_names(self,
+                  campaign_ids):
+        """
+        Returns dictionary of campaign id -> name for all campaign_ids. The index is loaded if
+        more than one id is unknown, remaining unknown ids are fetched one by one.
+        """
+        missing_ids = [campaign_id for campaign_id in campaign_ids if campaign_id not in self._names]
+        if len(missing_ids) > 1 and not self.is_loaded:
+            self.refresh()
+            missing_ids = [campaign_id for campaign_id in missing_ids if campaign_id not in self._names]
+
+        for campaign_id in missing_ids:
+            response = self.client.get_campaign(
+                ApplicationId=self.application_id,
+                CampaignId=campaign_id
+            )
+            self.add(response['CampaignResponse'])
+
+        return {campaign_id: self._names[campaign_id] for campaign_id in campaign_ids}
+
+
+    def __len__(self):
+        return len(self._names)
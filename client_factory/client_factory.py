@@ -0,0 +1,166 @@
+"""
+Process wide factory of boto3 clients. One session is created per process and clients
+are cached per (service, region), so credential resolution, endpoint loading and TLS
+connections are shared by all the builders and s3_utility objects of the process.
+
+Usage:
+    client_factory.configure(max_pool_connections=50)
+    pinpoint_client = client_factory.get_client('pinpoint', region_name='us-east-1')
+"""
+
+import threading
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_resources = {}
+_listeners = []
+_config_args = {
+    'max_pool_connections': 50,
+    'tcp_keepalive': True,
+    'retries': {'max_attempts': 3, 'mode': 'standard'}
+}
+
+
+def configure(max_pool_connections=None,
+              tcp_keepalive=None,
+              retries=None,
+              **config_args):
+    """
+    Updates the botocore Config used for the clients. Already created clients are
+    discarded, so that new clients are created with the new config.
+
+    param: max_pool_connections: Maximum number of open connections of a client. Set it atleast
+                                 to the number of threads using the client.
+
+    param: tcp_keepalive:        True | False, use TCP keep-alive for the connections
+
+    param: retries:              Retry config of botocore, eg {'max_attempts': 3, 'mode': 'standard'}
+
+    param: config_args:          Any other argument of botocore.config.Config
+    """
+    with _lock:
+        if max_pool_connections is not None:
+            _config_args['max_pool_connections'] = max_pool_connections
+        if tcp_keepalive is not None:
+            _config_args['tcp_keepalive'] = tcp_keepalive
+        if retries is not None:
+            _config_args['retries'] = retries
+        _config_args.update(config_args)
+        _clients.clear()
+        _resources.clear()
+
+
+def get_session():
+    """
+    Returns the boto3 session of the process
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            # boto3 is imported only when the first client is needed, to keep imports cheap
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_region_name():
+    """
+    Returns the region of the session, i.e. the current region
+    """
+    return get_session().region_name
+
+
+def add_client_listener(listener):
+    """
+    Calls listener(service_name, client) for every client of the factory: the clients already
+    created, and the clients created later, including the ones created again after configure.
+    Adding the same listener again has no effect.
+    """
+    with _lock:
+        if listener in _listeners:
+            return
+        _listeners.append(listener)
+        clients = list(_clients.items())
+    for (service_name, _), client in clients:
+        listener(service_name, client)
+
+
+def remove_client_listener(listener):
+    """
+    Stops calling listener for the clients created later
+    """
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def _notify_listeners(service_name,
+                      client):
+    for listener in list(_listeners):
+        listener(service_name, client)
+
+
+def _botocore_config():
+    from botocore.config import Config
+    return Config(**_config_args)
+
+
+def get_client(service_name,
+               region_name=None):
+    """
+    Returns the shared client of the service for the region. boto3 clients are thread safe,
+    so the returned client can be used by all the threads of the process.
+    """
+    key = (service_name, region_name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = get_session().client(service_name, region_name=region_name,
+                                              config=_botocore_config())
+                _clients[key] = client
+                _notify_listeners(service_name, client)
+    return client
+
+
+def register_client(service_name,
+                    client,
+                    region_name=None):
+    """
+    Registers client as the shared client of the service for the region, so that get_client
+    returns it, eg a stubbed client for offline benchmarks
+    """
+    with _lock:
+        _clients[(service_name, region_name)] = client
+        _notify_listeners(service_name, client)
+
+
+def get_resource(service_name,
+                 region_name=None):
+    """
+    Returns the shared resource of the service for the region. Resources are not thread safe,
+    use them only from one thread, or use get_client instead.
+    """
+    key = (service_name, region_name)
+    resource = _resources.get(key)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(key)
+            if resource is None:
+                resource = get_session().resource(service_name, region_name=region_name,
+                                                  config=_botocore_config())
+                _resources[key] = resource
+    return resource
+
+
+def reset():
+    """
+    Discards the session and all the clients, eg after forking a process
+    """
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+        _resources.clear()
@@ -0,0 +1,295 @@
+"""
+Per operation metrics of AWS API calls, collected through the event hooks of botocore
+clients: latency histograms, errors, retries, throttles and payload sizes. Metrics can
+be exported as Prometheus text or as a JSON snapshot.
+
+Usage:
+    metrics = ClientMetrics()
+    metrics.attach(pinpoint_client)
+    ...
+    print(metrics.to_prometheus())
+
+or, for all the pinpoint and s3 clients of client_factory:
+    metrics = default_metrics()
+"""
+
+import json
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from ..client_factory import client_factory
+from ..throttled_client.throttled_client import ThrottledClient
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class OperationMetrics:
+    """
+    Metrics of one operation of one service
+    """
+
+
+    def __init__(self,
+                 buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+    def observe_latency(self,
+                        seconds):
+        self.calls += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+
+
+    def snapshot(self):
+        cumulative, total = {}, 0
+        for upper_bound, count in zip(list(self.buckets) + ['+Inf'], self.bucket_counts):
+            total += count
+            cumulative[str(upper_bound)] = total
+        return {
+            'Calls': self.calls,
+            'Errors': self.errors,
+            'Retries': self.retries,
+            'Throttles': self.throttles,
+            'LatencySum': round(self.latency_sum, 6),
+            'LatencyMax': round(self.latency_max, 6),
+            'LatencyAverage': round(self.latency_sum / self.calls, 6) if self.calls else None,
+            'LatencyBuckets': cumulative,
+            'RequestBytes': self.request_bytes,
+            'ResponseBytes': self.response_bytes
+        }
+
+
+class ClientMetrics:
+    """
+    Collects metrics of all the clients it is attached to. One object can be attached to
+    many clients, metrics are kept per (service, operation).
+    """
+
+    EVENTS = ('before-call', 'before-send', 'needs-retry', 'after-call', 'after-call-error')
+    PROMETHEUS_PREFIX = 'aws_pinpoint_campaign_builder_api'
+
+
+    def __init__(self,
+                 buckets=LATENCY_BUCKETS):
+        """
+        param: buckets: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._clients = weakref.WeakSet()
+        self._factory_services = set()
+
+
+    def attach(self,
+               client):
+        """
+        Registers the event handlers on a boto3 client (or a ThrottledClient). Attaching the
+        same client again has no effect.
+        """
+        if isinstance(client, ThrottledClient):
+            client = client.client
+        events = client.meta.events
+        handlers = {
+            'before-call': self._before_call,
+            'before-send': self._before_send,
+            'needs-retry': self._needs_retry,
+            'after-call': self._after_call,
+            'after-call-error': self._after_call_error
+        }
+        for event, handler in handlers.items():
+            events.register(f'{event}.*.*', handler, unique_id=f'client-metrics-{id(self)}-{event}')
+        self._clients.add(client)
+        return client
+
+
+    def detach(self,
+               client):
+        """
+        Removes the event handlers from the client
+        """
+        if isinstance(client, ThrottledClient):
+            client = client.client
+        for event in self.EVENTS:
+            client.meta.events.unregister(f'{event}.*.*', unique_id=f'client-metrics-{id(self)}-{event}')
+        self._clients.discard(client)
+
+
+    def attach_to_factory(self,
+                          services=('pinpoint', 's3')):
+        """
+        Attaches to the clients of client_factory for the services, when they are created. Clients
+        which already exist are attached now, clients created later (eg after client_factory.configure)
+        when they are created. Attaching again has no effect.
+        """
+        with self._lock:
+            self._factory_services.update(services)
+        client_factory.add_client_listener(self._on_factory_client)
+
+
+    def _on_factory_client(self, service_name, client):
+        if service_name in self._factory_services:
+            self.attach(client)
+
+
+    def close(self):
+        """
+        Stops attaching to new clients of client_factory, and removes the event handlers from all
+        the clients attached so far
+        """
+        client_factory.remove_client_listener(self._on_factory_client)
+        for client in list(self._clients):
+            self.detach(client)
+
+
+    def __operation(self,
+                    event_name):
+        """
+        Private method. Returns the OperationMetrics of the event, eg after-call.pinpoint.SendMessages
+        """
+        _, service, operation = event_name.split('.', 2)
+        key = (service, operation)
+        metrics = self._operations.get(key)
+        if metrics is None:
+            with self._lock:
+                metrics = self._operations.setdefault(key, OperationMetrics(self.buckets))
+        return metrics
+
+
+    def _before_call(self, event_name, context=None, **kwargs):
+        if context is not None:
+            context['client_metrics_started_at'] = time.perf_counter()
+
+
+    def _before_send(self, event_name, request=None, **kwargs):
+        size = request.headers.get('Content-Length') if request is not None else None
+        if size is None and request is not None and isinstance(request.body, (bytes, str)):
+            size = len(request.body)
+        if size:
+            metrics = self.__operation(event_name)
+            with self._lock:
+                metrics.request_bytes += int(size)
+
+
+    def _needs_retry(self, event_name, response=None, caught_exception=None, **kwargs):
+        if response is None:
+            return None
+        error_code = response[1].get('Error', {}).get('Code') if response[1] else None
+        if error_code in ThrottledClient.THROTTLING_ERRORS or response[0].status_code == 429:
+            metrics = self.__operation(event_name)
+            with self._lock:
+                metrics.throttles += 1
+        # Returning None leaves the retry decision to the retry handler of botocore
+        return None
+
+
+    def _after_call(self, event_name, http_response=None, parsed=None, context=None, **kwargs):
+        metrics = self.__operation(event_name)
+        started_at = context.get('client_metrics_started_at') if context else None
+        response_metadata = parsed.get('ResponseMetadata', {}) if parsed else {}
+        response_size = http_response.headers.get('Content-Length') if http_response is not None else None
+        with self._lock:
+            if started_at is not None:
+                metrics.observe_latency(time.perf_counter() - started_at)
+            else:
+                metrics.calls += 1
+            metrics.retries += response_metadata.get('RetryAttempts', 0)
+            if http_response is not None and http_response.status_code >= 400:
+                metrics.errors += 1
+            if response_size:
+                metrics.response_bytes += int(response_size)
+
+
+    def _after_call_error(self, event_name, exception=None, context=None, **kwargs):
+        metrics = self.__operation(event_name)
+        started_at = context.get('client_metrics_started_at') if context else None
+        with self._lock:
+            if started_at is not None:
+                metrics.observe_latency(time.perf_counter() - started_at)
+            else:
+                metrics.calls += 1
+            metrics.errors += 1
+
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+
+    def snapshot(self):
+        """
+        Returns {'service': {'Operation': {'Calls', 'Errors', 'Retries', 'Throttles', 'LatencyBuckets', ...}}}
+        """
+        with self._lock:
+            result = {}
+            for (service, operation), metrics in sorted(self._operations.items()):
+                result.setdefault(service, {})[operation] = metrics.snapshot()
+            return result
+
+
+    def to_json(self,
+                indent=None):
+        return json.dumps({'Timestamp': time.time(), 'Services': self.snapshot()}, indent=indent)
+
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        prefix = self.PROMETHEUS_PREFIX
+        counters = [('Calls', 'calls_total', 'Number of API calls'),
+                    ('Errors', 'errors_total', 'Number of API calls which failed'),
+                    ('Retries', 'retries_total', 'Number of retries made by botocore'),
+                    ('Throttles', 'throttles_total', 'Number of throttled attempts'),
+                    ('RequestBytes', 'request_bytes_total', 'Bytes sent in request bodies'),
+                    ('ResponseBytes', 'response_bytes_total', 'Bytes received in response bodies')]
+        snapshot = [(service, operation, metrics) for service, operations in self.snapshot().items()
+                    for operation, metrics in operations.items()]
+
+        lines = [f'# HELP {prefix}_latency_seconds Latency of API calls including retries',
+                 f'# TYPE {prefix}_latency_seconds histogram']
+        for service, operation, metrics in snapshot:
+            labels = f'service="{service}",operation="{operation}"'
+            for upper_bound, count in metrics['LatencyBuckets'].items():
+                lines.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{upper_bound}"}} {count}')
+            lines.append(f'{prefix}_latency_seconds_sum{{{labels}}} {metrics["LatencySum"]}')
+            lines.append(f'{prefix}_latency_seconds_count{{{labels}}} {metrics["LatencyBuckets"]["+Inf"]}')
+
+        for key, name, description in counters:
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            for service, operation, metrics in snapshot:
+                lines.append(f'{prefix}_{name}{{service="{service}",operation="{operation}"}} {metrics[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def default_metrics():
+    """
+    Returns the ClientMetrics of the process, attached to the pinpoint and s3 clients of client_factory.
+    Used by the builders created with metrics=True, so that the clients get one set of event handlers
+    however many builders are created.
+    """
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = ClientMetrics()
+            _default_metrics.attach_to_factory()
+        return _default_metrics
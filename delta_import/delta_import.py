@@ -0,0 +1,259 @@
+"""
+Fingerprints of previously imported endpoints, used to import only the rows which
+are new or changed since the last import, and to track the deleted ones.
+"""
+
+import gzip
+import heapq
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from functools import partial
+from hashlib import blake2b
+
+
+def _hash(text):
+    return int.from_bytes(blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class FingerprintIndex:
+    """
+    For every imported endpoint, an 8 byte hash of its key (Id if present, else ChannelType and
+    Address) and an 8 byte hash of its whole row, sorted by the key hash. Kept in memory as two
+    arrays of integers, 16 bytes per endpoint. Stored in s3 as two gzip files written in the same
+    order: {prefix}.bin.gz with the fixed width hashes, and {prefix}.keys.gz with one key per
+    line, which is streamed only to report the deleted endpoints.
+    """
+
+    KEY_SEPARATOR = '\x1f'
+    BLOCK_RECORDS = 65536
+
+
+    def __init__(self,
+                 key_hashes=None,
+                 fingerprints=None,
+                 s3_obj=None,
+                 prefix=None):
+        self.key_hashes = key_hashes if key_hashes is not None else array('Q')
+        self.fingerprints = fingerprints if fingerprints is not None else array('Q')
+        self._s3_obj = s3_obj
+        self._prefix = prefix
+
+
+    @classmethod
+    def load(cls,
+             s3_obj,
+             prefix):
+        """
+        Streams the index from s3, an empty index is returned if it is not present
+        """
+        index = cls(s3_obj=s3_obj, prefix=prefix)
+        stream = s3_obj.get_file_stream(f'{prefix}.bin.gz')
+        if stream is None:
+            return index
+        with gzip.GzipFile(fileobj=stream, mode='rb') as records:
+            for block in iter(partial(records.read, 16 * cls.BLOCK_RECORDS), b''):
+                values = array('Q', block)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                index.key_hashes.extend(values[0::2])
+                index.fingerprints.extend(values[1::2])
+        return index
+
+
+    def find(self,
+             key_hash):
+        """
+        Returns the position of key_hash in the index, None if it is not present
+        """
+        position = bisect_left(self.key_hashes, key_hash)
+        if position < len(self.key_hashes) and self.key_hashes[position] == key_hash:
+            return position
+        return None
+
+
+    def keys(self,
+             positions):
+        """
+        Yields the keys at positions (ascending), streamed from the keys file
+        """
+        stream = self._s3_obj.get_file_stream(f'{self._prefix}.keys.gz') if self._s3_obj else None
+        if stream is None:
+            return
+        wanted = iter(positions)
+        next_position = next(wanted, None)
+        with gzip.open(stream, 'rt', encoding='utf-8', newline='\n') as keys:
+            for position, key in enumerate(keys):
+                if next_position is None:
+                    break
+                if position == next_position:
+                    yield key[:-1]
+                    next_position = next(wanted, None)
+
+
+    def __len__(self):
+        return len(self.key_hashes)
+
+
+class FingerprintIndexWriter:
+    """
+    Collects the fingerprints of the current rows, and saves them as a FingerprintIndex. Entries
+    are sorted in runs of run_size entries spilled to temp files, which are merged in one streaming
+    pass while saving, so memory is bounded by run_size and not by the number of rows.
+    """
+
+
+    def __init__(self,
+                 run_size=1000000):
+        self.run_size = run_size
+        self._run = []
+        self._run_files = []
+
+
+    def add(self,
+            key_hash,
+            fingerprint,
+            key):
+        # Fixed width hex keeps the lines in the order of key_hash
+        self._run.append(f'{key_hash:016x}\t{fingerprint:016x}\t{key}\n')
+        if len(self._run) >= self.run_size:
+            self.__spill_run()
+
+
+    def __spill_run(self):
+        """
+        Private method. Writes the sorted current run to a temp file
+        """
+        self._run.sort()
+        run_file = tempfile.TemporaryFile('w+', encoding='utf-8', newline='\n')
+        run_file.writelines(self._run)
+        run_file.seek(0)
+        self._run_files.append(run_file)
+        self._run = []
+
+
+    def save(self,
+             s3_obj,
+             prefix,
+             part_size=8 * 1024 * 1024):
+        """
+        Merges the runs and streams the index to {prefix}.bin.gz and {prefix}.keys.gz in s3.
+        Of the rows having the same key, only one is kept.
+        """
+        self._run.sort()
+        block, previous_key_hash = array('Q'), None
+
+        def write_block(records):
+            if sys.byteorder == 'big':
+                block.byteswap()
+            records.write(block.tobytes())
+            del block[:]
+
+        try:
+            with s3_obj.open_multipart_writer(f'{prefix}.bin.gz', part_size=part_size) as records_file, \
+                    s3_obj.open_multipart_writer(f'{prefix}.keys.gz', part_size=part_size) as keys_file, \
+                    gzip.GzipFile(fileobj=records_file, mode='wb') as records, \
+                    gzip.open(keys_file, 'wt', encoding='utf-8', newline='\n') as keys:
+                for line in heapq.merge(self._run, *self._run_files):
+                    key_hash, fingerprint, key = line.split('\t', 2)
+                    if key_hash == previous_key_hash:
+                        continue
+                    previous_key_hash = key_hash
+                    block.append(int(key_hash, 16))
+                    block.append(int(fingerprint, 16))
+                    keys.write(key)
+                    if len(block) >= 2 * FingerprintIndex.BLOCK_RECORDS:
+                        write_block(records)
+                write_block(records)
+        finally:
+            for run_file in self._run_files:
+                run_file.close()
+            self._run, self._run_files = [], []
+
+
+class DeltaImport:
+    """
+    Compares rows against the FingerprintIndex of the last import. changed_rows yields only
+    the new and changed rows, and collects the fingerprints of the current rows in next_index.
+    After all the rows are consumed, deleted_keys yields the endpoints which were imported last
+    time but are not present now.
+
+    Rows are yielded as they are given. If the fields have no Id column, write them with
+    endpoint_upsert.with_endpoint_ids, so that changed rows update their endpoints instead of
+    creating new ones.
+
+    Usage:
+        delta = DeltaImport(csv_file_fields, FingerprintIndex.load(s3_obj, index_prefix))
+        write_csv(*with_endpoint_ids(csv_file_fields, delta.changed_rows(rows)))
+        delta.next_index.save(s3_obj, index_prefix)   --> only after the import succeeds
+    """
+
+
+    def __init__(self,
+                 csv_file_fields,
+                 previous_index,
+                 run_size=1000000):
+        if 'Id' in csv_file_fields:
+            self.key_positions = [csv_file_fields.index('Id')]
+        else:
+            assert 'ChannelType' in csv_file_fields and 'Address' in csv_file_fields, \
+                'csv_file_fields should have Id, or ChannelType and Address to find changed rows'
+            self.key_positions = [csv_file_fields.index('ChannelType'), csv_file_fields.index('Address')]
+        self.previous_index = previous_index
+        self.next_index = FingerprintIndexWriter(run_size)
+        self.stats = {'New': 0, 'Changed': 0, 'Unchanged': 0}
+        # One byte per previous endpoint, set when the endpoint is present in the current rows
+        self._seen = bytearray(len(previous_index))
+
+
+    def changed_rows(self,
+                     rows):
+        """
+        Yields the rows which are new or changed since the previous import
+        """
+        separator = FingerprintIndex.KEY_SEPARATOR
+        find = self.previous_index.find
+        previous_fingerprints = self.previous_index.fingerprints
+        add = self.next_index.add
+        seen = self._seen
+        key_positions = self.key_positions
+        for row in rows:
+            key = separator.join([str(row[position]) for position in key_positions])
+            key_hash = _hash(key)
+            fingerprint = _hash(separator.join(map(str, row)))
+            add(key_hash, fingerprint, key)
+            position = find(key_hash)
+            if position is None:
+                self.stats['New'] += 1
+            else:
+                seen[position] = 1
+                if previous_fingerprints[position] != fingerprint:
+                    self.stats['Changed'] += 1
+                else:
+                    self.stats['Unchanged'] += 1
+                    continue
+            yield row
+
+
+    def deleted_count(self):
+        """
+        Returns the number of endpoints which are not present anymore
+        """
+        return self._seen.count(0)
+
+
+    def deleted_keys(self):
+        """
+        Yields the keys of the endpoints which are not present anymore, as lists of the key fields
+        i.e. [Id] or [ChannelType, Address]
+        """
+        for key in self.previous_index.keys(self.__unseen_positions()):
+            yield key.split(FingerprintIndex.KEY_SEPARATOR)
+
+
+    def __unseen_positions(self):
+        position = self._seen.find(0)
+        while position != -1:
+            yield position
+            position = self._seen.find(0, position + 1)
@@ -2,6 +2,7 @@
 # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
 
 from ..channel.channel import Channel
+from ..client_factory import client_factory
 
 class Email(Channel):
 
@@ -11,10 +12,11 @@ class Email(Channel):
                  application_id):
         """
         Intializes instace variables with the application_id
-        of the project and the client for pinpoint
+        of the project and the client for pinpoint. If client_for_pinpoint
+        is None, the shared client from client_factory is used.
         """
 
-        self.client = client_for_pinpoint
+        self.client = client_for_pinpoint if client_for_pinpoint else client_factory.get_client('pinpoint')
         self.application_id = application_id
         self.custom_message = None
         self.template_name = None
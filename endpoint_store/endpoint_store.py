@@ -0,0 +1,205 @@
+"""
+Compact columnar container for endpoint rows, used in place of a list of lists
+for the data of the CSV file imported into pinpoint.
+"""
+
+import sys
+from array import array
+from itertools import islice
+from operator import itemgetter
+
+
+class _ColumnDictionary(dict):
+    """
+    Maps every distinct value of a column to an integer code. New values get the
+    next code, and str values are interned so repeated values share one object.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.values = []
+
+
+    def __missing__(self, value):
+        if isinstance(value, str):
+            value = sys.intern(value)
+        code = len(self.values)
+        self.values.append(value)
+        self[value] = code
+        return code
+
+
+class EndpointStore:
+    """
+    Stores endpoint rows column by column. Columns with few distinct values
+    (ChannelType, most Attributes.*) are dictionary encoded into an array of
+    integer codes, and columns with mostly unique values (Address, Id) are kept
+    as a plain list of values. The encoding is decided from the cardinality: every
+    column starts dictionary encoded, and is converted to a plain list once its
+    distinct values exceed max_distinct_ratio of the rows. No python object is
+    created per row, rows are only materialized as tuples while iterating.
+
+    Usage:
+        store = EndpointStore.from_rows(['ChannelType', 'Address', 'Attributes.Name'], rows)
+        pp.set_email_data(store)
+    """
+
+    DEFAULT_PLAIN_FIELDS = ('Address', 'Id', 'User.UserId')
+
+    # Cardinality is checked only once the store has these many rows, small stores stay encoded
+    MIN_ROWS_FOR_CARDINALITY = 1024
+
+
+    def __init__(self,
+                 fields,
+                 plain_fields=DEFAULT_PLAIN_FIELDS,
+                 chunk_size=65536,
+                 max_distinct_ratio=0.5):
+        """
+        param: fields:             List of column names, same as csv_file_fields.
+
+        param: plain_fields:       Columns which are known to be unique, they are stored as plain
+                                   lists from the start. Other columns are switched to plain lists
+                                   by their cardinality, so this is only a shortcut.
+
+        param: chunk_size:         Number of rows converted at once when extending the store
+                                   from an iterator.
+
+        param: max_distinct_ratio: A dictionary encoded column is converted to a plain list once
+                                   its number of distinct values is more than this fraction of rows.
+        """
+        assert fields, 'fields can not be empty. Eg ["ChannelType", "Address"]'
+        self.fields = list(fields)
+        self.chunk_size = chunk_size
+        self.max_distinct_ratio = max_distinct_ratio
+        self._field_index = {field: index for index, field in enumerate(self.fields)}
+        self._dictionaries = [None if field in plain_fields else _ColumnDictionary()
+                              for field in self.fields]
+        self._columns = [[] if dictionary is None else array('I')
+                         for dictionary in self._dictionaries]
+        self._row_count = 0
+
+
+    @classmethod
+    def from_rows(cls,
+                  fields,
+                  rows,
+                  **store_args):
+        """
+        Creates a store from rows, where rows are lists in the order of fields, or
+        dictionaries keyed by fields
+        """
+        store = cls(fields, **store_args)
+        store.extend(rows)
+        return store
+
+
+    def extend(self,
+               rows):
+        """
+        Appends rows to the store. rows can be any iterable of lists or dictionaries,
+        it is consumed chunk_size rows at a time.
+        """
+        rows = iter(rows)
+        while True:
+            # A small first chunk decides the encoding of the columns before the bulk of the rows
+            chunk_size = self.chunk_size if self._row_count >= self.MIN_ROWS_FOR_CARDINALITY \
+                else self.MIN_ROWS_FOR_CARDINALITY - self._row_count
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            self.__extend_chunk(chunk)
+
+
+    def append(self,
+               row):
+        """
+        Appends a single row to the store
+        """
+        self.__extend_chunk([row])
+
+
+    def __extend_chunk(self,
+                       chunk):
+        """
+        Private method. Converts the chunk column by column, so the work done in python
+        grows with the number of columns and not with the number of rows.
+        """
+        keys = self.fields if isinstance(chunk[0], dict) else range(len(self.fields))
+        for key, column, dictionary in zip(keys, self._columns, self._dictionaries):
+            values = map(itemgetter(key), chunk)
+            if dictionary is None:
+                column.extend(values)
+            else:
+                column.extend(map(dictionary.__getitem__, values))
+        self._row_count += len(chunk)
+        if self._row_count >= self.MIN_ROWS_FOR_CARDINALITY:
+            self.__drop_high_cardinality_dictionaries()
+
+
+    def __drop_high_cardinality_dictionaries(self):
+        """
+        Private method. Converts the dictionary encoded columns having more distinct values than
+        max_distinct_ratio of the rows to plain lists, as their codes and dictionary take more
+        memory and time than the values themselves.
+        """
+        max_distinct = self.max_distinct_ratio * self._row_count
+        for index, dictionary in enumerate(self._dictionaries):
+            if dictionary is not None and len(dictionary.values) > max_distinct:
+                self._columns[index] = list(map(dictionary.values.__getitem__, self._columns[index]))
+                self._dictionaries[index] = None
+
+
+    def column(self,
+               field):
+        """
+        Returns an iterator over the decoded values of the column field
+        """
+        index = self._field_index[field]
+        column, dictionary = self._columns[index], self._dictionaries[index]
+        if dictionary is None:
+            return iter(column)
+        return map(dictionary.values.__getitem__, column)
+
+
+    def distinct_values(self,
+                        field):
+        """
+        Returns the list of distinct values of a dictionary encoded column. Columns converted to
+        plain lists for their cardinality are not supported.
+        """
+        dictionary = self._dictionaries[self._field_index[field]]
+        assert dictionary is not None, f'{field} is not a dictionary encoded column'
+        return list(dictionary.values)
+
+
+    def select(self,
+               fields=None):
+        """
+        Returns an iterator of rows as tuples, having the columns in fields order.
+        All the columns are returned if fields is not given.
+        """
+        fields = fields if fields else self.fields
+        return zip(*[self.column(field) for field in fields])
+
+
+    def __iter__(self):
+        return self.select()
+
+
+    def __len__(self):
+        return self._row_count
+
+
+    def nbytes(self):
+        """
+        Approx memory used by the columns and dictionaries, excluding the plain values
+        themselves
+        """
+        total = 0
+        for column, dictionary in zip(self._columns, self._dictionaries):
+            total += sys.getsizeof(column)
+            if dictionary is not None:
+                total += sys.getsizeof(dictionary) + sys.getsizeof(dictionary.values)
+                total += sum(sys.getsizeof(value) for value in dictionary.values)
+        return total
@@ -0,0 +1,268 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from itertools import chain, islice
+
+TOP_LEVEL_FIELDS = ('Id', 'ChannelType', 'Address', 'EffectiveDate', 'EndpointStatus', 'OptOut', 'RequestId')
+LIST_VALUED_GROUPS = ('Attributes', 'User.UserAttributes')
+FLOAT_VALUED_FIELDS = ('Location.Latitude', 'Location.Longitude')
+
+
+def endpoint_id(channel_type, address):
+    """
+    Returns a stable endpoint id for the channel and address, used when rows have no Id column
+    """
+    return blake2b(f'{channel_type}:{address}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def with_endpoint_ids(fields, rows):
+    """
+    Returns (fields, rows) with an Id column derived from ChannelType and Address appended, if
+    fields has no Id column. Every import file and batch write of the builder uses it, so an address
+    always maps to the same endpoint. Returned as they are if fields has no ChannelType or Address.
+    """
+    if 'Id' in fields or 'ChannelType' not in fields or 'Address' not in fields:
+        return fields, rows
+    channel_position, address_position = fields.index('ChannelType'), fields.index('Address')
+    return list(fields) + ['Id'], ([*row, endpoint_id(row[channel_position], row[address_position])]
+                                   for row in rows)
+
+
+def row_to_endpoint(fields, row):
+    """
+    Converts a CSV row into an endpoint dictionary, as used by update_endpoints_batch and by
+    JSON import files. Column names are the ones used in CSV import files, eg 'Attributes.Name'
+    becomes {'Attributes': {'Name': [str(value)]}} and 'Metrics.Score' becomes {'Metrics': {'Score': float}}.
+    Empty values are skipped, so only the attributes present on the endpoint are returned.
+
+    param: fields: csv_file_fields
+
+    param: row:    List of values in the order of fields
+    """
+    endpoint = {}
+    for field, value in zip(fields, row):
+        if value is None or value == '':
+            continue
+        if field in TOP_LEVEL_FIELDS:
+            endpoint[field] = value
+            continue
+
+        group, _, name = field.rpartition('.')
+        assert group, f'{field} is not a valid endpoint field'
+        if group in LIST_VALUED_GROUPS:
+            # Pinpoint takes lists of strings, numbers are written as the CSV import path writes them
+            value = [str(item) for item in value] if isinstance(value, list) else [str(value)]
+        elif group == 'Metrics' or field in FLOAT_VALUED_FIELDS:
+            value = float(value)
+
+        target = endpoint
+        for key in group.split('.'):
+            target = target.setdefault(key, {})
+        target[name] = value
+    return endpoint
+
+
+class CostModel:
+    """
+    Estimates the time taken to upsert a number of rows with update_endpoints_batch calls and with an
+    import job, to choose the faster path. Tune the defaults with numbers measured for your account.
+    """
+
+
+    def __init__(self,
+                 batch_call_seconds=0.25,
+                 batch_size=100,
+                 max_workers=8,
+                 import_fixed_seconds=40,
+                 import_rows_per_second=20000):
+        """
+        param: batch_call_seconds:     Time taken by one update_endpoints_batch call
+
+        param: batch_size:             Endpoints in one update_endpoints_batch call, max 100
+
+        param: max_workers:            Concurrent update_endpoints_batch calls
+
+        param: import_fixed_seconds:   Fixed cost of the import path, i.e. upload, job start and polling
+
+        param: import_rows_per_second: Rows processed per second by an import job
+        """
+        assert 0 < batch_size <= 100, 'batch_size should be between 1 and 100'
+        self.batch_call_seconds = batch_call_seconds
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.import_fixed_seconds = import_fixed_seconds
+        self.import_rows_per_second = import_rows_per_second
+
+
+    def batch_seconds(self,
+                      row_count):
+        calls = -(-row_count // self.batch_size)
+        return -(-calls // self.max_workers) * self.batch_call_seconds
+
+
+    def import_seconds(self,
+                       row_count):
+        return self.import_fixed_seconds + row_count / self.import_rows_per_second
+
+
+    def choose(self,
+               row_count):
+        """
+        Returns 'BATCH' or 'IMPORT', whichever is estimated to be faster
+        """
+        return 'BATCH' if self.batch_seconds(row_count) <= self.import_seconds(row_count) else 'IMPORT'
+
+
+    def max_batch_rows(self,
+                       limit=10 ** 8):
+        """
+        Returns the largest row count for which the batch path is chosen
+        """
+        low, high = 0, limit
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.choose(middle) == 'BATCH':
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+
+class EndpointUpsertEngine:
+    """
+    Writes endpoints into an application through whichever path is cheaper for the number of rows:
+    concurrent update_endpoints_batch calls of 100 endpoints for small updates, or the CSV import job
+    for large ones. Both paths give the same endpoints: rows without an Id get the id derived from
+    ChannelType and Address on either path. Neither path changes segment membership, import_rows is
+    expected to import without defining a segment.
+
+    Rows can be a generator. If the number of rows is not known, rows are streamed to the batch path,
+    and once CostModel.max_batch_rows rows are sent the rest are streamed to the import path.
+    """
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 application_id,
+                 import_rows,
+                 cost_model=None):
+        """
+        param: import_rows: Callable taking (fields, rows) which imports rows with an import job
+
+        param: cost_model:  CostModel used to choose the path. Default CostModel() is used if not given
+        """
+        self.client = client_for_pinpoint
+        self.application_id = application_id
+        self.import_rows = import_rows
+        self.cost_model = cost_model if cost_model else CostModel()
+
+
+    def upsert(self,
+               fields,
+               rows,
+               row_count=None):
+        """
+        Upserts rows and returns
+        {
+            'Path': 'BATCH' | 'IMPORT' | 'BATCH_THEN_IMPORT',
+            'Rows': 123,
+            'Calls': 123,                         --> batch calls
+            'Failures': [{'Endpoints': ['id'], 'Error': 'string'}]   --> failed batch calls
+        }
+
+        param: fields:    csv_file_fields
+
+        param: rows:      Iterable of rows in the order of fields
+
+        param: row_count: Number of rows, if known. Else rows are streamed to the batch path first, and the
+                          rows after CostModel.max_batch_rows to the import path (BATCH_THEN_IMPORT).
+        """
+        if row_count is None and hasattr(rows, '__len__'):
+            row_count = len(rows)
+
+        fields, rows = with_endpoint_ids(fields, iter(rows))
+        if row_count is not None:
+            if self.cost_model.choose(row_count) == 'IMPORT':
+                return self.__import(fields, rows, {'Path': 'IMPORT', 'Rows': 0, 'Calls': 0, 'Failures': []})
+            return self.__upsert_batches(fields, rows)
+
+        result = self.__upsert_batches(fields, islice(rows, self.cost_model.max_batch_rows()))
+        for first_row in rows:
+            result['Path'] = 'BATCH_THEN_IMPORT'
+            return self.__import(fields, chain([first_row], rows), result)
+        return result
+
+
+    def __import(self,
+                 fields,
+                 rows,
+                 result):
+        """
+        Private method. Imports rows with import_rows, adding their count to result
+        """
+        counted = _CountingIterator(rows)
+        self.import_rows(fields, counted)
+        result['Rows'] += counted.count
+        return result
+
+
+    def __upsert_batches(self,
+                         fields,
+                         rows):
+        """
+        Private method. Sends the rows in batches of batch_size endpoints over a bounded thread pool
+        """
+        result = {'Path': 'BATCH', 'Rows': 0, 'Calls': 0, 'Failures': []}
+        items = (row_to_endpoint(fields, row) for row in rows)
+        batches = iter(lambda: list(islice(items, self.cost_model.batch_size)), [])
+        with ThreadPoolExecutor(max_workers=self.cost_model.max_workers) as executor:
+            in_flight = []
+            for batch in batches:
+                result['Rows'] += len(batch)
+                in_flight.append((batch, executor.submit(self.__send_batch, batch)))
+                if len(in_flight) >= 2 * self.cost_model.max_workers:
+                    self.__collect(result, *in_flight.pop(0))
+            for batch, future in in_flight:
+                self.__collect(result, batch, future)
+        return result
+
+
+    def __send_batch(self,
+                     batch):
+        return self.client.update_endpoints_batch(
+            ApplicationId=self.application_id,
+            EndpointBatchRequest={'Item': batch}
+        )
+
+
+    def __collect(self,
+                  result,
+                  batch,
+                  future):
+        result['Calls'] += 1
+        try:
+            future.result()
+        except Exception as ex:
+            result['Failures'].append({'Endpoints': [item['Id'] for item in batch], 'Error': str(ex)})
+
+
+class _CountingIterator:
+    """
+    Iterator which counts the items passed through it
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.count = 0
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
@@ -0,0 +1,122 @@
+"""
+Dependency graph of setup steps, which runs every step as soon as the steps it
+depends on are completed, so that independent steps run concurrently.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ExecutionPlan:
+    """
+    Usage:
+        plan = ExecutionPlan()
+        plan.add_step('import_base_segment', pp.import_data_into_pinpoint)
+        plan.add_step('create_email_segment', create_email_segment, depends_on=['import_base_segment'])
+        plan.add_step('create_sms_segment', create_sms_segment, depends_on=['import_base_segment'])
+        print(plan.describe())
+        results = plan.run()
+    """
+
+
+    def __init__(self):
+        self._steps = OrderedDict()
+
+
+    def add_step(self,
+                 name,
+                 function,
+                 depends_on=()):
+        """
+        Adds a step to the plan
+
+        param: name:       Unique name of the step
+
+        param: function:   Callable without arguments, which performs the step
+
+        param: depends_on: Names of the steps which have to complete before this step starts
+        """
+        assert name not in self._steps, f'Step {name} is already present in the plan'
+        self._steps[name] = {'function': function, 'depends_on': list(depends_on)}
+        return self
+
+
+    def stages(self):
+        """
+        Returns the steps grouped in stages, where every step of a stage depends only on the steps of
+        earlier stages, i.e. the steps of a stage can run concurrently. Raises an exception if a
+        dependency is unknown or the dependencies have a cycle.
+        """
+        for name, step in self._steps.items():
+            for dependency in step['depends_on']:
+                assert dependency in self._steps, f'Step {name} depends on unknown step {dependency}'
+
+        completed = set()
+        stages = []
+        while len(completed) < len(self._steps):
+            stage = [name for name, step in self._steps.items()
+                     if name not in completed and all(dependency in completed for dependency in step['depends_on'])]
+            if not stage:
+                raise Exception(f'Steps {[name for name in self._steps if name not in completed]} have cyclic dependencies')
+            stages.append(stage)
+            completed.update(stage)
+        return stages
+
+
+    def dry_run(self):
+        """
+        Returns the plan without running it
+        [
+            {'stage': 1, 'steps': [{'name': 'string', 'depends_on': ['string']}]}
+        ]
+        """
+        return [{'stage': index, 'steps': [{'name': name, 'depends_on': self._steps[name]['depends_on']}
+                                           for name in stage]}
+                for index, stage in enumerate(self.stages(), start=1)]
+
+
+    def describe(self):
+        """
+        Returns the dry run of the plan as readable text
+        """
+        lines = []
+        for stage in self.dry_run():
+            lines.append(f'Stage {stage["stage"]}:')
+            for step in stage['steps']:
+                depends_on = f' (after {", ".join(step["depends_on"])})' if step['depends_on'] else ''
+                lines.append(f'    {step["name"]}{depends_on}')
+        return '\n'.join(lines)
+
+
+    def run(self,
+            max_workers=4):
+        """
+        Runs the plan and returns dictionary of step name -> return value of its function. A step
+        starts as soon as all its dependencies are completed. If a step fails, steps depending on it
+        are not started, running steps are completed and then the exception is raised.
+        """
+        self.stages()
+        results = {}
+        error = None
+        pending = OrderedDict(self._steps)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while pending or running:
+                if not error:
+                    ready = [name for name, step in pending.items()
+                             if all(dependency in results for dependency in step['depends_on'])]
+                    for name in ready:
+                        running[executor.submit(pending.pop(name)['function'])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as ex:
+                        error = error if error else ex
+
+        if error:
+            raise error
+        return results
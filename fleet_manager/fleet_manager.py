@@ -0,0 +1,163 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class FleetManager:
+    """
+    Runs operations over many pinpoint applications. Applications are read from every
+    page of get_apps, the operation is run for them with bounded concurrency, and errors
+    are collected per application instead of stopping the whole run.
+
+    Usage:
+        fleet = FleetManager(client_for_pinpoint, max_workers=16)
+        result = fleet.update_channel('SMS', enable=False)
+        result['Failed']  --> {application_id: exception}
+    """
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 max_workers=16,
+                 page_size=100):
+        """
+        param: max_workers: Maximum number of applications processed at once
+
+        param: page_size:   Number of applications fetched in one get_apps call
+        """
+        self.client = client_for_pinpoint
+        self.max_workers = max_workers
+        self.page_size = page_size
+
+
+    def iter_applications(self):
+        """
+        Yields ApplicationResponse of every application, reading all the pages of get_apps
+        """
+        next_token = None
+        while True:
+            request = {'PageSize': str(self.page_size)}
+            if next_token:
+                request['Token'] = next_token
+            response = self.client.get_apps(**request)['ApplicationsResponse']
+            yield from response.get('Item', [])
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+
+
+    def application_ids(self):
+        """
+        Returns ids of all the applications
+        """
+        return [application['Id'] for application in self.iter_applications()]
+
+
+    def run(self,
+            operation,
+            application_ids=None):
+        """
+        Calls operation(application_id) for every application, at most max_workers at once. Returns
+        {
+            'Succeeded': {application_id: return value of operation},
+            'Failed': {application_id: exception raised by operation}
+        }
+
+        param: operation:       Callable taking the application id
+
+        param: application_ids: Iterable of application ids. All the applications are used if not given.
+        """
+        if application_ids is None:
+            application_ids = (application['Id'] for application in self.iter_applications())
+
+        result = {'Succeeded': {}, 'Failed': {}}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+            for application_id in application_ids:
+                if len(in_flight) >= 2 * self.max_workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__collect(result, in_flight.pop(future), future)
+                in_flight[executor.submit(operation, application_id)] = application_id
+            for future in list(in_flight):
+                self.__collect(result, in_flight.pop(future), future)
+        return result
+
+
+    def __collect(self,
+                  result,
+                  application_id,
+                  future):
+        try:
+            result['Succeeded'][application_id] = future.result()
+        except Exception as ex:
+            result['Failed'][application_id] = ex
+
+
+    def delete_applications(self,
+                            application_ids=None):
+        """
+        Deletes the applications, all the applications if application_ids is not given
+        """
+        if application_ids is None:
+            # Pages are read before deleting, so that deletes do not shift the pages being read
+            application_ids = self.application_ids()
+        return self.run(lambda application_id: self.client.delete_app(ApplicationId=application_id),
+                        application_ids)
+
+
+    def update_channel(self,
+                       channel,
+                       enable=True,
+                       application_ids=None,
+                       **channel_request):
+        """
+        Enables or disables the channel of the applications
+
+        param: channel:          'EMAIL' | 'SMS'
+
+        param: channel_request:  Other fields of EmailChannelRequest / SMSChannelRequest. EMAIL channel
+                                 requires FromAddress and Identity, eg
+                                 update_channel('EMAIL', FromAddress='a@b.com', Identity=ses_identity_arn)
+        """
+        assert channel in ['EMAIL', 'SMS'], 'Channel should be either "SMS" or "EMAIL"'
+        channel_request['Enabled'] = enable
+
+        def update(application_id):
+            if channel == 'EMAIL':
+                return self.client.update_email_channel(ApplicationId=application_id,
+                                                        EmailChannelRequest=channel_request)
+            return self.client.update_sms_channel(ApplicationId=application_id,
+                                                  SMSChannelRequest=channel_request)
+
+        return self.run(update, application_ids)
+
+
+    def collect_kpis(self,
+                     kpi_names,
+                     start_time=None,
+                     end_time=None,
+                     application_ids=None):
+        """
+        Fetches the KPIs of the applications. Succeeded values are dictionaries of KPI name -> rows
+        of the KpiResult of get_application_date_range_kpi
+        """
+        date_range = {}
+        if start_time:
+            date_range['StartTime'] = start_time
+        if end_time:
+            date_range['EndTime'] = end_time
+
+        def collect(application_id):
+            kpis = {}
+            for kpi_name in kpi_names:
+                response = self.client.get_application_date_range_kpi(
+                    ApplicationId=application_id,
+                    KpiName=kpi_name,
+                    **date_range
+                )
+                kpis[kpi_name] = response['ApplicationDateRangeKpiResponse']['KpiResult']['Rows']
+            return kpis
+
+        return self.run(collect, application_ids)
@@ -0,0 +1,208 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+
+class JobWaiter:
+    """
+    Waits for many pinpoint import / export jobs at once from a single background thread.
+    Every job is polled with its own adaptive backoff with jitter: the delay is reset when
+    the job status changes and grows while it stays the same. Each job has a deadline, and
+    completion is reported through a concurrent.futures.Future, so callers can block on it,
+    add callbacks, or await it in an asyncio loop.
+
+    Usage:
+        waiter = JobWaiter(client_for_pinpoint)
+        future = waiter.add(application_id, job_id, callback=print)
+        import_job_response = future.result()
+    """
+
+    FINAL_STATUSES = ('COMPLETED', 'FAILED')
+    THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException')
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 initial_delay=0.5,
+                 max_delay=15,
+                 backoff_factor=1.6,
+                 jitter=0.2,
+                 default_timeout=600):
+        """
+        param: initial_delay:   Delay in seconds before the first poll of a job, and after
+                                every status change.
+
+        param: max_delay:       Upper limit of the delay between two polls of a job
+
+        param: backoff_factor:  Delay is multiplied by this factor while status does not change
+
+        param: jitter:          Delay is randomly changed by +/- this fraction, so that polls of
+                                jobs created together are spread out
+
+        param: default_timeout: Seconds after which a job is abandoned, if timeout is not given in add
+        """
+        self.client = client_for_pinpoint
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.default_timeout = default_timeout
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+
+    def add(self,
+            application_id,
+            job_id,
+            job_type='IMPORT',
+            timeout=None,
+            callback=None):
+        """
+        Starts tracking a job and returns a Future. Result of the future is the ImportJobResponse
+        or ExportJobResponse of the completed job. If the job fails or the deadline is crossed,
+        the future raises an exception.
+
+        param: job_type:  'IMPORT' | 'EXPORT'
+
+        param: timeout:   In seconds, deadline of the job. default_timeout is used if not given
+
+        param: callback:  Callable which is called with the future when job is completed
+        """
+        assert job_type in ['IMPORT', 'EXPORT'], 'job_type should be either "IMPORT" or "EXPORT"'
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+
+        now = time.monotonic()
+        job = {
+            'application_id': application_id,
+            'job_id': job_id,
+            'job_type': job_type,
+            'deadline': now + (timeout if timeout else self.default_timeout),
+            'delay': self.initial_delay,
+            'status': None,
+            'future': future
+        }
+        with self._condition:
+            heapq.heappush(self._jobs, (now + self.__jittered(self.initial_delay), next(self._sequence), job))
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.__run, name='pinpoint-job-waiter', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+
+    def wait(self,
+             application_id,
+             job_id,
+             job_type='IMPORT',
+             timeout=None):
+        """
+        Blocks till the job is completed and returns its response
+        """
+        return self.add(application_id, job_id, job_type=job_type, timeout=timeout).result()
+
+
+    async def wait_async(self,
+                         application_id,
+                         job_id,
+                         job_type='IMPORT',
+                         timeout=None):
+        """
+        Awaitable version of wait, for use inside an asyncio loop
+        """
+        return await asyncio.wrap_future(self.add(application_id, job_id, job_type=job_type, timeout=timeout))
+
+
+    def pending_jobs(self):
+        """
+        Returns the number of jobs which are still being tracked
+        """
+        with self._condition:
+            return len(self._jobs)
+
+
+    def __jittered(self,
+                   delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+    def __run(self):
+        """
+        Private method. Polls the job which is due next, till no job is left
+        """
+        while True:
+            with self._condition:
+                if not self._jobs:
+                    self._thread = None
+                    return
+                poll_at, _, job = self._jobs[0]
+                now = time.monotonic()
+                if poll_at > now:
+                    self._condition.wait(poll_at - now)
+                    continue
+                heapq.heappop(self._jobs)
+
+            if self.__poll(job):
+                with self._condition:
+                    next_poll = time.monotonic() + self.__jittered(job['delay'])
+                    heapq.heappush(self._jobs, (next_poll, next(self._sequence), job))
+
+
+    def __poll(self,
+               job):
+        """
+        Private method. Polls the job once, resolves its future if it is done.
+        Returns True if job has to be polled again.
+        """
+        future = job['future']
+        if future.cancelled():
+            return False
+
+        try:
+            if job['job_type'] == 'IMPORT':
+                response = self.client.get_import_job(
+                    ApplicationId=job['application_id'],
+                    JobId=job['job_id']
+                )['ImportJobResponse']
+            else:
+                response = self.client.get_export_job(
+                    ApplicationId=job['application_id'],
+                    JobId=job['job_id']
+                )['ExportJobResponse']
+        except Exception as ex:
+            error_code = getattr(ex, 'response', {}).get('Error', {}).get('Code')
+            if error_code not in self.THROTTLING_ERRORS:
+                future.set_exception(ex)
+                return False
+            status = job['status']
+        else:
+            status = response['JobStatus']
+            if status == 'COMPLETED':
+                future.set_result(response)
+                return False
+            if status == 'FAILED':
+                future.set_exception(Exception(f'{job["job_type"].title()} job {job["job_id"]} failed, '
+                                               f'please try again. Failures: {response.get("Failures")}'))
+                return False
+
+        if time.monotonic() >= job['deadline']:
+            future.set_exception(Exception(f'Time out happened, {job["job_type"].lower()} job {job["job_id"]} '
+                                           f'is still in {status} status, Abandoning...'))
+            return False
+
+        if status != job['status']:
+            job['status'] = status
+            job['delay'] = self.initial_delay
+        else:
+            job['delay'] = min(self.max_delay, job['delay'] * self.backoff_factor)
+        return True
@@ -0,0 +1,86 @@
+"""
+Local SQLite store of daily KPI values of pinpoint applications, so that time series
+can be served locally and only the new days have to be fetched from pinpoint.
+"""
+
+import sqlite3
+import threading
+
+
+class KpiHistoryStore:
+
+
+    def __init__(self,
+                 db_path='/tmp/pinpoint_kpi_history.db'):
+        """
+        param: db_path: Path of the SQLite database file. Pass ':memory:' for a store which is not persisted.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS kpi_history ('
+                'application_id TEXT NOT NULL, '
+                'kpi_name TEXT NOT NULL, '
+                'day TEXT NOT NULL, '
+                'value REAL, '
+                'PRIMARY KEY (application_id, kpi_name, day))'
+            )
+
+
+    def latest_day(self,
+                   application_id,
+                   kpi_name):
+        """
+        Returns the newest stored day (YYYY-MM-DD) of the KPI, None if nothing is stored
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT MAX(day) FROM kpi_history WHERE application_id = ? AND kpi_name = ?',
+                (application_id, kpi_name)
+            ).fetchone()
+        return row[0]
+
+
+    def add_values(self,
+                   application_id,
+                   kpi_name,
+                   values):
+        """
+        Stores the daily values of the KPI, replacing the already stored values of those days
+
+        param: values: Dictionary of day (YYYY-MM-DD) -> value
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO kpi_history (application_id, kpi_name, day, value) VALUES (?, ?, ?, ?)',
+                ((application_id, kpi_name, day, value) for day, value in values.items())
+            )
+
+
+    def get_values(self,
+                   application_id,
+                   kpi_name,
+                   start_day=None,
+                   end_day=None):
+        """
+        Returns dictionary of day -> value of the KPI, ordered by day. start_day and end_day
+        (YYYY-MM-DD) are inclusive.
+        """
+        query = 'SELECT day, value FROM kpi_history WHERE application_id = ? AND kpi_name = ?'
+        parameters = [application_id, kpi_name]
+        if start_day:
+            query += ' AND day >= ?'
+            parameters.append(start_day)
+        if end_day:
+            query += ' AND day <= ?'
+            parameters.append(end_day)
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY day', parameters).fetchall()
+        return dict(rows)
+
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
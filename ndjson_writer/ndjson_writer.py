@@ -0,0 +1,79 @@
+"""
+Streaming writer of endpoints as newline delimited JSON, the JSON format of pinpoint
+import jobs. Only the attributes present on an endpoint are written, so sparse
+attributes do not cost an empty cell in every row as they do in CSV files.
+"""
+
+import json
+
+from ..endpoint_upsert.endpoint_upsert import LIST_VALUED_GROUPS, row_to_endpoint
+
+
+class NdjsonEndpointWriter:
+    """
+    Usage:
+        with open('/tmp/pp_details.json', 'w', encoding='utf-8') as json_file:
+            writer = NdjsonEndpointWriter(json_file, csv_file_fields)
+            writer.write_rows(rows)
+    """
+
+
+    def __init__(self,
+                 file,
+                 fields):
+        """
+        param: file:   Any object with a write(str) method, eg a text file opened with encoding='utf-8' (non ascii
+                       characters are written as they are) or s3_utility.open_multipart_writer
+
+        param: fields: Column names of the rows as used in CSV import files, eg ['ChannelType', 'Attributes.Name']
+        """
+        self.file = file
+        self.fields = list(fields)
+        self.row_count = 0
+        self._encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+
+    def write_endpoint(self,
+                       endpoint):
+        """
+        Writes an endpoint dictionary (as in update_endpoints_batch) as one line. Attribute values are
+        written as lists of strings, as row_to_endpoint and the CSV import path write them.
+        """
+        self.file.write(self._encode(self.__string_attributes(endpoint)) + '\n')
+        self.row_count += 1
+
+
+    @staticmethod
+    def __string_attributes(endpoint):
+        """
+        Private method. Returns endpoint with the values of Attributes and User.UserAttributes as lists
+        of strings, pinpoint JSON import rejects other values
+        """
+        endpoint = dict(endpoint)
+        for group in LIST_VALUED_GROUPS:
+            *parents, name = group.split('.')
+            target = endpoint
+            for key in parents:
+                if not isinstance(target.get(key), dict):
+                    break
+                target[key] = target = dict(target[key])
+            else:
+                if isinstance(target.get(name), dict):
+                    target[name] = {key: [str(item) for item in value] if isinstance(value, list) else [str(value)]
+                                    for key, value in target[name].items()}
+        return endpoint
+
+
+    def write_rows(self,
+                   rows):
+        """
+        Writes rows, lists in the order of fields, skipping their empty values.
+        Returns the number of rows written.
+        """
+        fields, encode, write = self.fields, self._encode, self.file.write
+        count = 0
+        for row in rows:
+            write(encode(row_to_endpoint(fields, row)) + '\n')
+            count += 1
+        self.row_count += count
+        return count
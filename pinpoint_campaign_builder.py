@@ -3,17 +3,40 @@ A pinpoint campaign builder. Currently supports only EMAIL and SMS channel
 """
 
 import csv
+import io
 import json
+import os
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from .audience_cleaner.audience_cleaner import AudienceCleaner
+from .bulk_sender.bulk_sender import BulkSender
+from .delta_import.delta_import import DeltaImport, FingerprintIndex
+from .campaign_index.campaign_index import CampaignIndex
 from .email_channel.email_channel import Email
+from .endpoint_store.endpoint_store import EndpointStore
+from .endpoint_upsert.endpoint_upsert import EndpointUpsertEngine, with_endpoint_ids
+from .execution_plan.execution_plan import ExecutionPlan
+from .fleet_manager.fleet_manager import FleetManager
 from decimal import Decimal
-
-import boto3
-from botocore.exceptions import ClientError
-
+from itertools import chain, islice
+from operator import itemgetter
+
+from .client_factory import client_factory
+from .client_metrics.client_metrics import default_metrics
+from .job_waiter.job_waiter import JobWaiter
+from .kpi_history.kpi_history import KpiHistoryStore
+from .ndjson_writer.ndjson_writer import NdjsonEndpointWriter
 from .s3_utility.s3_utility import s3_utility
+from .sharded_import.sharded_import import ShardedImporter
 from .sms_channel.sms_channel import Sms
+from .throttled_client.throttled_client import ThrottledClient
+from .tracing.tracing import Tracer, traced
+from .template_renderer.template_renderer import MessageRenderer
+from .template_sync.template_sync import TemplateSync
+from .ttl_cache.ttl_cache import TTLCache
 
 
 class PinpointCampaignBuilder:
@@ -34,6 +57,12 @@ class PinpointCampaignBuilder:
                  sms_data=None,
                  from_address=None,
                  application_exists=False,
+                 throttle_config=None,
+                 kpi_cache_ttl=60,
+                 kpi_history_store=None,
+                 lazy=False,
+                 metrics=None,
+                 tracer=None,
                  **additional_args):
         """
             param: s3_bucket_name:      This bucket is used to store the csv file and all project
@@ -82,7 +111,9 @@ class PinpointCampaignBuilder:
             param: csv_file_fields  :   List containing the column names to be written into CSV file, as accepted by AWS.
                                         Please check allowed fields by AWS for imported CSV files. Not setting proper field name
                                         will result in importing error and segment will not be created.
-                                        For eg ['ChannelType', 'Address', 'Attributes.Name']
+                                        For eg ['ChannelType', 'Address', 'Attributes.Name']. If there is no Id
+                                        column, files and batch writes get an Id derived from ChannelType and
+                                        Address, so that an address is always the same endpoint.
 
             param: email_data       :   A list containing lists, where each list corresponds to a row entry in CSV file.
                                         eg [['EMAIL', 'sirohisajal@gmail.com', 'sajal']] for the headers defined in csv_file_fields
@@ -97,24 +128,69 @@ class PinpointCampaignBuilder:
             param: application_exists:  Default False. Set to true, if application exists. It will automatically assign the 
                                         base_segment_id stored in s3_folder_path defined : in s3_bucket_name bucket, and fetches 
                                         the channel type used previously and assign to self.channel_type 
+
+            param: throttle_config  :   Dictionary of arguments for ThrottledClient, which paces every pinpoint call.
+                                        eg {'max_rate': 50, 'operation_rates': {'send_messages': 20}}. Set max_rate to
+                                        the quota of your account. Throttled calls are retried by botocore, set the
+                                        number of attempts with client_factory.configure(retries=...).
+
+            param: kpi_cache_ttl    :   In seconds, time for which KPI values are cached by get_kpi_value. Default 60
+
+            param: kpi_history_store:   KpiHistoryStore used by sync_kpi_history. A store in /tmp is used if not given.
+
+            param: lazy             :   Default False. If true, no network call is made here. The pinpoint client, the
+                                        application, its channels and the state in s3 are created / fetched the first
+                                        time they are needed. Time taken by each of these phases is recorded in
+                                        self.startup_timings.
+
+            param: metrics          :   ClientMetrics object, or True to use the ClientMetrics of the process (shared by all builders).
+                                        If given, it is attached to the pinpoint and s3 clients of client_factory when they are
+                                        created, and records latency, retries, throttles and payload sizes of every API call.
+                                        Export them with metrics.to_prometheus() or metrics.to_json()
+
+            param: tracer           :   Tracer whose exporters receive a timed span for every phase (create_csv,
+                                        upload_to_s3, import_data_into_pinpoint, create_dynamic_segment, create_campaign
+                                        etc.) with attributes like rows, bytes, job_id and segment_id. Eg
+                                        Tracer(exporters=[ChromeTraceExporter('/tmp/trace.json')])
     """
+        init_started_at = time.perf_counter()
         assert pinpoint_access_role_arn, 'pinpoint_access_role_arn field argument can not be empty'
 
-        self.region_pinpoint = region if region else boto3.session.Session().region_name
-        self.client_pinpoint = boto3.client('pinpoint',region_name=self.region_pinpoint)
+        self.lazy = lazy
+
+        self.startup_timings = {}
+
+        self._lazy_lock = threading.RLock()
+
+        self._region_pinpoint = region
+
+        self.metrics = default_metrics() if metrics is True else metrics
+        if self.metrics:
+            # Handlers are registered on the shared pinpoint and s3 clients when they are created
+            self.metrics.attach_to_factory()
+
+        self.tracer = tracer if tracer else Tracer()
+
+        self.client_pinpoint = ThrottledClient(create_client=self.__create_pinpoint_client,
+                                               **(throttle_config if throttle_config else {}))
+        self.job_waiter = JobWaiter(self.client_pinpoint)
+        self.kpi_cache = TTLCache(ttl=kpi_cache_ttl)
+        self.kpi_history_store = kpi_history_store
 
         self.application_name = application_name if application_name  else str(datetime.now())[:-7]  # keeping name till seconds
 
-        self.application_id = application_id if application_id \
-                              else self.create_application(self.application_name)
+        self._application_id = application_id
+
+        self._campaign_index = None
+        self._template_sync = None
 
         self.segment_id_for_campaign = None
 
-        self.s3_folder_path = s3_folder_path if s3_folder_path else f'{self.application_id}'
+        self._s3_folder_path = s3_folder_path
 
         self.pinpoint_acc_arn = pinpoint_access_role_arn
 
-        self.channel_type = channel_type
+        self._channel_type = channel_type
 
         self.email_data = email_data 
 
@@ -122,11 +198,11 @@ class PinpointCampaignBuilder:
 
         self.csv_file_fields = csv_file_fields
 
-        self.base_segment_id = base_segment_id
+        self._base_segment_id = base_segment_id
 
-        self.sms_dynamic_segment_id = sms_dynamic_segment_id
+        self._sms_dynamic_segment_id = sms_dynamic_segment_id
 
-        self.email_dynamic_segment_id = email_dynamic_segment_id
+        self._email_dynamic_segment_id = email_dynamic_segment_id
 
         if s3_bucket_name:
             self.s3_bucket = s3_bucket_name
@@ -135,25 +211,221 @@ class PinpointCampaignBuilder:
             self.s3_bucket = None
             self.s3_obj = None
 
-        if application_exists:
-            if self.s3_bucket:
-                self.fetch_pinpoint_data_from_s3()
-            if not channel_type:
-                self.__get_channels()
+        # Work which is deferred till it is needed in lazy mode
+        self._s3_state_pending = bool(application_exists and self.s3_bucket)
+        self._channels_pending = bool(application_exists and not channel_type)
+        self._update_channels_pending = not application_exists
+        self._email_obj = None
+        self._sms_obj = None
+        self._ses_identity_arn = ses_identity_arn
+        self._from_address = from_address
+
+        if not self._channels_pending:
+            assert self._channel_type, 'channel_type argument can not be empty. Eg. ["EMAIL","SMS"] | ["EMAIL"] | ["SMS"]'
+            if self._update_channels_pending and 'EMAIL' in self._channel_type:
+                assert ses_identity_arn, 'Please provide ses_identity_role param if you are using EMAIL channel'
+
+        if not lazy:
+            self.__load_s3_state()
+            # Channels fetched from an existing application get their objects on first access only
+            if channel_type and 'EMAIL' in channel_type:
+                self.email_obj
+            if channel_type and 'SMS' in channel_type:
+                self.sms_obj
+
+        self.startup_timings['__init__'] = time.perf_counter() - init_started_at
+
+
+    @contextmanager
+    def __timed(self,
+                phase):
+        """
+        Private method. Records the time taken by a startup phase in self.startup_timings
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - started_at
 
-        assert self.channel_type, 'channel_type argument can not be empty. Eg. ["EMAIL","SMS"] | ["EMAIL"] | ["SMS"]'
 
-        if 'EMAIL' in channel_type:
-            assert ses_identity_arn, 'Please provide ses_identity_role param if you are using EMAIL channel'
-            from_address = from_address if from_address else ses_identity_arn.split('/')[-1]
-            self.email_obj = Email(self.client_pinpoint, self.application_id)
-            if not application_exists:
-                self.email_obj.update_channel(ses_identity_arn, from_address, pinpoint_access_role_arn)
+    def __create_pinpoint_client(self):
+        """
+        Private method. Creates the pinpoint client, called by ThrottledClient on the first call
+        """
+        with self.__timed('create_client'):
+            return client_factory.get_client('pinpoint', region_name=self.region_pinpoint)
 
-        if 'SMS' in channel_type:
-            self.sms_obj = Sms(self.client_pinpoint, self.application_id)
-            if not application_exists:
-                self.sms_obj.update_channel()
+
+    @property
+    def region_pinpoint(self):
+        if not self._region_pinpoint:
+            self._region_pinpoint = client_factory.get_region_name()
+        return self._region_pinpoint
+
+
+    @property
+    def application_id(self):
+        """
+        Id of the pinpoint application. Application is created on first access if it was not given
+        """
+        if not self._application_id:
+            with self._lazy_lock:
+                if not self._application_id:
+                    with self.__timed('create_application'):
+                        self._application_id = self.create_application(self.application_name)
+        return self._application_id
+
+
+    @application_id.setter
+    def application_id(self, application_id):
+        self._application_id = application_id
+
+
+    @property
+    def s3_folder_path(self):
+        return self._s3_folder_path if self._s3_folder_path else f'{self.application_id}'
+
+
+    @s3_folder_path.setter
+    def s3_folder_path(self, s3_folder_path):
+        self._s3_folder_path = s3_folder_path
+
+
+    @property
+    def channel_type(self):
+        """
+        Channels of the application. Fetched from pinpoint on first access, if application exists and
+        channel_type was not given
+        """
+        if self._channels_pending:
+            with self._lazy_lock:
+                if self._channels_pending:
+                    with self.__timed('get_channels'):
+                        self.__get_channels()
+                    self._channels_pending = False
+        return self._channel_type
+
+
+    @channel_type.setter
+    def channel_type(self, channel_type):
+        self._channel_type = channel_type
+        self._channels_pending = False
+
+
+    def __load_s3_state(self):
+        """
+        Private method. Reads application_details.json from s3 once, if application exists
+        """
+        if self._s3_state_pending:
+            with self._lazy_lock:
+                if self._s3_state_pending:
+                    self._s3_state_pending = False
+                    with self.__timed('fetch_pinpoint_data_from_s3'):
+                        self.fetch_pinpoint_data_from_s3()
+
+
+    @property
+    def base_segment_id(self):
+        self.__load_s3_state()
+        return self._base_segment_id
+
+
+    @base_segment_id.setter
+    def base_segment_id(self, base_segment_id):
+        self._base_segment_id = base_segment_id
+
+
+    @property
+    def email_dynamic_segment_id(self):
+        self.__load_s3_state()
+        return self._email_dynamic_segment_id
+
+
+    @email_dynamic_segment_id.setter
+    def email_dynamic_segment_id(self, email_dynamic_segment_id):
+        self._email_dynamic_segment_id = email_dynamic_segment_id
+
+
+    @property
+    def sms_dynamic_segment_id(self):
+        self.__load_s3_state()
+        return self._sms_dynamic_segment_id
+
+
+    @sms_dynamic_segment_id.setter
+    def sms_dynamic_segment_id(self, sms_dynamic_segment_id):
+        self._sms_dynamic_segment_id = sms_dynamic_segment_id
+
+
+    @property
+    def email_obj(self):
+        """
+        Email channel object, created on first access. The channel is enabled at that time if the
+        application did not exist before.
+        """
+        if self._email_obj is None:
+            with self._lazy_lock:
+                if self._email_obj is None:
+                    assert 'EMAIL' in self.channel_type, 'EMAIL is not present in channel_type'
+                    email_obj = Email(self.client_pinpoint, self.application_id)
+                    if self._update_channels_pending:
+                        assert self._ses_identity_arn, \
+                            'Please provide ses_identity_role param if you are using EMAIL channel'
+                        from_address = self._from_address if self._from_address \
+                                       else self._ses_identity_arn.split('/')[-1]
+                        with self.__timed('update_email_channel'):
+                            email_obj.update_channel(self._ses_identity_arn, from_address, self.pinpoint_acc_arn)
+                    self._email_obj = email_obj
+        return self._email_obj
+
+
+    @property
+    def sms_obj(self):
+        """
+        SMS channel object, created on first access. The channel is enabled at that time if the
+        application did not exist before.
+        """
+        if self._sms_obj is None:
+            with self._lazy_lock:
+                if self._sms_obj is None:
+                    assert 'SMS' in self.channel_type, 'SMS is not present in channel_type'
+                    sms_obj = Sms(self.client_pinpoint, self.application_id)
+                    if self._update_channels_pending:
+                        with self.__timed('update_sms_channel'):
+                            sms_obj.update_channel()
+                    self._sms_obj = sms_obj
+        return self._sms_obj
+
+
+    def __ensure_channels(self,
+                          channels):
+        """
+        Private method. Makes sure the channel objects are created, i.e. channels are enabled, before
+        anything is sent over them in lazy mode
+        """
+        if 'EMAIL' in channels:
+            self.email_obj
+        if 'SMS' in channels:
+            self.sms_obj
+
+
+    @property
+    def campaign_index(self):
+        if self._campaign_index is None:
+            with self._lazy_lock:
+                if self._campaign_index is None:
+                    self._campaign_index = CampaignIndex(self.client_pinpoint, self.application_id)
+        return self._campaign_index
+
+
+    @property
+    def template_sync(self):
+        if self._template_sync is None:
+            with self._lazy_lock:
+                if self._template_sync is None:
+                    self._template_sync = TemplateSync(self.client_pinpoint)
+        return self._template_sync
 
 
     def __get_channels(self):
@@ -195,23 +467,53 @@ class PinpointCampaignBuilder:
 
 
     def delete_application(self,
-                           application_id=[]):
+                           application_id=None,
+                           max_workers=16,
+                           raise_on_error=True):
         """
-        Deletes application given the application ID. If no id is given, uses self.application_id
+        Deletes application given the application ID, or a list of application IDs which are deleted
+        concurrently. If no id is given, uses self.application_id. Returns the result of FleetManager.run
+
+        param: raise_on_error: Default True. If true, an exception is raised after all the deletes are tried,
+                               if any of them failed, with the result as ex.args[1]. If false, failures are only
+                               reported in result['Failed'].
         """
         if not application_id:
-            application_id.append(self.application_id)
-    
-        [self.client_pinpoint.delete_app(ApplicationId=app_id) for app_id in application_id]
+            application_id = [self.application_id]
+        elif isinstance(application_id, str):
+            application_id = [application_id]
+
+        result = FleetManager(self.client_pinpoint, max_workers=max_workers).delete_applications(application_id)
+        if raise_on_error:
+            self.__raise_failed_deletes(result)
+        return result
+
+
+    def delete_all_apps(self,
+                        max_workers=16,
+                        raise_on_error=True):
+        """
+        Deletes all the pinpoint applications, reading all the pages of applications.
+        Returns the result of FleetManager.run. raise_on_error is same as in delete_application.
+        """
+        result = FleetManager(self.client_pinpoint, max_workers=max_workers).delete_applications()
+        if raise_on_error:
+            self.__raise_failed_deletes(result)
+        return result
 
 
-    def delete_all_apps(self):
+    def __raise_failed_deletes(self,
+                               result):
         """
-        Deletes all the pinpoint applications
+            Private method. Raises an exception naming the applications which could not be deleted, with the
+            result of FleetManager.run as its second argument. The exception of the first failure is chained.
         """
-        response = self.client_pinpoint.get_apps()
-        all_application_ids = [item['Id'] for item in response['ApplicationsResponse']['Item']]
-        self.delete_application(all_application_ids)
+        if not result['Failed']:
+            return
+        application_id, first_error = next(iter(result['Failed'].items()))
+        raise Exception(f'Unable to delete {len(result["Failed"])} of '
+                        f'{len(result["Failed"]) + len(result["Succeeded"])} applications, '
+                        f'eg {application_id}: {first_error}', result) from first_error
 
 
     def get_segments(self):
@@ -227,14 +529,29 @@ class PinpointCampaignBuilder:
 
     def __set_data(self,
                    data,
-                   csv_file_fields):
+                   csv_file_fields,
+                   columnar=False):
         """
             Private method. Assigns data to self.email_data or self.sms_data
             Returns a list containing data to be assigned in
             [['EMAIL', 'sirohisajal@gmail.com', 'sajal']] format.
             
-            param: data: A list containing either list or dictionary.
+            param: data: A list containing either list or dictionary, or an EndpointStore.
+
+            param: columnar: If true, data is converted into an EndpointStore
         """
+        if isinstance(data, EndpointStore):
+            if not self.csv_file_fields:
+                self.csv_file_fields = data.fields
+            return data
+
+        if columnar:
+            fields = csv_file_fields if csv_file_fields else self.csv_file_fields
+            assert fields, 'Please provide the list of fields in csv_file_fields parameter to create columnar data'
+            if not self.csv_file_fields:
+                self.csv_file_fields = fields
+            return EndpointStore.from_rows(fields, data)
+
         if isinstance(data[0], dict):
             assert self.csv_file_fields or csv_file_fields, \
                 f'Please provide the list of fields in csv_file_fields parameter, with a list of keys used to define ' \
@@ -262,7 +579,8 @@ class PinpointCampaignBuilder:
 
     def set_email_data(self,
                        data,
-                       csv_file_fields=None):
+                       csv_file_fields=None,
+                       columnar=False):
         """
             Data of CSV file that will be imported to pinpont.
 
@@ -282,14 +600,19 @@ class PinpointCampaignBuilder:
                                             'Attributes.Name': 'sajal sirohi'
                                         },   --> Row 1 data
                                     ]
+                                    An EndpointStore can also be passed as data.
+
+            param: columnar:        Default False. If true, data is stored in a compact columnar EndpointStore
+                                    instead of a list of lists. Use it for large audiences.
         """
         assert data, 'Data field can not be Null'
-        self.email_data = self.__set_data(data=data, csv_file_fields=csv_file_fields)
+        self.email_data = self.__set_data(data=data, csv_file_fields=csv_file_fields, columnar=columnar)
 
 
     def set_sms_data(self,
                      data,
-                     csv_file_fields=None):
+                     csv_file_fields=None,
+                     columnar=False):
         """
             Data of CSV file that will be imported to pinpont.
 
@@ -309,9 +632,13 @@ class PinpointCampaignBuilder:
                                             'Attributes.Name': 'sajal sirohi'
                                         },   --> Row 1 data
                                 ]
+                                An EndpointStore can also be passed as data.
+
+            param: columnar:        Default False. If true, data is stored in a compact columnar EndpointStore
+                                    instead of a list of lists. Use it for large audiences.
         """
         assert data, 'Data field can not be Null'
-        self.sms_data = self.__set_data(data=data, csv_file_fields=csv_file_fields)
+        self.sms_data = self.__set_data(data=data, csv_file_fields=csv_file_fields, columnar=columnar)
 
 
     def set_csv_file_headers(self,
@@ -323,6 +650,32 @@ class PinpointCampaignBuilder:
         self.csv_file_fields = csv_file_fields
 
 
+    @traced()
+    def clean_audience(self,
+                       default_country_code=None,
+                       csv_file_fields=None):
+        """
+            Normalizes and validates the addresses of self.email_data and self.sms_data, and removes duplicate
+            endpoints across both the channels, before the csv file is created. Emails are lower cased and
+            validated, phone numbers are converted to E.164 format. Invalid and duplicate rows are removed from
+            the data, and a report of the rejected rows is returned, see AudienceCleaner.clean.
+
+            param: default_country_code: Prefixed to phone numbers without international code, eg '+91'
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        cleaner = AudienceCleaner(default_country_code=default_country_code)
+        cleaned, report = cleaner.clean(self.csv_file_fields, {'EMAIL': self.email_data, 'SMS': self.sms_data})
+        if 'EMAIL' in cleaned:
+            self.email_data = cleaned['EMAIL']
+        if 'SMS' in cleaned:
+            self.sms_data = cleaned['SMS']
+        return report
+
+
+    @traced()
     def create_dynamic_segment(self,
                                channel,
                                write_segment_request=None,
@@ -361,19 +714,24 @@ class PinpointCampaignBuilder:
             self.email_dynamic_segment_id = response['SegmentResponse']['Id']
         else:
             self.sms_dynamic_segment_id = response['SegmentResponse']['Id']
+        self.tracer.set_attributes(channel=channel, segment_id=response['SegmentResponse']['Id'])
 
         return response if return_full_response else ''
 
 
+    @traced()
     def import_data_into_pinpoint(self,
                                   csv_file_s3_url=None,
                                   return_full_response=False,
                                   s3_csv_file_path=None,
                                   bucket_name=None,
                                   import_job_request=None,
-                                  file_name='pinpoint_details.csv',
+                                  file_name=None,
                                   update_base_segment=False,
                                   import_segment_name='Base Segment',
+                                  wait_till=100,
+                                  import_format='CSV',
+                                  define_segment=True,
                                   **additional_args):
         """
             Import the csv file present either in the bucket (path : s3://bucket_name/{application_id}/{filename}.csv) or
@@ -389,25 +747,43 @@ class PinpointCampaignBuilder:
             param: bucket_name:           Assign the name of bucket. Then program will assume the path 
                                           {BUCKET_NAME}/{application_id}/{file_name}.csv
 
-            param: file_name:             Name of the CSV file stored in the s3 bucket.
+            param: file_name:             Name of the CSV file stored in the s3 bucket. Default pinpoint_details.csv,
+                                          or pinpoint_details.json for JSON format.
 
             param: update_base_segment:   Default Value false. It will create a new segment by 
                                           default behavior. If set to True, it will update previously
                                           created segment with the new CSV file data.
+
+            param: wait_till:             In seconds, time to wait for the import job before raising error
+
+            param: import_format:         'CSV' | 'JSON'. Use JSON for newline delimited JSON files created with
+                                          create_json_stream. csv_file_s3_url / s3_csv_file_path then point to
+                                          the JSON file.
+
+            param: define_segment:        Default True. If False, endpoints are only created / updated, no segment is
+                                          created or updated, so membership of the base segment is not changed.
+                                          Note that updating an imported segment replaces its endpoints with the
+                                          endpoints of the file.
         """
         assert self.s3_bucket or bucket_name or csv_file_s3_url, f'Please provide a CSV file url, or a bucket name with file path'
 
         if not self.s3_bucket and bucket_name:
             self.s3_bucket = bucket_name
 
+        assert import_format in ['CSV', 'JSON'], 'import_format should be either "CSV" or "JSON"'
+        extensions = ('.csv',) if import_format == 'CSV' else ('.json', '.jsonl', '.ndjson')
+        if not file_name:
+            file_name = 'pinpoint_details.csv' if import_format == 'CSV' else 'pinpoint_details.json'
+
         if csv_file_s3_url:
-            assert csv_file_s3_url.endswith('.csv') and csv_file_s3_url.startswith('s3://'), \
-                f'Format of URL is wrong. URL should start with s3:// and end with .csv. eg s3://XX/details.csv'
+            assert csv_file_s3_url.endswith(extensions) and csv_file_s3_url.startswith('s3://'), \
+                f'Format of URL is wrong. URL should start with s3:// and end with {" or ".join(extensions)}. ' \
+                f'eg s3://XX/details{extensions[0]}'
             csv_file_url = csv_file_s3_url
 
         elif self.s3_bucket and s3_csv_file_path:
-            assert s3_csv_file_path.endswith('.csv'), \
-                f'Given s3 path should end with .csv'
+            assert s3_csv_file_path.endswith(extensions), \
+                f'Given s3 path should end with {" or ".join(extensions)}'
             csv_file_url = f's3://{self.s3_bucket}/{s3_csv_file_path}'
 
         elif self.s3_bucket:
@@ -416,13 +792,16 @@ class PinpointCampaignBuilder:
         if not import_job_request:
             import_job_request = {
                 'DefineSegment': True,
-                'Format': 'CSV',
+                'Format': import_format,
                 'RegisterEndpoints': True,
                 'RoleArn': self.pinpoint_acc_arn,
                 'S3Url': csv_file_url,
                 'SegmentName': import_segment_name
             }
-            if update_base_segment:
+            if not define_segment:
+                import_job_request['DefineSegment'] = False
+                del import_job_request['SegmentName']
+            elif update_base_segment:
                 assert self.base_segment_id, f'Base_segment_id should be present if you want to update'\
                                 f' it, else pass False in update_base_segment param'
                 import_job_request['SegmentId'] = self.base_segment_id
@@ -434,54 +813,256 @@ class PinpointCampaignBuilder:
         )
 
         job_id = response['ImportJobResponse']['Id']
+        self.tracer.set_attributes(job_id=job_id, s3_url=import_job_request.get('S3Url'))
+        with self.tracer.span('wait_for_import_job', job_id=job_id):
+            import_job_response = self.job_waiter.wait(self.application_id, job_id, timeout=wait_till)
+        self.tracer.set_attributes(segment_id=import_job_response.get('Definition', {}).get('SegmentId'),
+                                   rows=import_job_response.get('TotalProcessed'),
+                                   failures=import_job_response.get('TotalFailures'))
         if 'SegmentName' in import_job_request:
             # It is a new segment
-            if self.is_segment_imported(job_id):
-                response_for_segments = self.client_pinpoint.get_segments(
-                    ApplicationId=self.application_id
-                )
-                self.base_segment_id = response_for_segments['SegmentsResponse']['Item'][0]['Id']
-        else:
-            while not self.is_segment_imported(job_id):
-                print("Waiting for import job to be completed...")
+            self.base_segment_id = import_job_response['Definition']['SegmentId']
+
+
+    @traced()
+    def import_data_into_pinpoint_sharded(self,
+                                          shard_count=4,
+                                          rows_per_shard=None,
+                                          email_rows=None,
+                                          sms_rows=None,
+                                          csv_file_fields=None,
+                                          s3_folder=None,
+                                          import_segment_name='Base Segment',
+                                          update_base_segment=False,
+                                          max_workers=8,
+                                          **additional_args):
+        """
+            Imports a large audience by splitting it into shard_count CSV parts, which are uploaded to
+            s3 concurrently and imported with one import job per part, concurrently, without defining a segment.
+            Once all the parts are imported, one job over the folder of the parts defines the base segment with
+            all their endpoints, as an import job into an existing segment replaces its endpoints. Sets
+            self.base_segment_id and returns the combined result of all the jobs, see ShardedImporter.import_rows.
+
+            param: shard_count:     Number of CSV parts. Used only if number of rows is known (lists or EndpointStore).
+
+            param: rows_per_shard:  Number of rows in each part. Required if rows are generators.
+
+            param: email_rows:      Rows for EMAIL channel, as in create_csv_stream. Default self.email_data
+
+            param: sms_rows:        Rows for SMS channel, as in create_csv_stream. Default self.sms_data
+
+            param: s3_folder:       Folder in self.s3_bucket where parts are stored, other files in it are deleted.
+                                    Default is {application_id}/pinpoint_details_parts
+
+            param: update_base_segment: Default False. If true, endpoints of self.base_segment_id are replaced with
+                                        the endpoints of all the parts
+
+            param: max_workers:     Maximum number of concurrent part uploads
+        """
+        assert self.s3_bucket, 'Please provide a bucket name using s3_bucket_details method'
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        channel_rows = self.__channel_rows(email_rows, sms_rows)
+
+        if not rows_per_shard:
+            assert all(hasattr(rows, '__len__') for rows in channel_rows), \
+                'Please provide rows_per_shard if rows are generators'
+            total_rows = sum(len(rows) for rows in channel_rows)
+            rows_per_shard = max(1, -(-total_rows // shard_count))
+
+        if update_base_segment:
+            assert self.base_segment_id, f'Base_segment_id should be present if you want to update'\
+                                         f' it, else pass False in update_base_segment param'
+
+        importer = ShardedImporter(self.client_pinpoint, self.s3_obj, self.application_id,
+                                   self.pinpoint_acc_arn, self.job_waiter, max_workers=max_workers)
+        result = importer.import_rows(self.__import_fields(),
+                                      self.__with_endpoint_ids(
+                                          chain.from_iterable(self.__iter_csv_rows(rows) for rows in channel_rows)),
+                                      rows_per_shard,
+                                      s3_folder if s3_folder else f'{self.application_id}/pinpoint_details_parts',
+                                      segment_name=import_segment_name,
+                                      segment_id=self.base_segment_id if update_base_segment else None)
+        self.base_segment_id = result['SegmentId']
+        self.tracer.set_attributes(segment_id=result['SegmentId'], rows=result['TotalRows'],
+                                   parts=result['Parts'], job_ids=','.join(result['JobIds']))
+        return result
+
+
+    @traced()
+    def import_delta_into_pinpoint(self,
+                                   email_rows=None,
+                                   sms_rows=None,
+                                   csv_file_fields=None,
+                                   s3_file_name='pinpoint_delta.csv',
+                                   full_s3_file_name='pinpoint_full.csv',
+                                   import_segment_name='Base Segment',
+                                   part_size=8 * 1024 * 1024,
+                                   **additional_args):
+        """
+            Imports only the rows which are new or changed since the last delta import. A fingerprint of every imported
+            endpoint is kept in {s3_folder_path}/endpoint_fingerprints.bin.gz (and .keys.gz) next to
+            application_details.json. In one pass over the rows, the changed rows are streamed to
+            {s3_folder_path}/{s3_file_name} and all the rows to {s3_folder_path}/{full_s3_file_name}, and only the
+            file which is needed is kept:
+                - only changed rows, base segment exists: the delta file is imported without updating any segment,
+                  as updating the imported base segment would replace its endpoints with only the changed ones.
+                - new rows, or no base segment: the full file is imported into the base segment (a new base segment
+                  is created if there is none), so that the new endpoints become its members.
+            Rows are written with the endpoint Id derived from ChannelType and Address if csv_file_fields has no Id,
+            so changed rows update their endpoints instead of creating new ones.
+            Endpoints which are not present anymore are written to {s3_folder_path}/deleted_endpoints.csv with their Id,
+            they are not removed from pinpoint (but are not members of a base segment updated with the full file). The
+            fingerprints are saved only after the import succeeds. Returns
+            {
+                'New': 123, 'Changed': 123, 'Unchanged': 123, 'Deleted': 123,
+                'Imported': True | False,
+                'ImportedFile': 's3 key' | None,
+                'DeletedEndpointsFile': 's3 key' | None
+            }
+
+            param: email_rows / sms_rows : Rows as in create_csv_stream. Default self.email_data / self.sms_data
+        """
+        assert self.s3_bucket, 'Please provide a bucket name using s3_bucket_details method'
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        channel_rows = self.__channel_rows(email_rows, sms_rows)
+
+        index_prefix = f'{self.s3_folder_path}/endpoint_fingerprints'
+        delta = DeltaImport(self.csv_file_fields, FingerprintIndex.load(self.s3_obj, index_prefix))
+        base_segment_id = self.base_segment_id
+
+        delta_file_name = f'{self.s3_folder_path}/{s3_file_name}'
+        full_file_name = f'{self.s3_folder_path}/{full_s3_file_name}'
+        rows = chain.from_iterable(self.__iter_csv_rows(rows) for rows in channel_rows)
+        with self.s3_obj.open_multipart_writer(delta_file_name, part_size=part_size) as delta_file, \
+                self.s3_obj.open_multipart_writer(full_file_name, part_size=part_size) as full_file:
+            delta_writer, full_writer = csv.writer(delta_file), csv.writer(full_file)
+            delta_writer.writerow(self.__import_fields())
+            full_writer.writerow(self.__import_fields())
+            for chunk in iter(lambda: list(islice(rows, 4096)), []):
+                full_writer.writerows(self.__with_endpoint_ids(chunk))
+                delta_writer.writerows(self.__with_endpoint_ids(delta.changed_rows(chunk)))
+
+            result = dict(delta.stats)
+            import_full = bool(result['New'] or (result['Changed'] and not base_segment_id))
+            import_delta = bool(result['Changed'] and not import_full)
+            if not import_full:
+                full_file.abort()
+            if not import_delta:
+                delta_file.abort()
+
+        result['Imported'] = import_full or import_delta
+        result['ImportedFile'] = None
+        if import_full:
+            result['ImportedFile'] = full_file_name
+            self.import_data_into_pinpoint(s3_csv_file_path=full_file_name,
+                                           update_base_segment=bool(base_segment_id),
+                                           import_segment_name=import_segment_name)
+        elif import_delta:
+            result['ImportedFile'] = delta_file_name
+            self.import_data_into_pinpoint(s3_csv_file_path=delta_file_name, define_segment=False)
+
+        result['Deleted'] = delta.deleted_count()
+        result['DeletedEndpointsFile'] = None
+        if result['Deleted']:
+            result['DeletedEndpointsFile'] = f'{self.s3_folder_path}/deleted_endpoints.csv'
+            with self.s3_obj.open_multipart_writer(result['DeletedEndpointsFile'], part_size=part_size) as deleted_file:
+                key_fields, deleted_keys = with_endpoint_ids(
+                    [self.csv_file_fields[position] for position in delta.key_positions], delta.deleted_keys())
+                csv_writer = csv.writer(deleted_file)
+                csv_writer.writerow(key_fields)
+                csv_writer.writerows(deleted_keys)
+
+        delta.next_index.save(self.s3_obj, index_prefix, part_size=part_size)
+        self.tracer.set_attributes(new=result['New'], changed=result['Changed'],
+                                   unchanged=result['Unchanged'], deleted=result['Deleted'])
+        return result
+
+
+    @traced()
+    def upsert_endpoints(self,
+                         email_rows=None,
+                         sms_rows=None,
+                         csv_file_fields=None,
+                         cost_model=None,
+                         s3_file_name='pinpoint_upsert.csv',
+                         **additional_args):
+        """
+            Writes endpoints into the application, choosing the cheaper path for the number of rows: concurrent
+            update_endpoints_batch calls for small updates (milliseconds), or an import job for large ones.
+            Returns the result of EndpointUpsertEngine.upsert.
+
+            Rows are in the same format as set_email_data / set_sms_data (lists, dictionaries or EndpointStore).
+            If csv_file_fields has no Id column, both paths use the id derived from ChannelType and Address, the same
+            id as in the files of create_csv, create_csv_stream and the import methods, so an address upserted by
+            either path is the endpoint imported before.
+
+            Segment membership is not changed by either path: the import job does not define or update a segment,
+            as updating the imported base segment would replace its endpoints with only the upserted ones. So
+            updated endpoints stay in the base segment, but new endpoints are not added to it (and to the dynamic
+            segments built on it). Use import_data_into_pinpoint with the whole audience to add new endpoints
+            to the base segment.
+
+            param: email_rows / sms_rows : Default self.email_data / self.sms_data
+
+            param: cost_model            : CostModel deciding the path, tune it for your account
+
+            param: s3_file_name          : Name of the CSV file in {s3_folder_path}, if import path is chosen
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        channel_rows = self.__channel_rows(email_rows, sms_rows, require_all=False)
+
+        def import_rows(fields, rows):
+            assert self.s3_bucket, 'Please provide a bucket name using s3_bucket_details method'
+            s3_file_path = f'{self.s3_folder_path}/{s3_file_name}'
+            with self.s3_obj.open_multipart_writer(s3_file_path) as csv_file:
+                csv_writer = csv.writer(csv_file)
+                csv_writer.writerow(fields)
+                csv_writer.writerows(rows)
+            self.import_data_into_pinpoint(s3_csv_file_path=s3_file_path, define_segment=False)
+
+        row_count = sum(len(rows) for rows in channel_rows) \
+            if all(hasattr(rows, '__len__') for rows in channel_rows) else None
+        engine = EndpointUpsertEngine(self.client_pinpoint, self.application_id, import_rows, cost_model=cost_model)
+        result = engine.upsert(self.csv_file_fields,
+                               chain.from_iterable(self.__iter_csv_rows(rows) for rows in channel_rows),
+                               row_count=row_count)
+        self.tracer.set_attributes(path=result['Path'], rows=result['Rows'])
+        return result
 
 
     def is_segment_imported(self,
                             job_id,
                             wait_till=100):
         """
-            Returns True if import_job is completed
+            Returns True if import_job is completed. Blocks till the job is completed, and raises
+            an exception if the job fails. Job is polled by self.job_waiter with adaptive backoff,
+            use self.job_waiter.add directly to wait for many jobs at once without blocking.
 
             param: wait_till:      In seconds, try to import for this much time before raising error
         """
-        time_out = 0
-        response_import_job = self.client_pinpoint.get_import_job(
-            ApplicationId=self.application_id,
-            JobId=job_id
-        )
-        print("Current Status for import job ->", response_import_job['ImportJobResponse']['JobStatus'])
-        while response_import_job['ImportJobResponse']['JobStatus'] != 'COMPLETED':
-            time_out += 5
-            time.sleep(5)
-            response_import_job = self.client_pinpoint.get_import_job(
-                ApplicationId=self.application_id,
-                JobId=job_id
-            )
-            print("Current Status for import job ->",
-                  response_import_job['ImportJobResponse']['JobStatus'])
-            if response_import_job['ImportJobResponse']['JobStatus'] == 'FAILED':
-                raise Exception("Import Failed, please try again.")
-
-            if time_out >= wait_till:
-                print("Time out happened, not able to import file, Abandoning...")
-                raise Exception("Import Failed, please try again.")
+        self.job_waiter.wait(self.application_id, job_id, timeout=wait_till)
         return True
 
 
+    @traced()
     def create_all_segments(self,
                             csv_file_s3_url=None,
                             s3_bucket_name=None,
                             import_segment_name='Base Segment',
+                            parallel=False,
+                            dry_run=False,
+                            upload_csv=False,
+                            campaign_args=None,
+                            max_workers=4,
                             **additional_args):
         """
             Creates all of the segments for the user. i.e. Base segment [Imported], Email segment [Dynamic], SMS 
@@ -499,10 +1080,29 @@ class PinpointCampaignBuilder:
 
             param: imported_segment_name: if not given, 'Base Segment' will be used as the imported 
                                      segment name
+
+            param: parallel:         Default False. If true, steps are run with the plan of build_setup_plan, where
+                                     independent steps (eg the two dynamic segments) run concurrently. Returns the
+                                     results of the steps.
+
+            param: dry_run:          If true, nothing is run and the plan is returned, see ExecutionPlan.dry_run
+
+            param: upload_csv:       Only used with parallel / dry_run. If true, csv file is streamed to s3 as a step of the plan.
+
+            param: campaign_args:    Only used with parallel / dry_run. Dictionary of arguments of create_campaign, if
+                                     campaign should be created as the last step of the plan.
             """
 
         assert csv_file_s3_url or s3_bucket_name, 'Please provide either the csv file url or the s3 bucket name'
 
+        if parallel or dry_run:
+            plan = self.build_setup_plan(csv_file_s3_url=csv_file_s3_url,
+                                         s3_bucket_name=s3_bucket_name,
+                                         import_segment_name=import_segment_name,
+                                         upload_csv=upload_csv,
+                                         campaign_args=campaign_args)
+            return plan.dry_run() if dry_run else plan.run(max_workers=max_workers)
+
         if csv_file_s3_url:
             self.import_data_into_pinpoint(csv_file_s3_url=csv_file_s3_url)
         else:
@@ -513,6 +1113,69 @@ class PinpointCampaignBuilder:
         self.create_dynamic_segment(channel='SMS')
 
 
+    def build_setup_plan(self,
+                         csv_file_s3_url=None,
+                         s3_bucket_name=None,
+                         import_segment_name='Base Segment',
+                         upload_csv=False,
+                         campaign_args=None):
+        """
+            Returns the ExecutionPlan to set up segments (and optionally a campaign) of the application. Steps are
+                create_csv            -> streams the csv file to s3, if upload_csv is true
+                enable_channels       -> enables the channels of channel_type, runs along with create_csv
+                import_base_segment   -> after create_csv
+                create_email_segment  -> after import_base_segment
+                create_sms_segment    -> after import_base_segment
+                create_campaign       -> after all the segments and channels, if campaign_args is given
+            Segment steps are the ones of the sequential path of create_all_segments. Building the plan does not
+            change the builder, s3_bucket_name is used from the steps which need it, when the plan is run.
+            Params are same as create_all_segments. Use plan.describe() to see the plan, and plan.run() to run it.
+        """
+        assert csv_file_s3_url or s3_bucket_name, 'Please provide either the csv file url or the s3 bucket name'
+
+        def create_csv():
+            self.__use_s3_bucket(s3_bucket_name)
+            return self.create_csv_stream(stream_to_s3=True)
+
+        def import_base_segment():
+            if csv_file_s3_url:
+                return self.import_data_into_pinpoint(csv_file_s3_url=csv_file_s3_url)
+            self.__use_s3_bucket(s3_bucket_name)
+            return self.import_data_into_pinpoint(import_segment_name=import_segment_name)
+
+        plan = ExecutionPlan()
+        import_depends_on = []
+        if upload_csv:
+            assert not csv_file_s3_url, 'upload_csv can only be used with s3_bucket_name'
+            plan.add_step('create_csv', create_csv)
+            import_depends_on.append('create_csv')
+
+        plan.add_step('enable_channels', lambda: self.__ensure_channels(self.channel_type))
+        plan.add_step('import_base_segment', import_base_segment, depends_on=import_depends_on)
+
+        plan.add_step('create_email_segment', lambda: self.create_dynamic_segment(channel='EMAIL'),
+                      depends_on=['import_base_segment'])
+        plan.add_step('create_sms_segment', lambda: self.create_dynamic_segment(channel='SMS'),
+                      depends_on=['import_base_segment'])
+        segment_steps = ['create_email_segment', 'create_sms_segment']
+
+        if campaign_args is not None:
+            plan.add_step('create_campaign', lambda: self.create_campaign(**campaign_args),
+                          depends_on=segment_steps + ['enable_channels'])
+        return plan
+
+
+    def __use_s3_bucket(self,
+                        s3_bucket_name):
+        """
+            Private method. Switches the builder to s3_bucket_name, if it is given and is not the current bucket
+        """
+        if s3_bucket_name and s3_bucket_name != self.s3_bucket:
+            self.s3_bucket = s3_bucket_name
+            self.s3_obj = s3_utility(self.s3_bucket)
+
+
+    @traced()
     def create_csv(self,
                    local_csv_file_name='/tmp/pp_details.csv',
                    upload_to_s3=False,
@@ -550,8 +1213,8 @@ class PinpointCampaignBuilder:
             assert self.email_data, 'Provide email_data using method set_email_data'
             with open(local_csv_file_name, 'w') as csv_file:
                 csv_writer = csv.writer(csv_file)
-                csv_writer.writerow(self.csv_file_fields)
-                csv_writer.writerows(self.email_data)
+                csv_writer.writerow(self.__import_fields())
+                csv_writer.writerows(self.__with_endpoint_ids(self.__csv_rows(self.email_data)))
 
         if 'SMS' in self.channel_type:
             assert self.sms_data, 'Provide sms_data using the method set_sms_data'
@@ -559,8 +1222,14 @@ class PinpointCampaignBuilder:
             with open(local_csv_file_name, open_file_as) as csv_file:
                 csv_writer = csv.writer(csv_file)
                 if open_file_as == 'w':
-                    csv_writer.writerow(self.csv_file_fields)
-                csv_writer.writerows(self.sms_data)
+                    csv_writer.writerow(self.__import_fields())
+                csv_writer.writerows(self.__with_endpoint_ids(self.__csv_rows(self.sms_data)))
+
+        self.tracer.set_attributes(
+            rows=sum(len(data) for channel, data in (('EMAIL', self.email_data), ('SMS', self.sms_data))
+                     if channel in self.channel_type),
+            bytes=os.path.getsize(local_csv_file_name)
+        )
 
         if upload_to_s3:
             assert self.s3_bucket or ('s3_bucket_name' in additional_args), 'Please provide a bucket name'
@@ -574,9 +1243,269 @@ class PinpointCampaignBuilder:
 
             assert s3_file_path.endswith('.csv'), 's3_file_path should end with .csv'
 
-            self.s3_obj.upload_file_to_s3(local_csv_file_name, s3_file_path)         
+            with self.tracer.span('upload_to_s3', bytes=os.path.getsize(local_csv_file_name), s3_key=s3_file_path):
+                self.s3_obj.upload_file_to_s3(local_csv_file_name, s3_file_path)
 
 
+    def __channel_rows(self,
+                       email_rows,
+                       sms_rows,
+                       require_all=True):
+        """
+            Private method. Returns the rows of every channel in self.channel_type, email first. Rows which
+            are not given default to self.email_data / self.sms_data.
+
+            param: require_all  : If True, every channel of channel_type should have rows. Else channels
+                                  without rows are skipped, and atleast one channel should have rows.
+        """
+        channel_rows = []
+        for channel, rows, data, method in (('EMAIL', email_rows, self.email_data, 'set_email_data'),
+                                            ('SMS', sms_rows, self.sms_data, 'set_sms_data')):
+            if channel not in self.channel_type:
+                continue
+            rows = rows if rows is not None else data
+            if rows is not None:
+                channel_rows.append(rows)
+            else:
+                assert not require_all, f'Provide {channel.lower()}_rows or set {channel.lower()} data using ' \
+                                        f'method {method}'
+        assert channel_rows, 'Provide rows, or set data using set_email_data / set_sms_data'
+        return channel_rows
+
+
+    def __import_fields(self):
+        """
+            Private method. Returns the columns of the import files: self.csv_file_fields, and the Id column
+            if csv_file_fields has none, see __with_endpoint_ids
+        """
+        return with_endpoint_ids(self.csv_file_fields, ())[0]
+
+
+    def __with_endpoint_ids(self,
+                            rows):
+        """
+            Private method. Returns rows (in the order of self.csv_file_fields) with the id derived from ChannelType
+            and Address appended, if csv_file_fields has no Id column. Every import file and upsert_endpoints use
+            the same id, so an address is always written to the same endpoint instead of a new one.
+        """
+        return with_endpoint_ids(self.csv_file_fields, rows)[1]
+
+
+    def __csv_rows(self,
+                   data):
+        """
+            Private method. Returns rows of data in the order of self.csv_file_fields. data
+            is either a list of lists or an EndpointStore.
+        """
+        if isinstance(data, EndpointStore):
+            return data.select(self.csv_file_fields)
+        return data
+
+
+    def __iter_csv_rows(self,
+                        rows):
+        """
+            Private method. Lazily yields the rows of rows in the order of self.csv_file_fields.
+            Rows can be lists or dictionaries, and rows can be any iterable including a generator,
+            so that the whole data is never held in memory.
+        """
+        if isinstance(rows, EndpointStore):
+            yield from rows.select(self.csv_file_fields)
+            return
+
+        rows = iter(rows)
+        for first_row in rows:
+            break
+        else:
+            return
+
+        if isinstance(first_row, dict):
+            fields = self.csv_file_fields
+            if len(fields) == 1:
+                field = fields[0]
+                get_row = lambda row: (row[field],)
+            else:
+                get_row = itemgetter(*fields)
+            yield get_row(first_row)
+            yield from map(get_row, rows)
+        else:
+            yield first_row
+            yield from rows
+
+
+    def __iter_csv_row_chunks(self,
+                              rows,
+                              chunk_rows):
+        """
+            Private method. Yields the rows of rows in the order of self.csv_file_fields, as lists of upto
+            chunk_rows rows. Lists of lists are sliced, without going through a generator per row.
+        """
+        if isinstance(rows, list) and not (rows and isinstance(rows[0], dict)):
+            for start in range(0, len(rows), chunk_rows):
+                yield rows[start:start + chunk_rows]
+            return
+        rows = rows.select(self.csv_file_fields) if isinstance(rows, EndpointStore) else self.__iter_csv_rows(rows)
+        yield from iter(lambda: list(islice(rows, chunk_rows)), [])
+
+
+    def __iter_csv_chunks(self,
+                          channel_rows,
+                          counts,
+                          chunk_size,
+                          chunk_rows=4096):
+        """
+            Private method. Lazily yields the CSV file, header first, as encoded chunks of about chunk_size
+            bytes. Rows are written chunk_rows at a time with writerows into an in memory buffer, which is
+            encoded once per chunk. Number of rows written is kept in counts['Rows'].
+        """
+        chunk = io.StringIO()
+        csv_writer = csv.writer(chunk)
+        csv_writer.writerow(self.__import_fields())
+        for rows in channel_rows:
+            for row_chunk in self.__iter_csv_row_chunks(rows, chunk_rows):
+                csv_writer.writerows(self.__with_endpoint_ids(row_chunk))
+                counts['Rows'] += len(row_chunk)
+                if chunk.tell() >= chunk_size:
+                    yield chunk.getvalue().encode('utf-8')
+                    chunk.seek(0)
+                    chunk.truncate()
+        yield chunk.getvalue().encode('utf-8')
+
+
+    @traced()
+    def create_csv_stream(self,
+                          email_rows=None,
+                          sms_rows=None,
+                          local_csv_file_name='/tmp/pp_details.csv',
+                          upload_to_s3=False,
+                          stream_to_s3=False,
+                          csv_file_fields=None,
+                          s3_file_path=None,
+                          s3_file_name='pinpoint_details.csv',
+                          buffer_size=1024 * 1024,
+                          part_size=8 * 1024 * 1024,
+                          max_concurrency=None,
+                          **additional_args):
+        """
+            Streaming version of create_csv, meant for audiences too big to be kept in memory. Rows are consumed
+            from iterators / generators, written in one pass with a large buffer, and only a bounded amount of
+            data is in memory at any time. Returns the number of rows written.
+
+            param: email_rows           : EndpointStore, or iterable (list, generator etc.) of rows, each a list or a dictionary keyed
+                                          by csv_file_fields. If not given, self.email_data is used.
+
+            param: sms_rows             : Same as email_rows, for the SMS channel. If not given, self.sms_data is used.
+
+            param: local_csv_file_name  : Name of the csv file generated locally. Not used if stream_to_s3 is True.
+
+            param: upload_to_s3         : True | False. If true, local file is uploaded to s3 after it is written.
+
+            param: stream_to_s3         : True | False. If true, rows are directly streamed to s3 as a multipart
+                                          upload and no local file is created.
+
+            param: s3_file_path         : Whole path of the file in the bucket. Default path is
+                                          {application_id}/{s3_file_name}
+
+            param: buffer_size          : Size in bytes of the CSV chunks encoded and written at once
+
+            param: part_size            : Size of each part in bytes when streaming to s3, minimum 5 MB
+
+            param: max_concurrency      : Only used with stream_to_s3. If given, CSV chunks are produced from the rows
+                                          while up to max_concurrency parts are uploaded in parallel by
+                                          s3_utility.upload_stream, instead of one part at a time.
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        channel_rows = self.__channel_rows(email_rows, sms_rows)
+
+        if upload_to_s3 or stream_to_s3:
+            assert self.s3_bucket, 'Please provide a bucket name using s3_bucket_details method'
+            s3_file_path = s3_file_path if s3_file_path else f'{self.application_id}/{s3_file_name}'
+            assert s3_file_path.endswith('.csv'), 's3_file_path should end with .csv'
+
+        counts = {'Rows': 0}
+        chunks = self.__iter_csv_chunks(channel_rows, counts, buffer_size)
+        if stream_to_s3 and max_concurrency:
+            file_size = self.s3_obj.upload_stream(s3_file_path, chunks, part_size=part_size,
+                                                  max_concurrency=max_concurrency)
+            self.tracer.set_attributes(rows=counts['Rows'], bytes=file_size, stream_to_s3=stream_to_s3)
+            return counts['Rows']
+
+        if stream_to_s3:
+            csv_file = self.s3_obj.open_multipart_writer(s3_file_path, part_size=part_size)
+        else:
+            csv_file = open(local_csv_file_name, 'wb')
+
+        with csv_file:
+            for chunk in chunks:
+                csv_file.write(chunk)
+        row_count = counts['Rows']
+
+        file_size = csv_file.bytes_written if stream_to_s3 else os.path.getsize(local_csv_file_name)
+        self.tracer.set_attributes(rows=row_count, bytes=file_size, stream_to_s3=stream_to_s3)
+
+        if upload_to_s3 and not stream_to_s3:
+            with self.tracer.span('upload_to_s3', bytes=file_size, s3_key=s3_file_path):
+                self.s3_obj.upload_file_to_s3(local_csv_file_name, s3_file_path)
+
+        return row_count
+
+
+    @traced()
+    def create_json_stream(self,
+                           email_rows=None,
+                           sms_rows=None,
+                           local_json_file_name='/tmp/pp_details.json',
+                           upload_to_s3=False,
+                           stream_to_s3=False,
+                           csv_file_fields=None,
+                           s3_file_path=None,
+                           s3_file_name='pinpoint_details.json',
+                           buffer_size=1024 * 1024,
+                           part_size=8 * 1024 * 1024,
+                           **additional_args):
+        """
+            Same as create_csv_stream, but writes the endpoints as newline delimited JSON, which is imported with
+            import_data_into_pinpoint(import_format='JSON'). Columns are named as in csv_file_fields (eg
+            'Attributes.Name'), but empty values are not written, so endpoints with sparse attributes give a much
+            smaller file than CSV. Returns the number of endpoints written.
+
+            Params are same as create_csv_stream. Default s3 path is {application_id}/{s3_file_name}
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+
+        channel_rows = self.__channel_rows(email_rows, sms_rows)
+
+        if upload_to_s3 or stream_to_s3:
+            assert self.s3_bucket, 'Please provide a bucket name using s3_bucket_details method'
+            s3_file_path = s3_file_path if s3_file_path else f'{self.application_id}/{s3_file_name}'
+            assert s3_file_path.endswith(('.json', '.jsonl', '.ndjson')), 's3_file_path should end with .json'
+
+        if stream_to_s3:
+            json_file = self.s3_obj.open_multipart_writer(s3_file_path, part_size=part_size)
+        else:
+            json_file = open(local_json_file_name, 'w', encoding='utf-8', buffering=buffer_size)
+
+        with json_file:
+            json_writer = NdjsonEndpointWriter(json_file, self.__import_fields())
+            for rows in channel_rows:
+                json_writer.write_rows(self.__with_endpoint_ids(self.__iter_csv_rows(rows)))
+
+        file_size = json_file.bytes_written if stream_to_s3 else os.path.getsize(local_json_file_name)
+        self.tracer.set_attributes(rows=json_writer.row_count, bytes=file_size, stream_to_s3=stream_to_s3)
+
+        if upload_to_s3 and not stream_to_s3:
+            with self.tracer.span('upload_to_s3', bytes=file_size, s3_key=s3_file_path):
+                self.s3_obj.upload_file_to_s3(local_json_file_name, s3_file_path)
+
+        return json_writer.row_count
+
+
+    @traced()
     def create_campaign(self,
                         campaign_name=None,
                         write_campaign_request=None,
@@ -624,6 +1553,7 @@ class PinpointCampaignBuilder:
         else:
             raise Exception('Only EMAIL or SMS or both them allowed in channel_type')
 
+        self.__ensure_channels(self.channel_type)
         message_configuration = {}
 
         if not template_config:
@@ -651,6 +1581,8 @@ class PinpointCampaignBuilder:
             ApplicationId=self.application_id,
             WriteCampaignRequest=_write_campaign_request
         )
+        self.campaign_index.add(response['CampaignResponse'])
+        self.tracer.set_attributes(campaign_id=response['CampaignResponse']['Id'], segment_id=self.segment_id_for_campaign)
         return response if return_full_response else ''
 
     
@@ -676,6 +1608,9 @@ class PinpointCampaignBuilder:
         """
 
 
+        self.__ensure_channels(['EMAIL'])
+        from botocore.exceptions import ClientError
+
         try:
             response = self.client_pinpoint.send_messages(
                 ApplicationId=self.application_id,
@@ -741,6 +1676,9 @@ class PinpointCampaignBuilder:
                                         https://docs.aws.amazon.com/pinpoint/latest/userguide/channels-sms-countries.html
         """
         
+        self.__ensure_channels(['SMS'])
+        from botocore.exceptions import ClientError
+
         try:
             response = self.client_pinpoint.send_messages(
                 ApplicationId=self.application_id,
@@ -768,33 +1706,238 @@ class PinpointCampaignBuilder:
             print("Message sent! Message ID: "
                     + response['MessageResponse']['Result'][destination_number]['MessageId'])
 
-    
-    def get_application_analytics(self):
+
+    @traced()
+    def send_bulk_txn_email(self,
+                            recipients,
+                            sender=None,
+                            subject=None,
+                            body_text=None,
+                            body_html=None,
+                            char_set="UTF-8",
+                            batch_size=100,
+                            max_workers=8):
+        """
+        Send the same transactional email to many recipients. Addresses are packed 100 per send_messages
+        call and the calls are sent concurrently. Returns results and failures per address,
+        see BulkSender.send for the structure.
+
+        param: recipients   : Iterable of email addresses, or of dictionaries with 'Address' key and
+                              AddressConfiguration overrides, eg {'Address': 'a@b.com', 'Substitutions': {...}}
+
+        param: sender       : Email id used for sending out emails.
+
+        param: subject      : Subject of the email
+
+        param: body_text    : Text content of the email
+
+        param: body_html    : If receivers client supports html, format your body_text using html
+
+        param: max_workers  : Maximum number of concurrent send_messages calls
+        """
+        message_configuration = {
+            'EmailMessage': {
+                'FromAddress': sender,
+                'SimpleEmail': {
+                    'Subject': {
+                        'Charset': char_set,
+                        'Data': subject
+                    },
+                    'HtmlPart': {
+                        'Charset': char_set,
+                        'Data': body_html
+                    },
+                    'TextPart': {
+                        'Charset': char_set,
+                        'Data': body_text
+                    }
+                }
+            }
+        }
+        self.__ensure_channels(['EMAIL'])
+        bulk_sender = BulkSender(self.client_pinpoint, self.application_id,
+                                 batch_size=batch_size, max_workers=max_workers)
+        result = bulk_sender.send(recipients, 'EMAIL', message_configuration)
+        self.tracer.set_attributes(sent=len(result['Results']), failed=len(result['Failures']))
+        return result
+
+
+    @traced()
+    def send_bulk_txn_sms(self,
+                          recipients,
+                          origination_number=None,
+                          message="Hello from pinpoint",
+                          message_type='TRANSACTIONAL',
+                          registered_keyword='',
+                          sender_id='',
+                          batch_size=100,
+                          max_workers=8):
+        """
+        Send the same transactional sms to many recipients. Numbers are packed 100 per send_messages
+        call and the calls are sent concurrently. Returns results and failures per number,
+        see BulkSender.send for the structure.
+
+        param: recipients            : Iterable of phone numbers in E.164 format, or of dictionaries with 'Address'
+                                       key and AddressConfiguration overrides, eg {'Address': '+1...', 'BodyOverride': 'Hi'}
+
+        param: origination_number    : The phone number or short code to send the message from.
+
+        param: message               : Content of the message
+
+        param: message_type          : TRANSACTIONAL (time sensitive messages) | PROMOTIONAL (marketing related messages)
+
+        param: max_workers           : Maximum number of concurrent send_messages calls
+        """
+        message_configuration = {
+            'SMSMessage': {
+                'Body': message,
+                'Keyword': registered_keyword,
+                'MessageType': message_type,
+                'OriginationNumber': origination_number,
+                'SenderId': sender_id
+            }
+        }
+        self.__ensure_channels(['SMS'])
+        bulk_sender = BulkSender(self.client_pinpoint, self.application_id,
+                                 batch_size=batch_size, max_workers=max_workers)
+        result = bulk_sender.send(recipients, 'SMS', message_configuration)
+        self.tracer.set_attributes(sent=len(result['Results']), failed=len(result['Failures']))
+        return result
+
+
+    def render_recipients(self,
+                          rows,
+                          body_template=None,
+                          title_template=None,
+                          default_substitutions=None,
+                          csv_file_fields=None,
+                          address_field='Address'):
+        """
+        Lazily renders personalized messages for rows of endpoint data, without any API call. Yields
+        recipients for send_bulk_txn_email / send_bulk_txn_sms, with the rendered BodyOverride and TitleOverride.
+        Eg. pp.send_bulk_txn_sms(pp.render_recipients(rows, body_template='Hi {{Attributes.Name}}'))
+
+        param: rows                  : Rows in the order of csv_file_fields, dictionaries keyed by the fields,
+                                       or an EndpointStore
+
+        param: body_template         : Template of the body, variables written as {{Attributes.Name}}
+
+        param: title_template        : Template of the email subject
+
+        param: default_substitutions : JSON string or dictionary of values used for missing (None) variables,
+                                       as DefaultSubstitutions of pinpoint templates
+
+        param: address_field         : Column holding the email address / phone number
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+        renderer = MessageRenderer(body=body_template, title=title_template,
+                                   default_substitutions=default_substitutions)
+        return renderer.recipients(self.csv_file_fields, self.__iter_csv_rows(rows), address_field=address_field)
+
+
+    def preview_messages(self,
+                         rows,
+                         body_template=None,
+                         title_template=None,
+                         default_substitutions=None,
+                         limit=10,
+                         csv_file_fields=None):
+        """
+        Returns the messages rendered for the first limit rows, as [{'body': ..., 'title': ...}]. Params are
+        same as render_recipients, no address_field is needed as addresses are not part of the preview.
+
+        param: limit                 : Number of rows rendered
+        """
+        assert self.csv_file_fields or csv_file_fields, 'Please provide csv_file_fields parameter'
+        if csv_file_fields:
+            self.csv_file_fields = csv_file_fields
+        renderer = MessageRenderer(body=body_template, title=title_template,
+                                   default_substitutions=default_substitutions)
+        return list(islice(renderer.render_rows(self.csv_file_fields, self.__iter_csv_rows(rows)), limit))
+
+
+    def get_application_analytics(self,
+                                  start_time=None,
+                                  end_time=None,
+                                  use_cache=True,
+                                  max_workers=8):
         """
-        Returns analytics for your whole application. Provides all the possible analytics
+        Returns analytics for your whole application. Provides all the possible analytics.
+        All the KPIs are fetched concurrently, and values are served from self.kpi_cache
+        till they expire. Use invalidate_kpi_cache to force a refresh.
+
+        param: start_time / end_time : datetime, date range of the KPIs. Default range of pinpoint is used if not given.
+
+        param: use_cache             : Default True. Set to false to always fetch the KPIs from pinpoint.
+
+        param: max_workers           : Maximum number of KPIs fetched at once
         """
         kpi_names = ['successful-deliveries-grouped-by-campaign', 'successful-delivery-rate',
                     'email-open-rate', 'unique-deliveries', 'unique-deliveries-grouped-by-date',
                     'successful-delivery-rate-grouped-by-date', 'email-open-rate-grouped-by-campaign']
-        response = {}
-        {
-            response.update({
-                kpi_name: self.get_kpi_value(kpi_name)
-            }) for kpi_name in kpi_names
-        }
-            
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            kpi_values = executor.map(lambda kpi_name: self.get_kpi_value(kpi_name, start_time=start_time,
+                                                                          end_time=end_time, use_cache=use_cache),
+                                      kpi_names)
+            response = dict(zip(kpi_names, kpi_values))
+
         return response
 
-    
+
+    def invalidate_kpi_cache(self,
+                             kpi_name=None,
+                             application_id=None):
+        """
+        Removes cached KPI values of the application (self.application_id if not given). Only values of
+        kpi_name are removed if it is given. Returns the number of removed values.
+        """
+        application_id = application_id if application_id else self.application_id
+        return self.kpi_cache.invalidate(predicate=lambda key: key[0] == application_id and
+                                                               (kpi_name is None or key[1] == kpi_name))
+
+
     def get_kpi_value(self,
-                      kpi_name):
+                      kpi_name,
+                      start_time=None,
+                      end_time=None,
+                      use_cache=True):
+        """
+        Returns the value of the KPI-name. Values are cached in self.kpi_cache, keyed by application,
+        KPI and date range.
+
+        param: start_time / end_time : datetime, date range of the KPI. Default range of pinpoint is used if not given.
+
+        param: use_cache             : Default True. Set to false to fetch the value from pinpoint and refresh the cache.
+        """
+        cache_key = (self.application_id, kpi_name, start_time, end_time)
+        if use_cache:
+            return self.kpi_cache.get_or_set(cache_key,
+                                             lambda: self.__fetch_kpi_value(kpi_name, start_time, end_time))
+        kpi_value = self.__fetch_kpi_value(kpi_name, start_time, end_time)
+        self.kpi_cache.set(cache_key, kpi_value)
+        return kpi_value
+
+
+    def __fetch_kpi_value(self,
+                          kpi_name,
+                          start_time=None,
+                          end_time=None):
         """
-        Returns the value of the KPI-name
+        Private method. Fetches the value of the KPI-name from pinpoint
         """
+        date_range = {}
+        if start_time:
+            date_range['StartTime'] = start_time
+        if end_time:
+            date_range['EndTime'] = end_time
+
         kpi_value = 0
         response = self.client_pinpoint.get_application_date_range_kpi(
             ApplicationId=self.application_id,
-            KpiName=kpi_name
+            KpiName=kpi_name,
+            **date_range
         )
 
         response_rows = response['ApplicationDateRangeKpiResponse']['KpiResult']['Rows']
@@ -803,8 +1946,8 @@ class PinpointCampaignBuilder:
                 kpi_value = sum([self.__get_rounded_value(float(messages_delivered['Values'][0]['Value']))
                                 for messages_delivered in response_rows])
             elif kpi_name == 'unique-deliveries-grouped-by-date' or kpi_name == 'successful-delivery-rate-grouped-by-date':
+                kpi_value = {}
                 for data in response_rows:
-                    kpi_value = {}
                     value = self.__get_rounded_value(float(data['Values'][0]['Value']))
                     if kpi_name == 'successful-delivery-rate-grouped-by-date':
                         value = value * 100
@@ -812,9 +1955,11 @@ class PinpointCampaignBuilder:
 
             elif kpi_name == 'email-open-rate-grouped-by-campaign':
                 kpi_value = []
+                campaign_names = self.campaign_index.get_names([data['GroupedBys'][0]['Value']
+                                                                for data in response_rows])
                 for data in response_rows:
                     campaign_id = data['GroupedBys'][0]['Value']
-                    campaign_name = self.get_campaign_name(campaign_id)
+                    campaign_name = campaign_names[campaign_id]
                     kpi_value.append({'Campaign Name': campaign_name,
                                     'Value': self.__get_rounded_value(float(data['Values'][0]['Value']) * 100)})
             else:
@@ -825,16 +1970,88 @@ class PinpointCampaignBuilder:
         return kpi_value
 
 
+    def sync_kpi_history(self,
+                         kpi_names=('unique-deliveries-grouped-by-date', 'successful-delivery-rate-grouped-by-date'),
+                         default_start_time=None,
+                         max_days_per_request=30):
+        """
+        Stores the daily values of the *-grouped-by-date KPIs in self.kpi_history_store. Only the days
+        from the newest stored day onwards are fetched, the newest day is fetched again as its value may
+        have been partial. Returns dictionary of KPI name -> number of days fetched.
+
+        param: kpi_names:            KPIs to be synced, only *-grouped-by-date KPIs are allowed
+
+        param: default_start_time:   datetime from which history is fetched if nothing is stored yet.
+                                     Default is 30 days ago.
+
+        param: max_days_per_request: Date range of a single get_application_date_range_kpi call
+        """
+        if not self.kpi_history_store:
+            self.kpi_history_store = KpiHistoryStore()
+
+        end_time = datetime.now()
+        days_fetched = {}
+        for kpi_name in kpi_names:
+            assert kpi_name.endswith('-grouped-by-date'), f'{kpi_name} is not a *-grouped-by-date KPI'
+            latest_day = self.kpi_history_store.latest_day(self.application_id, kpi_name)
+            if latest_day:
+                start_time = datetime.strptime(latest_day, '%Y-%m-%d')
+            else:
+                start_time = default_start_time if default_start_time else end_time - timedelta(days=30)
+
+            days_fetched[kpi_name] = 0
+            while start_time < end_time:
+                window_end_time = min(end_time, start_time + timedelta(days=max_days_per_request))
+                values = self.__fetch_kpi_value(kpi_name, start_time, window_end_time)
+                if values:
+                    self.kpi_history_store.add_values(self.application_id, kpi_name, values)
+                    days_fetched[kpi_name] += len(values)
+                start_time = window_end_time
+
+        return days_fetched
+
+
+    def get_kpi_history(self,
+                        kpi_name,
+                        start_day=None,
+                        end_day=None):
+        """
+        Returns the stored daily values of the KPI as dictionary of day -> value, without calling pinpoint.
+        Call sync_kpi_history to fetch the new days.
+
+        param: start_day / end_day : Inclusive date range as YYYY-MM-DD strings
+        """
+        assert self.kpi_history_store, 'KPI history is empty, call sync_kpi_history first'
+        return self.kpi_history_store.get_values(self.application_id, kpi_name,
+                                                 start_day=start_day, end_day=end_day)
+
+
+    @traced()
+    def sync_templates(self,
+                       templates,
+                       dry_run=False):
+        """
+        Creates the new message templates and updates the changed ones in parallel. Templates whose
+        content is same as the deployed version are skipped. Returns the result of TemplateSync.sync
+
+        param: templates: Directory with email/<name>.json and sms/<name>.json files, each holding the
+                          EmailTemplateRequest / SMSTemplateRequest, or the same as a dictionary:
+                          {
+                              'EMAIL': {'welcome_en': {'Subject': ..., 'HtmlPart': ...}},
+                              'SMS': {'welcome_en': {'Body': ...}}
+                          }
+
+        param: dry_run:   True | False, if true only returns the templates which would be created or updated
+        """
+        return self.template_sync.sync(templates, dry_run=dry_run)
+
+
     def get_campaign_name(self,
                           campaign_id):
         """
-        Returns the name of campaign
+        Returns the name of campaign, using self.campaign_index
         """
-        response = self.client_pinpoint.get_campaign(
-            ApplicationId=self.application_id,
-            CampaignId=campaign_id
-        )
-        return response['CampaignResponse']['Name']
+        return self.campaign_index.get_name(campaign_id)
 
     
     def __get_rounded_value(self,
@@ -862,10 +2079,12 @@ class PinpointCampaignBuilder:
 
     def fetch_pinpoint_data_from_s3(self):
         """
-            Read pinpoint application details.json file from the s3 bucket, using s3_folder_path if provided
+            Read pinpoint application details.json file from the s3 bucket, using s3_folder_path if provided.
+            The parsed file is cached across builders, and is downloaded again only if it has changed in s3,
+            see s3_utility.configure_json_cache
         """
         assert self.s3_bucket, 'Set s3 details using the s3_bucket_details method'
-        application_details = self.s3_obj.get_json_file(f'{self.s3_folder_path}/application_details.json')
+        application_details = self.s3_obj.get_json_file_cached(f'{self.s3_folder_path}/application_details.json')
         self.base_segment_id = application_details['base_segment_id'] if 'base_segment_id' in application_details else None
         self.email_dynamic_segment_id = application_details['email_dynamic_segment_id'] if 'email_dynamic_segment_id' in\
                                application_details else None
@@ -883,7 +2102,7 @@ class PinpointCampaignBuilder:
             'email_dynamic_segment_id': self.email_dynamic_segment_id,
             'sms_dynamic_segment_id': self.sms_dynamic_segment_id
         }
-        self.s3_obj.upload_json_to_s3(f'{self.s3_folder_path}/application_details.json', data_json)
+        self.s3_obj.put_json_to_s3(f'{self.s3_folder_path}/application_details.json', data_json)
 
 
     def __str__(self):
@@ -1,16 +1,238 @@
+import copy
+import hashlib
+import io
 import json
-import boto3
-from botocore.errorfactory import ClientError
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from ..client_factory import client_factory
+from ..ttl_cache.ttl_cache import TTLCache
+
+
+class MultipartUploadWriter:
+    """
+    File like object which streams whatever is written into it to s3 as a multipart
+    upload, so that large files never have to be staged on the local disk or kept
+    fully in memory. Only one part (part_size bytes) is buffered at any time.
+    """
+
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+    def __init__(self, s3_client, bucket_name, file_name, part_size=8 * 1024 * 1024, encoding='utf-8'):
+        """
+            :param s3_client: boto3 s3 client used for the upload
+            :param bucket_name: Name of the bucket
+            :param file_name: Key of the object which will be created
+            :param part_size: Size of each uploaded part in bytes. AWS requires atleast 5 MB
+            :param encoding: Encoding used for str data written into the object
+        """
+        assert part_size >= self.MIN_PART_SIZE, 'part_size should be atleast 5 MB'
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.file_name = file_name
+        self.part_size = part_size
+        self.encoding = encoding
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket_name,
+                                                                 Key=self.file_name)['UploadId']
+
+
+    def write(self, data):
+        """
+            Buffers data and uploads a part as soon as part_size bytes are available
+        """
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+
+    def flush(self):
+        """
+            Parts are uploaded as they fill up, so there is nothing to flush. Allows wrapping the
+            writer in gzip.GzipFile or io.TextIOWrapper.
+        """
+
+
+    def _upload_part(self):
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(Bucket=self.bucket_name,
+                                              Key=self.file_name,
+                                              PartNumber=part_number,
+                                              UploadId=self._upload_id,
+                                              Body=bytes(self._buffer))
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer = bytearray()
+
+
+    def close(self):
+        """
+            Uploads the remaining buffered data and completes the multipart upload
+        """
+        if self._upload_id is None:
+            return
+        if self._buffer or not self._parts:
+            self._upload_part()
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket_name,
+                                                 Key=self.file_name,
+                                                 UploadId=self._upload_id,
+                                                 MultipartUpload={'Parts': self._parts})
+        self._upload_id = None
+
+
+    def abort(self):
+        """
+            Aborts the multipart upload, discarding all the uploaded parts
+        """
+        if self._upload_id is None:
+            return
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket_name,
+                                              Key=self.file_name,
+                                              UploadId=self._upload_id)
+        self._upload_id = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Seekable read only file like object over a bytes like object (bytes, bytearray, memoryview,
+    mmap ...). The data is not copied, every read returns only the requested slice.
+    """
+
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        data = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+
+    def readinto(self, buffer):
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+
+    def tell(self):
+        return self._position
+
+
+class IterableReader(io.RawIOBase):
+    """
+    Non seekable read only file like object over an iterable of bytes or str chunks, eg a
+    generator producing CSV lines. Chunks are pulled only when they are read.
+    """
+
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self._chunks = iter(chunks)
+        self._pending = memoryview(b'')
+        self.encoding = encoding
+        self.bytes_read = 0
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            if isinstance(chunk, str):
+                chunk = chunk.encode(self.encoding)
+            self._pending = memoryview(chunk).cast('B')
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.bytes_read += size
+        return size
 
 
 class s3_utility:
 
+    # Parsed json files, shared by all the objects of the process. Entries are
+    # (ETag, data, time of the last check) keyed by (bucket, key)
+    json_cache = TTLCache(ttl=3600, max_size=1024)
+    json_cache_max_age = 0
+    json_cache_dir = None
+    _json_cache_lock = threading.Lock()
+
 
     def __init__(self, BUCKET_NAME, *args):
         
         self.bucket_name = BUCKET_NAME
-        self.s3_client   = boto3.client('s3')
-        self.s3_resource = boto3.resource('s3')
+        self.s3_client   = client_factory.get_client('s3')
+
+
+    @classmethod
+    def configure_json_cache(cls, ttl=3600, max_size=1024, max_age=0, disk_cache_dir=None):
+        """
+            Configures the cache used by get_json_file_cached, discarding the cached files
+            :param ttl: In seconds, time after which a file is dropped from memory
+            :param max_size: Maximum number of files kept in memory, least recently used file is dropped after it
+            :param max_age: In seconds, time for which a cached file is returned without checking s3. With the
+                            default 0, every read makes a conditional GET, which does not download an unchanged file
+            :param disk_cache_dir: If given, files are also kept in this folder, so that new processes can
+                                   make conditional GETs as well
+        """
+        with cls._json_cache_lock:
+            cls.json_cache = TTLCache(ttl=ttl, max_size=max_size)
+            cls.json_cache_max_age = max_age
+            cls.json_cache_dir = disk_cache_dir
+            if disk_cache_dir:
+                os.makedirs(disk_cache_dir, exist_ok=True)
+
+
+    @property
+    def s3_resource(self):
+        """
+        Shared s3 resource of the process, created on first use
+        """
+        return client_factory.get_resource('s3')
         
     
     def get_json_file(self, file_name):
@@ -27,25 +249,244 @@ class s3_utility:
                             please check this functionality')
 
     
+    def get_json_file_cached(self, file_name):
+        """
+            Same as get_json_file, but the parsed file is cached (see configure_json_cache). A cached file is
+            revalidated with a conditional GET (IfNoneMatch), so it is downloaded and parsed again only if it
+            has changed in s3. A copy is returned, so the cached data can not be changed by the caller.
+            :param file_name: Name of the file
+            Raises s3_client.exceptions.NoSuchKey if the file is not present
+        """
+        key = (self.bucket_name, file_name)
+        entry = self.json_cache.get(key)
+        if entry is None:
+            entry = self.__read_json_disk_cache(key)
+        if entry is not None and time.monotonic() - entry[2] < self.json_cache_max_age:
+            return copy.deepcopy(entry[1])
+
+        request = {'Bucket': self.bucket_name, 'Key': file_name}
+        if entry is not None:
+            request['IfNoneMatch'] = entry[0]
+        try:
+            response = self.s3_client.get_object(**request)
+        except self.s3_client.exceptions.NoSuchKey:
+            self.invalidate_json_cache(file_name)
+            raise
+        except Exception as ex:
+            error = getattr(ex, 'response', {})
+            not_modified = error.get('Error', {}).get('Code') in ('304', 'NotModified') or \
+                error.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304
+            if not (entry is not None and not_modified):
+                print(ex)
+                raise Exception('Custom Exception --\nUnable to read json data from s3, \
+                                please check this functionality')
+            entry = (entry[0], entry[1], time.monotonic())
+        else:
+            entry = (response['ETag'], json.loads(response['Body'].read().decode('utf-8')), time.monotonic())
+            self.__write_json_disk_cache(key, entry)
+        self.json_cache.set(key, entry)
+        return copy.deepcopy(entry[1])
+
+
+    def invalidate_json_cache(self, file_name=None):
+        """
+            Drops file_name from the memory and disk cache of get_json_file_cached. If file_name is not given,
+            all the files of the bucket are dropped from the memory cache, disk entries are revalidated on use.
+        """
+        if file_name is not None:
+            self.json_cache.invalidate((self.bucket_name, file_name))
+            self.__remove_json_disk_cache((self.bucket_name, file_name))
+        else:
+            self.json_cache.invalidate(predicate=lambda key: key[0] == self.bucket_name)
+
+
+    def __disk_cache_path(self, key):
+        if not self.json_cache_dir:
+            return None
+        return os.path.join(self.json_cache_dir, hashlib.sha1('/'.join(key).encode('utf-8')).hexdigest() + '.json')
+
+
+    def __read_json_disk_cache(self, key):
+        """
+            Private method. Returns the entry of key stored on disk, None if there is none
+        """
+        path = self.__disk_cache_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        # Time of the check is not known, so the entry is always revalidated
+        return (cached['ETag'], cached['Data'], float('-inf'))
+
+
+    def __write_json_disk_cache(self, key, entry):
+        """
+            Private method. Stores the entry of key on disk. The disk cache is best effort, if it can not be
+            written (directory not writable, disk full ...) the entry is kept only in memory.
+        """
+        path = self.__disk_cache_path(key)
+        if not path:
+            return
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                json.dump({'ETag': entry[0], 'Data': entry[1]}, cache_file)
+            os.replace(temp_path, path)
+        except OSError:
+            self.__remove_file(temp_path)
+
+
+    def __remove_json_disk_cache(self, key):
+        path = self.__disk_cache_path(key)
+        if path:
+            self.__remove_file(path)
+
+
+    def __remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
     def put_json_to_s3(self, file_name, file_data):
         """
-            Helper function to put data to S3
+            Helper function to put data to S3. The cache of get_json_file_cached is updated with the new data.
+            Returns the ETag of the file.
             :param file_name: Name of the file
             :param file_data: Data to be put into the file
         """
+        body = json.dumps(file_data)
+        response = self.s3_client.put_object(Bucket=self.bucket_name,
+                                             Key=file_name,
+                                             Body=body)
+        key = (self.bucket_name, file_name)
+        if response.get('ETag'):
+            entry = (response['ETag'], json.loads(body), time.monotonic())
+            self.json_cache.set(key, entry)
+            self.__write_json_disk_cache(key, entry)
+        else:
+            self.invalidate_json_cache(file_name)
+        return response.get('ETag')
+
+    
+    def get_file_bytes(self, file_name):
+        """
+            Helper function to read a file from s3 as bytes
+            :param file_name: Name of the file
+            Returns None if the file is not present
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_name)
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+
+    def get_file_stream(self, file_name):
+        """
+            Helper function to read a file from s3 without loading it in memory
+            :param file_name: Name of the file
+            Returns the streaming body (file like object with a read method), None if the file is not present
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_name)
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return response['Body']
+
+
+    def put_bytes_to_s3(self, file_name, file_data):
+        """
+            Helper function to put bytes to S3
+            :param file_name: Name of the file
+            :param file_data: bytes to be put into the file
+        """
         self.s3_client.put_object(Bucket=self.bucket_name,
                                   Key=file_name,
-                                  Body=json.dumps(file_data))
+                                  Body=file_data)
+        self.invalidate_json_cache(file_name)
 
-    
-    def upload_file_to_s3(self, local_file_name, file_name):
+
+    def upload_file_to_s3(self, local_file_name, file_name, transfer_config=None):
         """
             Helper function to upload files into s3
             :param local_file_name: Name of the locally generated file. Eg. details.csv
             :param file_name: File path where file has to be stored
+            :param transfer_config: TransferConfig of the upload, see transfer_config
+        """
+        self.s3_client.upload_file(local_file_name, self.bucket_name, file_name, Config=transfer_config)
+
+
+    def transfer_config(self, part_size=8 * 1024 * 1024, max_concurrency=10, multipart_threshold=None, **config_args):
+        """
+            Returns a boto3 TransferConfig for the upload methods
+            :param part_size: Size of each part in bytes, minimum 5 MB
+            :param max_concurrency: Number of parts uploaded in parallel
+            :param multipart_threshold: Size in bytes from which multipart upload is used, default part_size
+            :param config_args: Any other argument of boto3.s3.transfer.TransferConfig
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(multipart_threshold=multipart_threshold if multipart_threshold else part_size,
+                              multipart_chunksize=part_size,
+                              max_concurrency=max_concurrency,
+                              **config_args)
+
+
+    def upload_buffer(self, file_name, buffer, part_size=8 * 1024 * 1024, max_concurrency=10, transfer_config=None):
+        """
+            Helper function to upload data held in memory, eg a memoryview, bytearray or mmap, without
+            copying it into a temp file. Parts are uploaded in parallel.
+            :param file_name: File path where file has to be stored
+            :param buffer: Any bytes like object
+            :param part_size: Size of each part in bytes, minimum 5 MB
+            :param max_concurrency: Number of parts uploaded in parallel
+            :param transfer_config: TransferConfig, overrides part_size and max_concurrency
         """
-        self.s3_resource.Bucket(self.bucket_name)\
-            .upload_file(local_file_name, file_name)
+        config = transfer_config if transfer_config else self.transfer_config(part_size, max_concurrency)
+        self.s3_client.upload_fileobj(MemoryViewReader(buffer), self.bucket_name, file_name, Config=config)
+
+
+    def upload_stream(self, file_name, producer, part_size=8 * 1024 * 1024, max_concurrency=10,
+                      transfer_config=None, encoding='utf-8'):
+        """
+            Helper function to upload data as it is produced, without a local file. Parts are uploaded
+            in parallel while the producer keeps producing the next ones. Returns the number of bytes uploaded.
+            :param file_name: File path where file has to be stored
+            :param producer: File like object with a read method (binary or text), or an iterable (eg a generator) of
+                             bytes or str chunks
+            :param part_size: Size of each part in bytes, minimum 5 MB
+            :param max_concurrency: Number of parts uploaded in parallel
+            :param transfer_config: TransferConfig, overrides part_size and max_concurrency
+            :param encoding: Encoding of str chunks, and of the data read from text files
+        """
+        config = transfer_config if transfer_config else self.transfer_config(part_size, max_concurrency)
+        if hasattr(producer, 'read'):
+            # File like objects are read in parts through IterableReader too, so that the bytes are counted
+            file_obj = producer
+            producer = iter(lambda: file_obj.read(config.multipart_chunksize) or None, None)
+
+        reader = IterableReader(producer, encoding=encoding)
+        # BufferedReader keeps reading till a full part is read, short parts are rejected by s3
+        self.s3_client.upload_fileobj(io.BufferedReader(reader, buffer_size=config.multipart_chunksize),
+                                      self.bucket_name, file_name, Config=config)
+        return reader.bytes_read
+
+
+    def open_multipart_writer(self, file_name, part_size=8 * 1024 * 1024):
+        """
+            Helper function to stream data into s3 without creating a local file
+            :param file_name: File path where file has to be stored
+            :param part_size: Size of each part uploaded to s3, minimum 5 MB
+            Usage:
+                with s3_obj.open_multipart_writer('app_id/details.csv') as s3_file:
+                    s3_file.write(data)
+        """
+        return MultipartUploadWriter(self.s3_client, self.bucket_name, file_name, part_size=part_size)
 
 
     def download_file(self, s3_file_name, local_file_name):
@@ -64,7 +505,135 @@ class s3_utility:
             in the bucket or not
         """
         try:
-            self.s3_client(Bucket=self.bucket_name, Key=file_name)
-        except ClientError:
-            return False
-        return True
\ No newline at end of file
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=file_name)
+        except Exception as ex:
+            if getattr(ex, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+
+    def __map_keys(self, function, file_names, max_workers, errors=None):
+        """
+            Private method. Calls function for every key, at most max_workers at once. Returns {key: result} of the
+            keys for which function succeeded. Exceptions are collected per key into errors. If errors is not given,
+            an exception naming the failed keys is raised once all the keys are done.
+        """
+        file_names = list(dict.fromkeys(file_names))
+        if not file_names:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(file_names))) as executor:
+            futures = {file_name: executor.submit(function, file_name) for file_name in file_names}
+
+        results, failures = {}, {}
+        for file_name, future in futures.items():
+            if future.exception() is None:
+                results[file_name] = future.result()
+            else:
+                failures[file_name] = future.exception()
+        if errors is not None:
+            errors.update(failures)
+        elif failures:
+            details = '\n'.join(f'{file_name}: {ex}' for file_name, ex in islice(failures.items(), 10))
+            raise Exception(f'Custom Exception --\nFailed for {len(failures)} of {len(file_names)} files\n{details}')
+        return results
+
+
+    def files_present(self, file_names, max_workers=16, errors=None):
+        """
+            Helper function to check many files at once
+            :param file_names: Iterable of file paths
+            :param max_workers: Maximum number of requests in flight
+            :param errors: Dictionary filled with {file_name: exception} of the failed checks. If not given, an
+                           exception is raised after all the files are checked, if any check failed.
+            Returns {file_name: True | False}
+        """
+        return self.__map_keys(self.is_file_present, file_names, max_workers, errors)
+
+
+    def get_json_files(self, file_names, max_workers=16, cached=True, errors=None):
+        """
+            Helper function to read many json files at once
+            :param file_names: Iterable of file paths
+            :param max_workers: Maximum number of requests in flight
+            :param cached: If true, files are read with get_json_file_cached
+            :param errors: Dictionary filled with {file_name: exception} of the failed reads. If not given, an
+                           exception is raised after all the files are read, if any read failed.
+            Returns {file_name: data}, data is None for files which are not present
+        """
+        def get_json(file_name):
+            if not cached:
+                data = self.get_file_bytes(file_name)
+                return json.loads(data.decode('utf-8')) if data is not None else None
+            try:
+                return self.get_json_file_cached(file_name)
+            except self.s3_client.exceptions.NoSuchKey:
+                return None
+
+        return self.__map_keys(get_json, file_names, max_workers, errors)
+
+
+    def put_json_files(self, files, max_workers=16, errors=None):
+        """
+            Helper function to write many json files at once
+            :param files: Dictionary of file path to data
+            :param max_workers: Maximum number of requests in flight
+            :param errors: Dictionary filled with {file_name: exception} of the failed writes. If not given, an
+                           exception is raised after all the files are written, if any write failed.
+            Returns {file_name: ETag}
+        """
+        return self.__map_keys(lambda file_name: self.put_json_to_s3(file_name, files[file_name]), files,
+                               max_workers, errors)
+
+
+    def list_files(self, prefix='', page_size=1000):
+        """
+            Helper function to list all the files under a prefix, reading every page of list_objects_v2
+            :param prefix: Prefix of the keys, eg 'app_id/'
+            :param page_size: Number of keys fetched in one call, maximum 1000
+            Yields {'Key': 'string', 'Size': 123, 'ETag': 'string', 'LastModified': datetime, ...}
+        """
+        request = {'Bucket': self.bucket_name, 'Prefix': prefix, 'MaxKeys': page_size}
+        while True:
+            response = self.s3_client.list_objects_v2(**request)
+            yield from response.get('Contents', [])
+            if not response.get('IsTruncated'):
+                break
+            request['ContinuationToken'] = response['NextContinuationToken']
+
+
+    def delete_files(self, file_names, max_workers=4, batch_size=1000):
+        """
+            Helper function to delete many files, batch_size keys per delete_objects call
+            :param file_names: Iterable of file paths
+            :param max_workers: Maximum number of delete_objects calls in flight
+            :param batch_size: Number of keys in one call, maximum 1000
+            Returns {file_name: {'Deleted': True} | {'Deleted': False, 'Code': 'string', 'Message': 'string'}}
+        """
+        assert 0 < batch_size <= 1000, 'batch_size should be between 1 and 1000'
+        file_names = iter(dict.fromkeys(file_names))
+        batches = list(iter(lambda: list(islice(file_names, batch_size)), []))
+        for file_name in (key for batch in batches for key in batch):
+            self.invalidate_json_cache(file_name)
+
+        def delete_batch(batch_index):
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': file_name} for file_name in batches[batch_index]], 'Quiet': True}
+                )
+            except Exception as ex:
+                # Whole call failed, every key of the batch is reported with the error of the call
+                error = getattr(ex, 'response', {}).get('Error', {})
+                return {file_name: {'Deleted': False, 'Code': error.get('Code', type(ex).__name__),
+                                    'Message': error.get('Message', str(ex))}
+                        for file_name in batches[batch_index]}
+            result = {file_name: {'Deleted': True} for file_name in batches[batch_index]}
+            for error in response.get('Errors', []):
+                result[error['Key']] = {'Deleted': False, 'Code': error.get('Code'), 'Message': error.get('Message')}
+            return result
+
+        result = {}
+        for batch_result in self.__map_keys(delete_batch, range(len(batches)), max_workers).values():
+            result.update(batch_result)
+        return result
\ No newline at end of file
@@ -0,0 +1,238 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+import csv
+import io
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from threading import BoundedSemaphore
+
+
+class ShardedImporter:
+    """
+    Imports a large audience into one segment by splitting it into several CSV parts.
+    Parts are uploaded to s3 concurrently, and one import job per part writes its endpoints,
+    without defining a segment, as soon as the part is uploaded. An import job into an existing
+    SegmentId replaces the endpoints of the segment, so parts can not be imported into the same
+    segment one after another. Once all the part jobs are done, one more job over the folder of
+    the parts defines (or updates) the segment with the endpoints of all the parts, without
+    registering them again. Jobs are waited for through the futures of a JobWaiter, so no thread
+    sleeps per job.
+    """
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 s3_obj,
+                 application_id,
+                 pinpoint_access_role_arn,
+                 job_waiter,
+                 max_workers=8,
+                 job_timeout=None):
+        """
+        param: client_for_pinpoint: boto3 pinpoint client
+
+        param: s3_obj:              s3_utility object of the bucket where parts are uploaded
+
+        param: job_waiter:          JobWaiter polling the import jobs
+
+        param: max_workers:         Maximum number of concurrent uploads. Also bounds the number of
+                                    parts kept in memory at once.
+
+        param: job_timeout:         In seconds, deadline of every import job. Default is the
+                                    default_timeout of job_waiter.
+        """
+        self.client = client_for_pinpoint
+        self.s3_obj = s3_obj
+        self.application_id = application_id
+        self.pinpoint_acc_arn = pinpoint_access_role_arn
+        self.job_waiter = job_waiter
+        self.max_workers = max_workers
+        self.job_timeout = job_timeout
+
+
+    def import_rows(self,
+                    csv_file_fields,
+                    rows,
+                    rows_per_shard,
+                    s3_prefix,
+                    segment_name='Base Segment',
+                    segment_id=None):
+        """
+        Splits rows into parts of rows_per_shard rows, uploads and imports them, then defines
+        the segment over all the parts. Returns the combined result of the import jobs of the parts
+        {
+            'SegmentId': 'string',
+            'SegmentJobId': 'string',            --> job which defined the segment
+            'JobIds': ['string'],                --> jobs of the parts
+            'Parts': ['s3 key of part'],
+            'TotalRows': 123,
+            'TotalProcessed': 123,
+            'TotalFailures': 123,
+            'FailedPieces': 123,
+            'JobStatus': 'COMPLETED'
+        }
+
+        param: rows:        Iterable of rows in the order of csv_file_fields
+
+        param: s3_prefix:   Folder in the bucket where parts are uploaded as part-00000.csv ...
+                            Files already in the folder are deleted first, as the segment is
+                            defined from all the files of the folder.
+
+        param: segment_id:  If given, the endpoints of this existing segment are replaced with
+                            the endpoints of all the parts, else a new segment named segment_name
+                            is created.
+        """
+        assert rows_per_shard > 0, 'rows_per_shard should be greater than 0'
+        result = {'SegmentId': segment_id, 'SegmentJobId': None, 'JobIds': [], 'Parts': [], 'TotalRows': 0}
+        in_flight = BoundedSemaphore(self.max_workers)
+        rows = iter(rows)
+        self.__clear_folder(s3_prefix)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as upload_executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as job_executor:
+            job_futures = []
+            while True:
+                part_rows = list(islice(rows, rows_per_shard))
+                if not part_rows:
+                    break
+                in_flight.acquire()
+                s3_key = f'{s3_prefix}/part-{len(result["Parts"]):05d}.csv'
+                body = self.__to_csv_bytes(csv_file_fields, part_rows)
+                result['Parts'].append(s3_key)
+                result['TotalRows'] += len(part_rows)
+                upload_future = upload_executor.submit(self.__upload_part, s3_key, body)
+                upload_future.add_done_callback(lambda _: in_flight.release())
+                # Import of the part starts as soon as it is uploaded, while the next parts are still uploading
+                job_futures.append(self.__then(upload_future, self.__start_import, job_executor))
+
+            assert result['Parts'], 'No rows found to import'
+
+            job_responses = [future.result() for future in job_futures]
+
+        segment_response = self.__start_import(f'{s3_prefix}/', segment_name=segment_name,
+                                               segment_id=segment_id).result()
+        result['SegmentId'] = segment_response['Definition']['SegmentId']
+        result['SegmentJobId'] = segment_response['Id']
+        result['JobIds'] = [response['Id'] for response in job_responses]
+        result.update(self.__combined_job_stats(job_responses))
+        if segment_response['JobStatus'] != 'COMPLETED':
+            result['JobStatus'] = segment_response['JobStatus']
+        return result
+
+
+    def __clear_folder(self,
+                       s3_prefix):
+        """
+        Private method. Deletes the files left in the folder of the parts, eg by an import with more parts
+        """
+        stale_keys = [s3_file['Key'] for s3_file in self.s3_obj.list_files(f'{s3_prefix}/')]
+        failed = [s3_key for s3_key, status in self.s3_obj.delete_files(stale_keys).items() if not status['Deleted']]
+        if failed:
+            raise Exception(f'Custom Exception --\nUnable to delete {len(failed)} old files in {s3_prefix}, '
+                            f'eg {failed[0]}')
+
+
+    def __then(self,
+               future,
+               function,
+               executor):
+        """
+        Private method. Returns a Future of function(result of future), which is run on executor once
+        future is done. If function returns a Future, the returned Future completes with it.
+        """
+        chained = Future()
+
+        def resolve(done):
+            if done.exception() is not None:
+                chained.set_exception(done.exception())
+            elif isinstance(done.result(), Future):
+                done.result().add_done_callback(resolve)
+            else:
+                chained.set_result(done.result())
+
+        def run(done):
+            if done.exception() is not None:
+                chained.set_exception(done.exception())
+            else:
+                executor.submit(function, done.result()).add_done_callback(resolve)
+
+        future.add_done_callback(run)
+        return chained
+
+
+    def __to_csv_bytes(self,
+                       csv_file_fields,
+                       part_rows):
+        """
+        Private method. Returns the CSV file of the part, including the header row
+        """
+        csv_file = io.StringIO()
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(csv_file_fields)
+        csv_writer.writerows(part_rows)
+        return csv_file.getvalue().encode('utf-8')
+
+
+    def __upload_part(self,
+                      s3_key,
+                      body):
+        self.s3_obj.s3_client.put_object(Bucket=self.s3_obj.bucket_name,
+                                         Key=s3_key,
+                                         Body=body)
+        return s3_key
+
+
+    def __create_import_job(self,
+                            s3_key,
+                            segment_name=None,
+                            segment_id=None):
+        """
+        Private method. Without segment_name and segment_id, the job only writes the endpoints of s3_key.
+        Else the job defines the segment from s3_key, without writing the endpoints again.
+        """
+        import_job_request = {
+            'DefineSegment': False,
+            'Format': 'CSV',
+            'RegisterEndpoints': True,
+            'RoleArn': self.pinpoint_acc_arn,
+            'S3Url': f's3://{self.s3_obj.bucket_name}/{s3_key}'
+        }
+        if segment_id or segment_name:
+            import_job_request['DefineSegment'] = True
+            import_job_request['RegisterEndpoints'] = False
+            if segment_id:
+                import_job_request['SegmentId'] = segment_id
+            else:
+                import_job_request['SegmentName'] = segment_name
+
+        response = self.client.create_import_job(
+            ApplicationId=self.application_id,
+            ImportJobRequest=import_job_request
+        )
+        return response['ImportJobResponse']['Id']
+
+
+    def __start_import(self,
+                       s3_key,
+                       segment_name=None,
+                       segment_id=None):
+        """
+        Private method. Creates the import job of the part, returns the JobWaiter future of the job
+        """
+        job_id = self.__create_import_job(s3_key, segment_name=segment_name, segment_id=segment_id)
+        return self.job_waiter.add(self.application_id, job_id, timeout=self.job_timeout)
+
+
+    def __combined_job_stats(self,
+                             job_responses):
+        """
+        Private method. Sums up the counters of all the import jobs
+        """
+        stats = {'TotalProcessed': 0, 'TotalFailures': 0, 'FailedPieces': 0, 'JobStatus': 'COMPLETED'}
+        for response in job_responses:
+            for counter in ('TotalProcessed', 'TotalFailures', 'FailedPieces'):
+                stats[counter] += response.get(counter, 0)
+            if response['JobStatus'] != 'COMPLETED':
+                stats['JobStatus'] = response['JobStatus']
+        return stats
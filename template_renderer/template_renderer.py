@@ -0,0 +1,167 @@
+"""
+Local renderer of pinpoint message templates. A template such as 'Hi {{Attributes.Name}}'
+is compiled once into a format string, and is then rendered for rows of endpoint data
+without any API call, falling back to DefaultSubstitutions for empty values.
+"""
+
+import json
+import re
+
+
+VARIABLE_PATTERN = re.compile(r'\{\{\s*([A-Za-z0-9_.\-]+)\s*\}\}')
+
+
+def flatten_substitutions(default_substitutions):
+    """
+    Returns DefaultSubstitutions as {'Attributes.Name': 'value'}. default_substitutions can be the
+    JSON string of a template, or a dictionary with dotted keys, nested keys, or both.
+    """
+    if not default_substitutions:
+        return {}
+    if isinstance(default_substitutions, str):
+        default_substitutions = json.loads(default_substitutions)
+
+    flat = {}
+    pending = [('', default_substitutions)]
+    while pending:
+        prefix, substitutions = pending.pop()
+        for key, value in substitutions.items():
+            if isinstance(value, dict):
+                pending.append((f'{prefix}{key}.', value))
+            else:
+                flat[f'{prefix}{key}'] = value[0] if isinstance(value, list) and value else value
+    return flat
+
+
+class CompiledTemplate:
+    """
+    Usage:
+        template = CompiledTemplate('Hi {{Attributes.Name}}', {'Attributes.Name': 'there'})
+        template.render({'Attributes.Name': 'Sam'})                       --> 'Hi Sam'
+        list(template.render_rows(['Address', 'Attributes.Name'], rows))   --> ['Hi Sam', 'Hi there']
+    """
+
+
+    def __init__(self,
+                 text,
+                 default_substitutions=None):
+        """
+        param: text:                  Template text, with variables written as {{Attributes.Name}}
+
+        param: default_substitutions: DefaultSubstitutions of the template, used for variables
+                                      which are missing (None) in the data. Falsy values like 0
+                                      or '' are rendered as they are.
+        """
+        self.text = text or ''
+        self.default_substitutions = flatten_substitutions(default_substitutions)
+        self.variables = []
+
+        parts = []
+        position = 0
+        for match in VARIABLE_PATTERN.finditer(self.text):
+            parts.append(self.text[position:match.start()].replace('{', '{{').replace('}', '}}'))
+            parts.append('{%d}' % len(self.variables))
+            self.variables.append(match.group(1))
+            position = match.end()
+        parts.append(self.text[position:].replace('{', '{{').replace('}', '}}'))
+        self._format = ''.join(parts).format
+        self._defaults = [str(self.default_substitutions.get(variable, '')) for variable in self.variables]
+
+
+    def render(self,
+               values):
+        """
+        Renders the template for one endpoint
+
+        param: values: Dictionary of variable name to value, eg {'Attributes.Name': 'Sam'}
+        """
+        return self._format(*[default if values.get(variable) is None else values[variable]
+                              for variable, default in zip(self.variables, self._defaults)])
+
+
+    def row_renderer(self,
+                     fields):
+        """
+        Returns a function rendering the template for one row. Positions of the variables in
+        fields are found once, so each row only costs one format call.
+
+        param: fields: Column names of the rows, eg ['ChannelType', 'Address', 'Attributes.Name']
+        """
+        positions = {field: index for index, field in enumerate(fields)}
+        lookups = [(positions.get(variable), default) for variable, default in zip(self.variables, self._defaults)]
+        render = self._format
+        if all(index is not None for index, _ in lookups):
+            return lambda row: render(*[default if row[index] is None else row[index] for index, default in lookups])
+        return lambda row: render(*[default if index is None or row[index] is None else row[index]
+                                    for index, default in lookups])
+
+
+    def render_rows(self,
+                    fields,
+                    rows):
+        """
+        Lazily renders the template for every row
+
+        param: rows: Iterable of lists in the order of fields
+        """
+        return map(self.row_renderer(fields), rows)
+
+
+class MessageRenderer:
+    """
+    Renders the parts of a message (eg body and title) for rows of endpoint data, giving the
+    per address overrides of send_messages.
+
+    Usage:
+        renderer = MessageRenderer(body='Hi {{Attributes.Name}}', title='Offer for {{Attributes.City}}')
+        recipients = renderer.recipients(csv_file_fields, rows)
+        --> {'Address': 'a@b.com', 'BodyOverride': 'Hi Sam', 'TitleOverride': 'Offer for Pune'}, ...
+    """
+
+    OVERRIDES = {'body': 'BodyOverride', 'title': 'TitleOverride'}
+
+
+    def __init__(self,
+                 body=None,
+                 title=None,
+                 default_substitutions=None):
+        """
+        param: body:                  Template of the body, eg 'Hi {{Attributes.Name}}'
+
+        param: title:                 Template of the title / subject of email
+
+        param: default_substitutions: DefaultSubstitutions, used for missing (None) values
+        """
+        assert body or title, 'Provide at least one of body or title template'
+        templates = {'body': body, 'title': title}
+        self.templates = {part: CompiledTemplate(text, default_substitutions)
+                          for part, text in templates.items() if text}
+
+
+    def render_rows(self,
+                    fields,
+                    rows):
+        """
+        Lazily yields {'body': ..., 'title': ...} for every row. Useful for previews.
+        """
+        renderers = [(part, template.row_renderer(fields)) for part, template in self.templates.items()]
+        for row in rows:
+            yield {part: render(row) for part, render in renderers}
+
+
+    def recipients(self,
+                   fields,
+                   rows,
+                   address_field='Address'):
+        """
+        Lazily yields the recipients of BulkSender.send with the rendered overrides of every row
+
+        param: address_field: Column holding the address
+        """
+        address_index = list(fields).index(address_field)
+        renderers = [(self.OVERRIDES[part], template.row_renderer(fields)) for part, template in self.templates.items()]
+        for row in rows:
+            recipient = {'Address': row[address_index]}
+            for override, render in renderers:
+                recipient[override] = render(row)
+            yield recipient
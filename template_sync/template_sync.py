@@ -0,0 +1,240 @@
+# For more help and to understand the return structure go to
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/pinpoint.html
+
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from ..ttl_cache.ttl_cache import TTLCache
+
+
+TEMPLATE_OPERATIONS = {
+    'EMAIL': ('create_email_template', 'update_email_template', 'EmailTemplateRequest'),
+    'SMS': ('create_sms_template', 'update_sms_template', 'SMSTemplateRequest'),
+}
+
+HASH_PATTERN = re.compile(r'\s*\[content-hash:([0-9a-f]+)\]$')
+
+
+def content_hash(template_request):
+    """
+    Returns the hash of the content of a template request. Keys are sorted, so the order in
+    which fields are written does not change the hash. tags are left out, as they can not be
+    changed by an update.
+    """
+    template_request = {key: value for key, value in template_request.items() if key != 'tags'}
+    content = json.dumps(template_request, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def load_template_directory(path):
+    """
+    Reads templates from a directory laid out as
+        path/email/<template name>.json   --> EmailTemplateRequest
+        path/sms/<template name>.json     --> SMSTemplateRequest
+    and returns them as {'EMAIL': {template name: request}, 'SMS': {...}}
+    """
+    templates = {}
+    for template_type in TEMPLATE_OPERATIONS:
+        folder = os.path.join(path, template_type.lower())
+        if not os.path.isdir(folder):
+            continue
+        for file_name in sorted(os.listdir(folder)):
+            if not file_name.endswith('.json'):
+                continue
+            with open(os.path.join(folder, file_name)) as template_file:
+                templates.setdefault(template_type, {})[file_name[:-len('.json')]] = json.load(template_file)
+    return templates
+
+
+class TemplateSync:
+    """
+    Creates or updates message templates, skipping the templates whose content has not changed.
+    The content hash of a template is kept at the end of its TemplateDescription, so the hashes
+    of the deployed templates are read back from list_templates and list_template_versions,
+    and are cached between syncs.
+
+    Usage:
+        template_sync = TemplateSync(client_for_pinpoint)
+        result = template_sync.sync('templates/')
+        result['Created'] --> [('EMAIL', 'welcome_en'), ...]
+    """
+
+
+    def __init__(self,
+                 client_for_pinpoint,
+                 max_workers=16,
+                 page_size=100,
+                 cache_ttl=300):
+        """
+        param: max_workers: Maximum number of templates read or written at once
+
+        param: page_size:   Number of items fetched in one list_templates / list_template_versions call
+
+        param: cache_ttl:   In seconds, time for which the deployed hashes are reused without listing them again
+        """
+        self.client = client_for_pinpoint
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.cache = TTLCache(ttl=cache_ttl, max_size=100000)
+
+
+    def __pages(self,
+                operation,
+                response_key,
+                **request):
+        """
+        Private method. Yields the items of every page of a paginated list call
+        """
+        next_token = None
+        while True:
+            if next_token:
+                request['NextToken'] = next_token
+            response = getattr(self.client, operation)(PageSize=str(self.page_size), **request)[response_key]
+            yield from response.get('Item', [])
+            next_token = response.get('NextToken')
+            if not next_token:
+                break
+
+
+    def template_names(self,
+                       template_type):
+        """
+        Returns the names of the deployed templates of the type, 'EMAIL' | 'SMS'
+        """
+        return self.cache.get_or_set(
+            ('NAMES', template_type),
+            lambda: {item['TemplateName'] for item in
+                     self.__pages('list_templates', 'TemplatesResponse', TemplateType=template_type)}
+        )
+
+
+    def deployed_hash(self,
+                      template_type,
+                      template_name):
+        """
+        Returns the content hash of the latest version of a deployed template. None if the
+        template does not exist or was not created by sync.
+        """
+        if template_name not in self.template_names(template_type):
+            return None
+
+        def latest_hash():
+            versions = list(self.__pages('list_template_versions', 'TemplateVersionsResponse',
+                                         TemplateName=template_name, TemplateType=template_type))
+            if not versions:
+                return None
+            latest = max(versions, key=lambda version: int(version.get('Version') or 0))
+            match = HASH_PATTERN.search(latest.get('TemplateDescription') or '')
+            return match.group(1) if match else None
+
+        return self.cache.get_or_set(('HASH', template_type, template_name), latest_hash)
+
+
+    def plan(self,
+             templates):
+        """
+        Compares templates with the deployed ones, without changing anything. Returns
+        {'Create': [(type, name)], 'Update': [(type, name)], 'Unchanged': [(type, name)]}
+
+        param: templates: Directory path (see load_template_directory) or {'EMAIL': {name: request}, 'SMS': {...}}
+        """
+        return self.__plan(self.__requests(templates))[0]
+
+
+    def sync(self,
+             templates,
+             dry_run=False):
+        """
+        Creates the new templates and updates the changed ones in parallel, updates create a new
+        version. Returns
+        {
+            'Created': [(type, name)],
+            'Updated': [(type, name)],
+            'Unchanged': [(type, name)],
+            'Failed': {(type, name): exception}
+        }
+
+        param: templates: Directory path (see load_template_directory) or {'EMAIL': {name: request}, 'SMS': {...}}
+
+        param: dry_run:   True | False, if true only the plan is returned
+        """
+        requests = self.__requests(templates)
+        plan, hashes = self.__plan(requests)
+        if dry_run:
+            return plan
+
+        result = {'Created': [], 'Updated': [], 'Unchanged': plan['Unchanged'], 'Failed': {}}
+        writes = [(key, 'Created') for key in plan['Create']] + [(key, 'Updated') for key in plan['Update']]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.__write, key, requests[key], hashes[key], outcome == 'Updated'):
+                       (key, outcome) for key, outcome in writes}
+        for future, (key, outcome) in futures.items():
+            try:
+                future.result()
+                result[outcome].append(key)
+            except Exception as ex:
+                result['Failed'][key] = ex
+        return result
+
+
+    def __requests(self,
+                   templates):
+        """
+        Private method. Returns {(type, name): request} of a directory path or mapping of templates
+        """
+        if isinstance(templates, str):
+            templates = load_template_directory(templates)
+        requests = {}
+        for template_type, named_requests in templates.items():
+            assert template_type in TEMPLATE_OPERATIONS, f'Template type should be one of {list(TEMPLATE_OPERATIONS)}'
+            for template_name, request in named_requests.items():
+                requests[(template_type, template_name)] = request
+        return requests
+
+
+    def __plan(self,
+               requests):
+        """
+        Private method. Returns the plan, and the content hash of every request
+        """
+        hashes = {key: content_hash(request) for key, request in requests.items()}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self.template_names, {template_type for template_type, _ in requests}))
+            deployed = dict(zip(requests, executor.map(lambda key: self.deployed_hash(*key), requests)))
+
+        plan = {'Create': [], 'Update': [], 'Unchanged': []}
+        for (template_type, template_name), request_hash in hashes.items():
+            if template_name not in self.template_names(template_type):
+                plan['Create'].append((template_type, template_name))
+            elif deployed[(template_type, template_name)] != request_hash:
+                plan['Update'].append((template_type, template_name))
+            else:
+                plan['Unchanged'].append((template_type, template_name))
+        return plan, hashes
+
+
+    def __write(self,
+                key,
+                request,
+                request_hash,
+                update):
+        """
+        Private method. Creates or updates one template, storing its content hash in the description
+        """
+        template_type, template_name = key
+        create_operation, update_operation, request_name = TEMPLATE_OPERATIONS[template_type]
+        description = HASH_PATTERN.sub('', request.get('TemplateDescription', ''))
+        request = dict(request, TemplateDescription=f'{description} [content-hash:{request_hash}]'.lstrip())
+
+        if update:
+            request.pop('tags', None)
+            getattr(self.client, update_operation)(**{request_name: request},
+                                                   TemplateName=template_name,
+                                                   CreateNewVersion=True)
+        else:
+            getattr(self.client, create_operation)(**{request_name: request}, TemplateName=template_name)
+            self.template_names(template_type).add(template_name)
+        self.cache.set(('HASH', template_type, template_name), request_hash)
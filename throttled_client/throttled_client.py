@@ -0,0 +1,315 @@
+"""
+Client wrapper which paces every call made to an AWS service, using one adaptive
+token bucket per operation.
+"""
+
+import threading
+import time
+import weakref
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate is adjusted with AIMD: the rate grows additively
+    while calls succeed, and is cut multiplicatively when a call is throttled.
+    """
+
+
+    def __init__(self,
+                 rate,
+                 min_rate,
+                 max_rate,
+                 burst=None):
+        """
+        param: rate:     Initial number of calls allowed per second
+
+        param: burst:    Maximum number of tokens that can pile up, defaults to one second of calls
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self._tokens = self.__capacity()
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def __capacity(self):
+        return self.burst if self.burst else max(1.0, self.rate)
+
+
+    def acquire(self):
+        """
+        Takes a token, sleeping till one is available. Tokens are reserved in order,
+        so waiting callers are spread evenly over time instead of waking together.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.__capacity(), self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait_for = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_for:
+            time.sleep(wait_for)
+
+
+    def on_success(self,
+                   additive_increase):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + additive_increase)
+
+
+    def on_throttle(self,
+                    multiplicative_decrease):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * multiplicative_decrease)
+            self._tokens = min(self._tokens, 0)
+
+
+class _ThrottleListener:
+    """
+    The needs-retry handler and the token buckets of one boto3 client. Registered once per client
+    however many ThrottledClients wrap it, so wrappers sharing a client of client_factory pace their
+    calls together. Wrappers are held through weak references, the shared client does not keep them
+    (or the builders owning them) alive.
+    """
+
+
+    def __init__(self,
+                 client):
+        self.operation_names = {api_name: operation_name for operation_name, api_name
+                                in client.meta.method_to_api_mapping.items()}
+        self.owners = weakref.WeakSet()
+        self.buckets = {}
+        self._lock = threading.Lock()
+        client.meta.events.register('needs-retry.*.*', self._needs_retry, unique_id='throttled-client')
+
+
+    def bucket(self,
+               operation_name,
+               create_bucket):
+        bucket = self.buckets.get(operation_name)
+        if bucket is None:
+            with self._lock:
+                bucket = self.buckets.get(operation_name)
+                if bucket is None:
+                    bucket = self.buckets[operation_name] = create_bucket()
+        return bucket
+
+
+    def _needs_retry(self, event_name, response=None, **kwargs):
+        if response is None or not response[1]:
+            return None
+        if response[1].get('Error', {}).get('Code') in ThrottledClient.THROTTLING_ERRORS:
+            operation_name = self.operation_names.get(event_name.split('.', 2)[2])
+            owners = list(self.owners)
+            if operation_name and owners:
+                # The bucket is shared, it is cut once by the first wrapper, the others only count the throttle
+                owners[0]._on_throttle(operation_name)
+                for owner in owners[1:]:
+                    owner._on_throttle(None)
+        # Returning None leaves the retry decision to the retry handler of botocore
+        return None
+
+
+_throttle_listeners = weakref.WeakKeyDictionary()
+_throttle_listeners_lock = threading.Lock()
+
+
+def _throttle_listener(client):
+    """
+    Returns the listener of client, registering it on the first call
+    """
+    with _throttle_listeners_lock:
+        listener = _throttle_listeners.get(client)
+        if listener is None:
+            listener = _throttle_listeners[client] = _ThrottleListener(client)
+        return listener
+
+
+class ThrottledClient:
+    """
+    Wraps a boto3 client. Every API call, and every page of a paginator, waits for a token
+    from the bucket of its operation, and the rate of the operation adapts to stay just under
+    the account quota. Retries are left to botocore (see retries of client_factory.configure):
+    the wrapper listens to the needs-retry event of the client, so the rate is cut on every
+    throttled attempt, including the ones botocore retries. Attributes which are not API calls
+    (meta, exceptions, get_waiter ...) are returned from the client as they are.
+
+    Wrappers of the same client (eg the shared clients of client_factory) share the token buckets and
+    the throttle listener of the client, the rates of the first wrapper making a call to an operation
+    are used for its bucket.
+
+    Default rates are conservative, sized for the control plane operations of pinpoint (get_*,
+    create_segment, create_campaign ...). Raise them for data plane operations with operation_rates
+    and operation_max_rates, eg {'send_messages': 100} and {'send_messages': 1000}.
+
+    Usage:
+        client = ThrottledClient(boto3.client('pinpoint'), operation_rates={'send_messages': 50})
+        client.get_apps()
+    """
+
+    THROTTLING_ERRORS = ('TooManyRequestsException', 'ThrottlingException', 'Throttling',
+                         'RequestLimitExceeded', 'SlowDown')
+    PASSTHROUGH_ATTRIBUTES = ('meta', 'exceptions', 'can_paginate', 'get_waiter', 'close')
+
+
+    def __init__(self,
+                 client=None,
+                 initial_rate=10,
+                 min_rate=0.5,
+                 max_rate=100,
+                 additive_increase=1,
+                 multiplicative_decrease=0.5,
+                 operation_rates=None,
+                 operation_max_rates=None,
+                 create_client=None):
+        """
+        param: client:                  boto3 client to be wrapped
+
+        param: initial_rate:            Calls per second an operation starts with, if it is not in operation_rates
+
+        param: min_rate / max_rate:     Limits of the calls per second of an operation. max_rate applies to the
+                                        operations which are not in operation_max_rates, set it to the quota of
+                                        your account.
+
+        param: additive_increase:       Calls per second added to the rate after every successful call
+
+        param: multiplicative_decrease: Factor by which rate is multiplied after a throttled attempt
+
+        param: operation_rates:         Dictionary of operation name to initial rate, eg {'send_messages': 50}
+
+        param: operation_max_rates:     Dictionary of operation name to max rate, eg {'send_messages': 1000}
+
+        param: create_client:           Callable returning the boto3 client, used instead of client to create
+                                        the client only when the first call is made
+        """
+        assert client or create_client, 'Please provide either client or create_client'
+        self._client = None
+        self._create_client = create_client
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.operation_rates = operation_rates if operation_rates else {}
+        self.operation_max_rates = operation_max_rates if operation_max_rates else {}
+        self.throttle_count = 0
+        self._buckets = {}
+        self._listener = None
+        self._lock = threading.Lock()
+        if client is not None:
+            self.__set_client(client)
+
+
+    @property
+    def client(self):
+        """
+        The wrapped boto3 client
+        """
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self.__set_client(self._create_client())
+        return self._client
+
+
+    def __set_client(self,
+                     client):
+        """
+        Private method. Joins the throttle listener of the client, clients without event hooks
+        (eg fakes) report throttles only through the exceptions of the calls
+        """
+        if getattr(getattr(client, 'meta', None), 'events', None) is not None:
+            self._listener = _throttle_listener(client)
+            self._listener.owners.add(self)
+        self._client = client
+
+
+    def _on_throttle(self,
+                     operation_name):
+        """
+        Counts a throttled attempt, and cuts the rate of the bucket of operation_name if it is given
+        """
+        with self._lock:
+            self.throttle_count += 1
+        if operation_name:
+            self.bucket(operation_name).on_throttle(self.multiplicative_decrease)
+
+
+    def __create_bucket(self,
+                        operation_name):
+        return TokenBucket(
+            self.operation_rates.get(operation_name, self.initial_rate),
+            self.min_rate,
+            self.operation_max_rates.get(operation_name, self.max_rate)
+        )
+
+
+    def bucket(self,
+               operation_name):
+        """
+        Returns the token bucket of the operation, creating it on first use
+        """
+        if self._listener is not None:
+            return self._listener.bucket(operation_name, lambda: self.__create_bucket(operation_name))
+        bucket = self._buckets.get(operation_name)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(operation_name, self.__create_bucket(operation_name))
+        return bucket
+
+
+    def current_rates(self):
+        """
+        Returns the current calls per second of every operation used so far
+        """
+        buckets = self._listener.buckets if self._listener is not None else self._buckets
+        return {operation_name: bucket.rate for operation_name, bucket in list(buckets.items())}
+
+
+    def get_paginator(self,
+                      operation_name):
+        """
+        Returns the paginator of the client, with every page call paced by the bucket of the operation
+        """
+        paginator = self.client.get_paginator(operation_name)
+        # Pages are fetched by calling paginator._method, the bound method of the client
+        paginator._method = getattr(self, operation_name)
+        return paginator
+
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if name in self.PASSTHROUGH_ATTRIBUTES or not callable(attribute):
+            return attribute
+
+        def throttled_call(*args, **kwargs):
+            return self.__call(name, attribute, *args, **kwargs)
+
+        throttled_call.__name__ = name
+        throttled_call.__doc__ = attribute.__doc__
+        return throttled_call
+
+
+    def __call(self,
+               operation_name,
+               method,
+               *args,
+               **kwargs):
+        """
+        Private method. Makes the call paced by the bucket of the operation
+        """
+        bucket = self.bucket(operation_name)
+        bucket.acquire()
+        try:
+            response = method(*args, **kwargs)
+        except Exception as ex:
+            error_code = getattr(ex, 'response', {}).get('Error', {}).get('Code')
+            if error_code in self.THROTTLING_ERRORS and self._listener is None:
+                self._on_throttle(operation_name)
+            raise
+        bucket.on_success(self.additive_increase)
+        return response
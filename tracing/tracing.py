@@ -0,0 +1,246 @@
+"""
+Lightweight tracing of the phases of a campaign build. Every phase runs in a timed span
+carrying attributes such as row count, bytes, job id and segment id. Finished spans are
+handed to pluggable exporters, eg ChromeTraceExporter which writes a trace file that can
+be opened as a flame graph in chrome://tracing, Perfetto or speedscope.
+
+Usage:
+    exporter = ChromeTraceExporter('/tmp/campaign_trace.json')
+    tracer = Tracer(exporters=[exporter])
+    with tracer.span('create_csv', rows=1000) as span:
+        ...
+        span.set_attribute('bytes', 123456)
+    exporter.write()
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+
+
+class Span:
+    """
+    One timed phase. start and end are time.perf_counter values, start_timestamp is the epoch time.
+    """
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'thread_id', 'start', 'end', 'start_timestamp',
+                 'attributes', 'error')
+
+
+    def __init__(self,
+                 name,
+                 span_id,
+                 parent_id=None,
+                 attributes=None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.thread_id = threading.get_ident()
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+        self.start_timestamp = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+    def set_attribute(self,
+                      key,
+                      value):
+        self.attributes[key] = value
+
+
+    def set_attributes(self,
+                       **attributes):
+        self.attributes.update(attributes)
+
+
+    def to_dict(self):
+        return {
+            'Name': self.name,
+            'SpanId': self.span_id,
+            'ParentId': self.parent_id,
+            'ThreadId': self.thread_id,
+            'StartTimestamp': self.start_timestamp,
+            'Duration': self.duration,
+            'Attributes': self.attributes,
+            'Error': self.error
+        }
+
+
+class Tracer:
+    """
+    Creates spans and hands the finished ones to the exporters. Spans opened in a thread
+    while another span of the same thread is open become its children.
+    """
+
+
+    def __init__(self,
+                 exporters=None):
+        """
+        param: exporters: Objects with an export(span) method, called with every finished span
+        """
+        self.exporters = list(exporters) if exporters else []
+        self._span_ids = count(1)
+        self._local = threading.local()
+
+
+    def add_exporter(self,
+                     exporter):
+        self.exporters.append(exporter)
+
+
+    def __stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+
+    @contextmanager
+    def span(self,
+             name,
+             **attributes):
+        """
+        Context manager running the block in a span. Yields the span, so that attributes known
+        only at the end of the phase can be set.
+        """
+        stack = self.__stack()
+        span = Span(name, next(self._span_ids), stack[-1].span_id if stack else None, attributes)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as ex:
+            span.error = f'{type(ex).__name__}: {ex}'
+            raise
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+            for exporter in self.exporters:
+                exporter.export(span)
+
+
+    def current_span(self):
+        """
+        Returns the innermost open span of the calling thread, None if there is none
+        """
+        stack = self.__stack()
+        return stack[-1] if stack else None
+
+
+    def set_attributes(self,
+                       **attributes):
+        """
+        Sets attributes on the innermost open span of the calling thread, if any
+        """
+        span = self.current_span()
+        if span is not None:
+            span.attributes.update(attributes)
+
+
+def traced(name=None):
+    """
+    Decorator running a method of an object having a tracer attribute in a span
+    named after the method
+    """
+    def decorator(method):
+        span_name = name if name else method.__name__
+
+        @wraps(method)
+        def traced_method(self, *args, **kwargs):
+            with self.tracer.span(span_name):
+                return method(self, *args, **kwargs)
+        return traced_method
+    return decorator
+
+
+class InMemoryExporter:
+    """
+    Keeps finished spans in a list, eg for tests or for printing a summary
+    """
+
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+
+    def export(self,
+               span):
+        with self._lock:
+            self.spans.append(span)
+
+
+    def summary(self):
+        """
+        Returns {span name: {'Count': int, 'TotalSeconds': float}}, slowest phases first
+        """
+        summary = {}
+        with self._lock:
+            for span in self.spans:
+                phase = summary.setdefault(span.name, {'Count': 0, 'TotalSeconds': 0.0})
+                phase['Count'] += 1
+                phase['TotalSeconds'] += span.duration
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['TotalSeconds']))
+
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class ChromeTraceExporter:
+    """
+    Collects spans as complete events of the Chrome trace event format, and writes them
+    to file_name. Nested spans of a thread show up as a flame graph.
+    """
+
+
+    def __init__(self,
+                 file_name='/tmp/pinpoint_campaign_trace.json'):
+        self.file_name = file_name
+        self.events = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+
+    def export(self,
+               span):
+        args = {key: value if isinstance(value, (int, float, str, bool)) or value is None else str(value)
+                for key, value in span.attributes.items()}
+        if span.error:
+            args['error'] = span.error
+        event = {
+            'name': span.name,
+            'cat': 'pinpoint_campaign_builder',
+            'ph': 'X',
+            'ts': round(span.start * 1e6, 3),
+            'dur': round(span.duration * 1e6, 3),
+            'pid': self._pid,
+            'tid': span.thread_id,
+            'args': args
+        }
+        with self._lock:
+            self.events.append(event)
+
+
+    def write(self,
+              file_name=None):
+        """
+        Writes all the spans exported so far, returns the path of the file
+        """
+        file_name = file_name if file_name else self.file_name
+        with self._lock:
+            trace = {'traceEvents': sorted(self.events, key=lambda event: event['ts']),
+                     'displayTimeUnit': 'ms'}
+        with open(file_name, 'w') as trace_file:
+            json.dump(trace, trace_file)
+        return file_name
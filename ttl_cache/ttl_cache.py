@@ -0,0 +1,103 @@
+"""
+Thread safe in-memory cache, where entries expire after a TTL and the least
+recently used entry is evicted once the cache is full.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+
+    _MISSING = object()
+
+
+    def __init__(self,
+                 ttl=60,
+                 max_size=1024):
+        """
+        param: ttl:      In seconds, time after which an entry expires. None means entries never expire.
+
+        param: max_size: Maximum number of entries, least recently used entry is evicted after it.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self,
+            key,
+            default=None):
+        """
+        Returns the value of key, or default if it is not present or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is self._MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+
+    def set(self,
+            key,
+            value,
+            ttl=None):
+        """
+        Stores value for key. ttl overrides the ttl of the cache for this entry.
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+    def get_or_set(self,
+                   key,
+                   create_value,
+                   ttl=None):
+        """
+        Returns the value of key, calling create_value() and storing its result if key is missing
+        """
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            value = create_value()
+            self.set(key, value, ttl=ttl)
+        return value
+
+
+    def invalidate(self,
+                   key=None,
+                   predicate=None):
+        """
+        Removes key, or all the keys for which predicate(key) is true. Clears the whole cache
+        if neither is given. Returns the number of removed entries.
+        """
+        with self._lock:
+            if key is not None:
+                return 1 if self._entries.pop(key, self._MISSING) is not self._MISSING else 0
+            if predicate is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            keys = [cached_key for cached_key in self._entries if predicate(cached_key)]
+            for cached_key in keys:
+                del self._entries[cached_key]
+            return len(keys)
+
+
+    def __contains__(self, key):
+        return self.get(key, self._MISSING) is not self._MISSING
+
+
+    def __len__(self):
+        return len(self._entries)